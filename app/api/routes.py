@@ -1,11 +1,38 @@
 # app/api/routes.py
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form, WebSocket, WebSocketDisconnect
-from app.schemas.task import TaskStatus # Твоя Pydantic схема
-from app.db.database import database, task_table # Для создания задачи
-from app.celery.celery import app as celery_app_instance # Экземпляр Celery из celery.py
-import tempfile
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Header, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse
+from app.schemas.task import (TaskStatus, TaskEta, TaskStatusBulkRequest, TaskBatch, TaskBatchItem,
+                              TaskBatchItemOptions) # Твоя Pydantic схема
+from app.db.database import FINAL_TASK_STATUSES, database, task_table # Для создания задачи
+from app.core.config import settings
 import logging
-from app.services.bruteforce import get_task_status # Функция для GET /status
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from pydantic import TypeAdapter, ValidationError
+from app.services.bruteforce import get_task_status, get_task_statuses, cancel_paused_task, resume_paused_task, get_live_progress # Функция для GET /status
+from app.services.dispatch import dispatch_bruteforce, dispatch_bruteforce_batch, resume_paused_shards # Отправка задачи (или ее шардов) в Celery
+from app.services.control import CONTROL_COMMANDS, control_key # Команды pause/resume/cancel
+from app.services.wordlist import parse_rules, resolve_wordlist, save_uploaded_wordlist # Атака по словарю
+from app.services.keyspace import parse_mask, CUSTOM_CHARSET_KEYS # Атака по маске
+from app.services.markov import ORDERING_MODES, train_model_file # Порядок перебора по вероятности
+from app.services.dedupe import (find_cached_password, find_cached_passwords, job_fingerprint, attach_to_running_job, register_job,
+                                 get_primary_task, detach_follower, get_followers, release_job_async,
+                                 clear_followers_async) # Кэш результатов и дедупликация задач
+from app.services.estimator import (estimate_space, estimate_job, save_estimate, load_estimate, eta_seconds,
+                                   estimate_key, required_shards, ESTIMATE_KEY_TTL) # Оценка длительности
+from app.services.admission import (queue_saturated, free_slots, defer_task, defer_tasks,
+                                   DEFERRED_QUEUE_KEY) # Допуск задач в очередь
+from app.services.scheduling import route_for, routes_for, acquire_share, acquire_shares, release_share_async, owner_key # Очереди и fair share
+from app.services.archive_store import receive_upload, receive_bundle, commit_upload, discard_upload # Хранилище архивов по sha256
+from app.services.status_cache import cache_task_status_async # Кэш статусов задач
+from app.services.metrics import queue_depths, render_metrics # /metrics
+from app.services.profiling import request_profiling # Профилирование задачи по запросу
+from app.services.rar_tools import analyze_archive, ArchiveRejected, plan_cache_key, PLAN_CACHE_TTL
+from fastapi.concurrency import run_in_threadpool
+import os
+import json
+import time
+import redis # Исключения клиента Redis
+from sqlalchemy import select, func
 from app.websocket.manager import ws_manager # Твой WebSocketManager
 
 logger = logging.getLogger(__name__)
@@ -13,74 +40,591 @@ router = APIRouter()
 
 @router.post("/brut_hash", response_model=TaskStatus) # Используем TaskStatus для ответа
 async def brut_hash(
+    request: Request,
     charset: str = Form(default="abcdefghijklmnopqrstuvwxyz0123456789"),
     max_length: int = Form(default=5, le=8), # le=8 - максимальная длина 8
-    rar_file: UploadFile = File(...)
+    shards: int = Form(default=settings.BRUTEFORCE_SHARDS, ge=1, le=settings.BRUTEFORCE_MAX_SHARDS), # На сколько воркеров делить перебор
+    local_pool: bool = Form(default=settings.LOCAL_POOL_DEFAULT), # Перебор пулом процессов на всех ядрах воркера
+    wordlist_file: Optional[UploadFile] = File(default=None), # Атака по словарю: загруженный словарь...
+    wordlist_name: Optional[str] = Form(default=None), # ...или имя словаря на сервере (WORDLIST_DIR)
+    rules: str = Form(default=""), # Правила для слов словаря через запятую: case,leet,digits,years
+    mask: Optional[str] = Form(default=None), # Маска в стиле hashcat, например ?u?l?l?l?l?l?d?d
+    custom_charset1: Optional[str] = Form(default=None), # Пользовательские наборы ?1..?4 для маски
+    custom_charset2: Optional[str] = Form(default=None),
+    custom_charset3: Optional[str] = Form(default=None),
+    custom_charset4: Optional[str] = Form(default=None),
+    hybrid_mode: str = Form(default="append"), # Словарь + маска: append (слово+маска) или prepend (маска+слово)
+    ordering: Optional[str] = Form(default=None), # Порядок перебора charset/маски: frequency или markov (сначала вероятные)
+    ordering_corpus_name: Optional[str] = Form(default=None), # Корпус паролей для обучения порядка: словарь на сервере...
+    ordering_corpus_file: Optional[UploadFile] = File(default=None), # ...или загруженный файл
+    rar_file: UploadFile = File(...),
+    profile: bool = Form(default=False), # Профилировать задачу: профили шардов (folded stacks) в PROFILE_DIR воркеров
+    user_id: Optional[str] = Header(default=None, alias="X-User-Id") # Пользователь для fair share (иначе - IP клиента)
 ):
-    logger.info(f"POST /brut_hash: charset='{charset}', max_length={max_length}, file='{rar_file.filename}'")
+    logger.info(f"POST /brut_hash: charset='{charset}', max_length={max_length}, shards={shards}, local_pool={local_pool}, "
+                f"wordlist='{wordlist_name or (wordlist_file.filename if wordlist_file else None)}', rules='{rules}', mask='{mask}', "
+                f"file='{rar_file.filename}'")
+    wordlist_path = None
+    uploaded_wordlist = False
     try:
-        # Сохраняем загруженный файл во временный файл
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".rar") as tmp_rar_file:
-            content = await rar_file.read()
-            tmp_rar_file.write(content)
-            tmp_rar_file_path = tmp_rar_file.name
-        logger.info(f"Файл сохранен во временный путь: {tmp_rar_file_path}")
+        try:
+            rule_names = parse_rules(rules)
+            if wordlist_name:
+                wordlist_path = resolve_wordlist(wordlist_name)
+            elif wordlist_file is not None and wordlist_file.filename:
+                wordlist_path = await run_in_threadpool(save_uploaded_wordlist, wordlist_file.file)
+                uploaded_wordlist = True
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        attack_options = await _attack_options(wordlist_path, rule_names, mask,
+                                               (custom_charset1, custom_charset2, custom_charset3, custom_charset4),
+                                               hybrid_mode, ordering, ordering_corpus_name, ordering_corpus_file)
+
+        # Загрузка пишется на диск потоком, кусками (без чтения в память целиком), sha256 считается по пути
+        upload_path, archive_sha256 = await run_in_threadpool(receive_upload, rar_file.file)
+        logger.info(f"Архив принят: sha256={archive_sha256}")
+
+        # Предварительный анализ архива: не зашифрованные и поврежденные архивы отклоняем сразу,
+        # не занимая воркер и не сохраняя в хранилище. План проверки кэшируется в Redis по sha256 содержимого.
+        try:
+            plan = await run_in_threadpool(analyze_archive, upload_path, archive_sha256)
+        except ArchiveRejected as e:
+            discard_upload(upload_path)
+            if uploaded_wordlist:
+                os.unlink(wordlist_path)
+            logger.warning(f"Архив '{rar_file.filename}' отклонен: {e}")
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception:
+            discard_upload(upload_path)
+            raise
+        logger.info(f"План проверки архива: версия RAR{plan.rar_version}, шифрование заголовков={plan.headers_encrypted}, "
+                    f"режим='{plan.mode}', файл для проверки='{plan.member}'")
+        if ws_manager.redis_client:
+            try:
+                await ws_manager.redis_client.set(plan_cache_key(plan.sha256), plan.to_json(), ex=PLAN_CACHE_TTL)
+            except redis.exceptions.RedisError as e:
+                # Кэш плана - только ускорение: без него воркер проанализирует архив сам
+                logger.error(f"Ошибка сохранения плана проверки {plan.sha256} в Redis: {e}")
+
+        if not database.is_connected: # Убедимся, что БД подключена
+            await database.connect()
+
+        # Пароль этого архива (по sha256 содержимого) уже найден раньше - отвечаем сразу, без перебора
+        cached_password = await find_cached_password(plan.sha256)
+
+        # Допуск в очередь: оценка длительности по размеру пространства и измеренной скорости воркеров
+        estimate = None
+        saturated = False
+        if cached_password is None:
+            keyspace, candidates = await run_in_threadpool(estimate_space, charset, max_length, attack_options)
+            estimate = await estimate_job(ws_manager.redis_client, plan, keyspace, candidates, shards, local_pool)
+            logger.info(f"Оценка задачи: рангов={keyspace}, кандидатов={candidates}, слотов={estimate.slots}, "
+                        f"скорость слота={estimate.cps_per_slot:.1f} ({'измерена' if estimate.measured else 'по умолчанию'}), "
+                        f"время={estimate.seconds:.0f} с")
+            min_shards = required_shards(estimate)
+            rejection = None
+            if estimate.seconds > settings.ADMISSION_MAX_ESTIMATED_SECONDS:
+                rejection = (400, f"Оценка длительности перебора {estimate.seconds:.0f} с больше допустимой "
+                                  f"({settings.ADMISSION_MAX_ESTIMATED_SECONDS:.0f} с): уменьшите набор символов, длину или маску")
+            elif min_shards > settings.BRUTEFORCE_MAX_SHARDS:
+                rejection = (400, f"Перебор не делится на шарды короче {settings.SHARD_MAX_SECONDS:.0f} с "
+                                  f"(нужно {min_shards}, допустимо {settings.BRUTEFORCE_MAX_SHARDS}): уменьшите набор символов, длину или маску")
+            else:
+                saturated = await queue_saturated(ws_manager.redis_client)
+                if saturated and (settings.ADMISSION_SATURATED_POLICY == "reject" or not ws_manager.redis_client):
+                    rejection = (503, "Очередь задач заполнена, повторите позже")
+            if rejection:
+                discard_upload(upload_path)
+                if uploaded_wordlist:
+                    os.unlink(wordlist_path)
+                raise HTTPException(status_code=rejection[0], detail=rejection[1])
+
+        # В задачу и воркеру уходит ссылка на архив в хранилище, а не путь на хосте API
+        rar_ref = await run_in_threadpool(commit_upload, upload_path, archive_sha256)
 
         # Создаем запись о задаче в БД
         # Статус "pending" или "queued", т.к. задача еще не начала выполняться воркером
         insert_query = task_table.insert().values(
-            file_path=tmp_rar_file_path, # Сохраняем путь к файлу
-            charset=charset,
-            max_length=max_length,
-            status="pending", # Начальный статус
-            progress=0,
-            result=None
+            hash=plan.sha256, # sha256 архива - для кэша результатов и дедупликации
+            file_path=rar_ref, # Ссылка на архив в хранилище (sha256:...)
+            charset=None if attack_options else charset, # Для словаря/маски charset/max_length не используются
+            max_length=None if attack_options else max_length,
+            status="pending" if cached_password is None else "completed", # Начальный статус
+            progress=0 if cached_password is None else 100,
+            result=cached_password
         )
-        if not database.is_connected: # Убедимся, что БД подключена
-            await database.connect()
-        
         task_id = await database.execute(insert_query) # Получаем ID созданной задачи
         logger.info(f"Задача создана в БД с ID: {task_id}")
+        if estimate is not None:
+            await save_estimate(ws_manager.redis_client, task_id, estimate)
+
+        if cached_password is not None:
+            logger.info(f"Задача {task_id}: пароль архива {plan.sha256} уже известен, перебор не нужен")
+            _remove_duplicate_upload(wordlist_path if uploaded_wordlist else None)
+            return TaskStatus(task_id=task_id, status="completed", progress=100, result=cached_password)
+
+        # Такая же задача (тот же архив и пространство перебора) уже выполняется - присоединяемся к ней
+        if ws_manager.redis_client:
+            fingerprint = await run_in_threadpool(job_fingerprint, plan.sha256, charset, max_length, attack_options)
+            primary_id = await attach_to_running_job(ws_manager.redis_client, fingerprint, task_id)
+            if primary_id is None and not await register_job(ws_manager.redis_client, fingerprint, task_id):
+                primary_id = await attach_to_running_job(ws_manager.redis_client, fingerprint, task_id)
+            if primary_id is not None:
+                primary = await get_task_status(primary_id, ws_manager.redis_client)
+                status = primary.status if primary else "pending"
+                progress = primary.progress if primary else 0
+                await database.execute(task_table.update().where(task_table.c.id == task_id)
+                                       .values(status=status, progress=progress))
+                await cache_task_status_async(ws_manager.redis_client, [task_id], status, progress)
+                logger.info(f"Задача {task_id} присоединена к выполняющейся задаче {primary_id} (тот же архив и пространство)")
+                _remove_duplicate_upload(wordlist_path if uploaded_wordlist else None)
+                return TaskStatus(task_id=task_id, status=status, progress=progress, result=None,
+                                  eta_seconds=await _task_eta(str(primary_id), status))
+
+        # Очередь - по оценке длительности, приоритет - с учетом уже выполняющихся задач пользователя
+        owner = user_id or (request.client.host if request.client else "anonymous")
+        route = await route_for(ws_manager.redis_client, estimate.seconds, owner)
+        await acquire_share(ws_manager.redis_client, task_id, owner)
+        if profile:
+            await request_profiling(ws_manager.redis_client, [task_id]) # Флаг читают шарды при запуске
+        dispatch_args = {"rar_path": rar_ref, "charset": charset, "max_length": max_length, "shards": shards,
+                         "min_shards": min_shards, "local_pool": local_pool, "attack_options": attack_options, "route": route,
+                         "submitted_at": time.time()}
+        if saturated:
+            # Очередь заполнена - задачу отправит admit_deferred_tasks, когда освободится место
+            await defer_task(ws_manager.redis_client, task_id, dispatch_args)
+            return TaskStatus(task_id=task_id, status="deferred", progress=0, result=None, eta_seconds=None)
 
-        # Отправляем задачу в Celery
+        # Отправляем задачу в Celery (при необходимости - группой шардов)
         # Передаем task_id (int), чтобы воркер знал, какую запись в БД обновлять
-        celery_app_instance.send_task(
-            'app.services.bruteforce.bruteforce_rar_task', # Имя задачи
-            args=[tmp_rar_file_path, charset, max_length, task_id] # Аргументы для задачи
-        )
-        logger.info(f"Задача {task_id} отправлена в Celery")
+        dispatch_bruteforce(task_id, **dispatch_args)
 
         # Возвращаем клиенту информацию о созданной задаче
         return TaskStatus(
             task_id=task_id,
             status="pending", # Или "queued"
             progress=0,
-            result=None
+            result=None,
+            eta_seconds=estimate.seconds
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка в эндпоинте /brut_hash: {e}", exc_info=True)
-        # Здесь можно удалить временный файл, если он был создан, но это опционально
-        # import os
-        # if 'tmp_rar_file_path' in locals() and os.path.exists(tmp_rar_file_path):
-        # os.unlink(tmp_rar_file_path)
+        # Архив из хранилища здесь не удаляем - его уберет сборщик мусора (gc_archive_store)
+        raise HTTPException(status_code=500, detail=f"Внутренняя ошибка сервера: {str(e)}")
+
+
+async def _attack_options(wordlist_path: Optional[str], rule_names: List[str], mask: Optional[str],
+                         custom_charset_values: Sequence[Optional[str]], hybrid_mode: str, ordering: Optional[str],
+                         ordering_corpus_name: Optional[str], ordering_corpus_file: Optional[UploadFile]) -> Dict[str, Any]:
+    """Параметры build_candidate_space для словаря, маски, гибрида и порядка перебора. Ошибки параметров - HTTP 400."""
+    if rule_names and not wordlist_path:
+        raise HTTPException(status_code=400, detail="Правила применяются только вместе со словарем")
+    if rule_names and mask:
+        raise HTTPException(status_code=400, detail="Правила не применяются в гибридной атаке (словарь + маска)")
+    custom_charsets = {key: value for key, value in zip(CUSTOM_CHARSET_KEYS, custom_charset_values) if value}
+    attack_options = {}
+    if wordlist_path:
+        attack_options.update(wordlist_path=wordlist_path, rules=rule_names)
+    if mask:
+        attack_options.update(mask=mask, custom_charsets=custom_charsets, hybrid_mode=hybrid_mode)
+        try:
+            parse_mask(mask, custom_charsets) # Ошибки маски - сразу клиенту, а не воркеру
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if hybrid_mode not in ("append", "prepend"):
+            raise HTTPException(status_code=400, detail="hybrid_mode: append или prepend")
+    if ordering:
+        if ordering not in ORDERING_MODES:
+            raise HTTPException(status_code=400, detail=f"ordering: одно из {', '.join(ORDERING_MODES)}")
+        if wordlist_path:
+            raise HTTPException(status_code=400, detail="Порядок по вероятности применяется только к перебору charset или маски")
+        attack_options.update(ordering=ordering,
+                              ordering_model=await _train_ordering_model(ordering_corpus_name, ordering_corpus_file))
+    return attack_options
+
+
+def _remove_duplicate_upload(wordlist_path: Optional[str]):
+    """
+    Загруженный словарь задачи, которая не запускает свой перебор, не нужен.
+    Архив остается в хранилище (он общий по sha256) - его уберет сборщик мусора.
+    """
+    if wordlist_path and os.path.exists(wordlist_path):
+        os.unlink(wordlist_path)
+
+
+async def _train_ordering_model(corpus_name: Optional[str], corpus_file: Optional[UploadFile]) -> str:
+    """Обучает (или берет из кэша по sha256 корпуса) модель порядка перебора. Возвращает путь к модели."""
+    try:
+        if corpus_name:
+            return await run_in_threadpool(train_model_file, resolve_wordlist(corpus_name))
+        if corpus_file is not None and corpus_file.filename:
+            corpus_path = await run_in_threadpool(save_uploaded_wordlist, corpus_file.file)
+            try:
+                return await run_in_threadpool(train_model_file, corpus_path)
+            finally:
+                os.unlink(corpus_path) # Корпус нужен только для обучения
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    raise HTTPException(status_code=400, detail="Для ordering нужен корпус: ordering_corpus_name или ordering_corpus_file")
+
+
+BATCH_ITEM_FIELDS = ("charset", "max_length", "shards", "local_pool", "wordlist_name", "rules", "mask",
+                     "custom_charset1", "custom_charset2", "custom_charset3", "custom_charset4",
+                     "hybrid_mode", "ordering", "ordering_corpus_name")
+
+
+@router.post("/brut_hash_batch", response_model=TaskBatch)
+async def brut_hash_batch(
+    request: Request,
+    charset: str = Form(default="abcdefghijklmnopqrstuvwxyz0123456789"),
+    max_length: int = Form(default=5, le=8),
+    shards: int = Form(default=settings.BRUTEFORCE_SHARDS, ge=1, le=settings.BRUTEFORCE_MAX_SHARDS),
+    local_pool: bool = Form(default=settings.LOCAL_POOL_DEFAULT),
+    wordlist_file: Optional[UploadFile] = File(default=None), # Общий загруженный словарь для всех архивов
+    wordlist_name: Optional[str] = Form(default=None),
+    rules: str = Form(default=""),
+    mask: Optional[str] = Form(default=None),
+    custom_charset1: Optional[str] = Form(default=None),
+    custom_charset2: Optional[str] = Form(default=None),
+    custom_charset3: Optional[str] = Form(default=None),
+    custom_charset4: Optional[str] = Form(default=None),
+    hybrid_mode: str = Form(default="append"),
+    ordering: Optional[str] = Form(default=None),
+    ordering_corpus_name: Optional[str] = Form(default=None), # Корпус для ordering - только словарь на сервере
+    items: Optional[str] = Form(default=None), # JSON-список параметров по архивам (в порядке архивов), поля - как у формы
+    rar_files: List[UploadFile] = File(default=[]),
+    bundle: Optional[UploadFile] = File(default=None), # zip или tar с архивами (добавляются после rar_files)
+    user_id: Optional[str] = Header(default=None, alias="X-User-Id")
+):
+    """
+    Пачка задач за один запрос: общие параметры перебора и, при необходимости, свои для каждого архива (items).
+    Все строки tasks вставляются одним запросом, сообщения Celery отправляются одной группой.
+    Архив, не прошедший проверку, параметры или оценку, возвращается со статусом rejected и причиной в error.
+    """
+    shared = {"charset": charset, "max_length": max_length, "shards": shards, "local_pool": local_pool,
+              "wordlist_name": wordlist_name, "rules": rules, "mask": mask, "custom_charset1": custom_charset1,
+              "custom_charset2": custom_charset2, "custom_charset3": custom_charset3, "custom_charset4": custom_charset4,
+              "hybrid_mode": hybrid_mode, "ordering": ordering, "ordering_corpus_name": ordering_corpus_name}
+    try:
+        overrides = TypeAdapter(List[TaskBatchItemOptions]).validate_json(items) if items else None
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=f"items: {e}")
+
+    uploads = [] # [(имя файла, временный файл загрузки, sha256)]
+    uploaded_wordlist_path = None
+    try:
+        for rar_file in rar_files:
+            if not rar_file.filename:
+                continue
+            if len(uploads) >= settings.BATCH_MAX_ARCHIVES:
+                raise HTTPException(status_code=400, detail=f"Больше {settings.BATCH_MAX_ARCHIVES} архивов в одном запросе")
+            uploads.append((rar_file.filename, *await run_in_threadpool(receive_upload, rar_file.file)))
+        if bundle is not None and bundle.filename:
+            try:
+                uploads += await run_in_threadpool(receive_bundle, bundle.file, settings.BATCH_MAX_ARCHIVES - len(uploads))
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        if not uploads:
+            raise HTTPException(status_code=400, detail="Нет архивов: передайте rar_files и/или bundle")
+        if overrides is not None and len(overrides) != len(uploads):
+            raise HTTPException(status_code=400, detail=f"items: {len(overrides)} элементов на {len(uploads)} архивов")
+        logger.info(f"POST /brut_hash_batch: архивов={len(uploads)}, общие параметры: charset='{charset}', "
+                    f"max_length={max_length}, shards={shards}, wordlist='{wordlist_name or (wordlist_file.filename if wordlist_file else None)}', "
+                    f"rules='{rules}', mask='{mask}'")
+        if wordlist_file is not None and wordlist_file.filename:
+            uploaded_wordlist_path = await run_in_threadpool(save_uploaded_wordlist, wordlist_file.file)
+
+        if not database.is_connected:
+            await database.connect()
+        jobs = [{"filename": filename, "upload_path": upload_path, "sha256": archive_sha256,
+                 "params": {**shared, **(overrides[index].model_dump(exclude_none=True) if overrides else {})}}
+                for index, (filename, upload_path, archive_sha256) in enumerate(uploads)]
+        responses: List[Optional[TaskBatchItem]] = [None] * len(jobs)
+        await _prepare_batch_jobs(jobs, responses, uploaded_wordlist_path)
+        await _submit_batch_jobs(jobs, responses, user_id or (request.client.host if request.client else "anonymous"))
+
+        if uploaded_wordlist_path and not any(job.get("dispatch_args", {}).get("attack_options", {}).get("wordlist_path")
+                                              == uploaded_wordlist_path for job in jobs):
+            os.unlink(uploaded_wordlist_path) # Словарь не понадобился ни одной запущенной задаче
+        return TaskBatch(tasks=responses)
+    except HTTPException:
+        if uploaded_wordlist_path and os.path.exists(uploaded_wordlist_path):
+            os.unlink(uploaded_wordlist_path)
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка в эндпоинте /brut_hash_batch: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Внутренняя ошибка сервера: {str(e)}")
+    finally:
+        for _, upload_path, _ in uploads:
+            discard_upload(upload_path) # Принятые архивы уже в хранилище - остаются только отклоненные
+
+
+def _reject_batch_job(jobs: List[Dict[str, Any]], responses: List[Optional[TaskBatchItem]], index: int, error: str):
+    job = jobs[index]
+    discard_upload(job["upload_path"])
+    responses[index] = TaskBatchItem(filename=job["filename"], status="rejected", error=error)
+    logger.warning(f"Архив '{job['filename']}' пачки отклонен: {error}")
+
+
+async def _prepare_batch_jobs(jobs: List[Dict[str, Any]], responses: List[Optional[TaskBatchItem]],
+                              uploaded_wordlist_path: Optional[str]):
+    """Параметры перебора, анализ архивов, кэш результатов и оценка длительности для каждого архива пачки."""
+    options_by_params = {} # Одинаковые параметры у архивов пачки проверяются (и считаются) один раз
+    spaces = {}
+    for index, job in enumerate(jobs):
+        params = job["params"]
+        params_key = json.dumps(params, sort_keys=True)
+        if params_key not in options_by_params:
+            try:
+                try:
+                    rule_names = parse_rules(params["rules"] or "")
+                    wordlist_path = resolve_wordlist(params["wordlist_name"]) if params["wordlist_name"] else uploaded_wordlist_path
+                except ValueError as e:
+                    raise HTTPException(status_code=400, detail=str(e))
+                options_by_params[params_key] = await _attack_options(
+                    wordlist_path, rule_names, params["mask"],
+                    [params[f"custom_charset{number}"] for number in range(1, 5)], params["hybrid_mode"],
+                    params["ordering"], params["ordering_corpus_name"], None)
+            except HTTPException as e:
+                options_by_params[params_key] = e
+        attack_options = options_by_params[params_key]
+        if isinstance(attack_options, HTTPException):
+            _reject_batch_job(jobs, responses, index, attack_options.detail)
+            continue
+        job["attack_options"] = attack_options
+        try:
+            job["plan"] = await run_in_threadpool(analyze_archive, job["upload_path"], job["sha256"])
+        except ArchiveRejected as e:
+            _reject_batch_job(jobs, responses, index, str(e))
+
+    analyzed = [job for job in jobs if "plan" in job]
+    if ws_manager.redis_client and analyzed:
+        pipe = ws_manager.redis_client.pipeline(transaction=False)
+        for job in analyzed:
+            pipe.set(plan_cache_key(job["plan"].sha256), job["plan"].to_json(), ex=PLAN_CACHE_TTL)
+        try:
+            await pipe.execute()
+        except redis.exceptions.RedisError as e:
+            logger.error(f"Пачка: ошибка сохранения планов проверки в Redis: {e}")
+    cached_passwords = await find_cached_passwords([job["plan"].sha256 for job in analyzed])
+
+    for index, job in enumerate(jobs):
+        if "plan" not in job:
+            continue
+        job["cached_password"] = cached_passwords.get(job["plan"].sha256)
+        if job["cached_password"] is not None:
+            continue
+        params = job["params"]
+        space_key = json.dumps([params["charset"], params["max_length"], job["attack_options"]], sort_keys=True)
+        if space_key not in spaces:
+            spaces[space_key] = await run_in_threadpool(estimate_space, params["charset"], params["max_length"],
+                                                        job["attack_options"])
+        keyspace, candidates = spaces[space_key]
+        job["estimate"] = await estimate_job(ws_manager.redis_client, job["plan"], keyspace, candidates,
+                                             params["shards"], params["local_pool"])
+        if job["estimate"].seconds > settings.ADMISSION_MAX_ESTIMATED_SECONDS:
+            _reject_batch_job(jobs, responses, index,
+                              f"Оценка длительности перебора {job['estimate'].seconds:.0f} с больше допустимой "
+                              f"({settings.ADMISSION_MAX_ESTIMATED_SECONDS:.0f} с)")
+            del job["plan"]
+        elif required_shards(job["estimate"]) > settings.BRUTEFORCE_MAX_SHARDS:
+            _reject_batch_job(jobs, responses, index,
+                              f"Перебор не делится на шарды короче {settings.SHARD_MAX_SECONDS:.0f} с "
+                              f"(нужно {required_shards(job['estimate'])}, допустимо {settings.BRUTEFORCE_MAX_SHARDS})")
+            del job["plan"]
+
+
+async def _submit_batch_jobs(jobs: List[Dict[str, Any]], responses: List[Optional[TaskBatchItem]], owner: str):
+    """Вставляет задачи пачки одним запросом, присоединяет дубликаты и отправляет (или откладывает) остальные."""
+    submitted_at = time.time()
+    to_run = [index for index, job in enumerate(jobs) if "plan" in job and job["cached_password"] is None]
+    free = await free_slots(ws_manager.redis_client)
+    if len(to_run) > free and (settings.ADMISSION_SATURATED_POLICY == "reject" or not ws_manager.redis_client):
+        for index in to_run[free:]:
+            _reject_batch_job(jobs, responses, index, "Очередь задач заполнена, повторите позже")
+            del jobs[index]["plan"]
+        to_run = to_run[:free]
+
+    accepted = [index for index, job in enumerate(jobs) if "plan" in job]
+    if not accepted:
+        return
+    refs = await run_in_threadpool(_commit_uploads, [(jobs[index]["upload_path"], jobs[index]["sha256"]) for index in accepted])
+    rows = []
+    for index, rar_ref in zip(accepted, refs):
+        job = jobs[index]
+        job["rar_ref"] = rar_ref
+        cached_password = job["cached_password"]
+        plain_charset = not job["attack_options"]
+        rows.append({"hash": job["plan"].sha256, "file_path": rar_ref,
+                     "charset": job["params"]["charset"] if plain_charset else None,
+                     "max_length": job["params"]["max_length"] if plain_charset else None,
+                     "status": "pending" if cached_password is None else "completed",
+                     "progress": 0 if cached_password is None else 100, "result": cached_password})
+    # По INSERT на строку в одной транзакции: порядок строк RETURNING многострочного INSERT не гарантирован,
+    # а file_path у одинаковых архивов совпадает - id сопоставляется с задачей пачки по самому запросу
+    async with database.transaction():
+        for index, row in zip(accepted, rows):
+            jobs[index]["task_id"] = await database.execute(task_table.insert().values(row))
+    logger.info(f"Пачка: создано задач в БД - {len(accepted)}")
+    if ws_manager.redis_client and to_run:
+        pipe = ws_manager.redis_client.pipeline(transaction=False)
+        for index in to_run:
+            pipe.set(estimate_key(str(jobs[index]["task_id"])), jobs[index]["estimate"].to_json(), ex=ESTIMATE_KEY_TTL)
+        await pipe.execute()
+
+    for index in accepted:
+        job = jobs[index]
+        if job["cached_password"] is not None:
+            responses[index] = TaskBatchItem(filename=job["filename"], task_id=job["task_id"], status="completed",
+                                             progress=100, result=job["cached_password"])
+
+    # Такая же задача уже выполняется (или стоит раньше в этой же пачке) - присоединяемся к ней
+    followers = {} # (статус, прогресс) основной задачи -> последователи
+    primaries = []
+    for index in to_run:
+        job = jobs[index]
+        primary_id = None
+        if ws_manager.redis_client:
+            fingerprint = await run_in_threadpool(job_fingerprint, job["plan"].sha256, job["params"]["charset"],
+                                                  job["params"]["max_length"], job["attack_options"])
+            primary_id = await attach_to_running_job(ws_manager.redis_client, fingerprint, job["task_id"])
+            if primary_id is None and not await register_job(ws_manager.redis_client, fingerprint, job["task_id"]):
+                primary_id = await attach_to_running_job(ws_manager.redis_client, fingerprint, job["task_id"])
+        if primary_id is None:
+            primaries.append(index)
+            continue
+        primary = await get_task_status(primary_id, ws_manager.redis_client)
+        status, progress = (primary.status, primary.progress) if primary else ("pending", 0)
+        followers.setdefault((status, progress), []).append(job["task_id"])
+        responses[index] = TaskBatchItem(filename=job["filename"], task_id=job["task_id"], status=status, progress=progress,
+                                         eta_seconds=await _task_eta(str(primary_id), status))
+    for (status, progress), task_ids in followers.items():
+        await database.execute(task_table.update().where(task_table.c.id.in_(task_ids)).values(status=status, progress=progress))
+        await cache_task_status_async(ws_manager.redis_client, task_ids, status, progress)
+
+    # Очередь - по оценке длительности, приоритет - с учетом задач пользователя (и предыдущих задач пачки)
+    routes = await routes_for(ws_manager.redis_client, [jobs[index]["estimate"].seconds for index in primaries], owner)
+    await acquire_shares(ws_manager.redis_client, [jobs[index]["task_id"] for index in primaries], owner)
+    dispatched, deferred = [], []
+    for position, (index, route) in enumerate(zip(primaries, routes)):
+        job = jobs[index]
+        job["dispatch_args"] = {"rar_path": job["rar_ref"], "charset": job["params"]["charset"],
+                                "max_length": job["params"]["max_length"], "shards": job["params"]["shards"],
+                                "min_shards": required_shards(job["estimate"]),
+                                "local_pool": job["params"]["local_pool"], "attack_options": job["attack_options"],
+                                "route": route, "submitted_at": submitted_at}
+        (dispatched if position < free else deferred).append(index)
+    if deferred:
+        # Очередь заполнена - задачи отправит admit_deferred_tasks, когда освободится место
+        await defer_tasks(ws_manager.redis_client, [(jobs[index]["task_id"], jobs[index]["dispatch_args"]) for index in deferred])
+    if dispatched:
+        await run_in_threadpool(dispatch_bruteforce_batch,
+                                [{"task_id": jobs[index]["task_id"], **jobs[index]["dispatch_args"]} for index in dispatched])
+    for index in dispatched:
+        responses[index] = TaskBatchItem(filename=jobs[index]["filename"], task_id=jobs[index]["task_id"], status="pending",
+                                         eta_seconds=jobs[index]["estimate"].seconds)
+    for index in deferred:
+        responses[index] = TaskBatchItem(filename=jobs[index]["filename"], task_id=jobs[index]["task_id"], status="deferred")
+
+
+def _commit_uploads(uploads: List[Tuple[str, str]]) -> List[str]:
+    return [commit_upload(upload_path, archive_sha256) for upload_path, archive_sha256 in uploads]
 
 
 @router.get("/get_status/{task_id}", response_model=Optional[TaskStatus]) # Может вернуть TaskStatus или null (404)
 async def get_status_route(task_id: int): # task_id здесь int
     logger.info(f"GET /get_status/{task_id}")
-    task_data = await get_task_status(task_id) # Эта функция должна вернуть Pydantic модель или None
+    task_data = await get_task_status(task_id, ws_manager.redis_client) # Сначала кэш статусов, при промахе - БД
     if task_data is None:
         logger.warning(f"Задача с ID {task_id} не найдена для GET /get_status")
         raise HTTPException(
             status_code=404,
             detail=f"Task with id {task_id} not found"
         )
+    task_data.eta_seconds = await _task_eta(str(task_id), task_data.status)
     return task_data
 
 
+@router.post("/get_status_bulk", response_model=List[TaskStatus])
+async def get_status_bulk_route(body: TaskStatusBulkRequest):
+    """
+    Статусы нескольких задач за один запрос: кэш читается одним пайплайном, промахи - одним запросом к БД.
+    Ненайденные задачи пропускаются; ETA не считается (для нее есть /eta/{task_id}).
+    """
+    task_ids = list(dict.fromkeys(body.task_ids)) # Без повторов, в порядке запроса
+    if len(task_ids) > settings.STATUS_BULK_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"Не больше {settings.STATUS_BULK_MAX_IDS} задач в одном запросе")
+    logger.info(f"POST /get_status_bulk: {len(task_ids)} задач")
+    statuses = await get_task_statuses(task_ids, ws_manager.redis_client)
+    return [statuses[task_id] for task_id in task_ids if task_id in statuses]
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics_route():
+    """Метрики в текстовом формате Prometheus: агрегаты процессов API и воркеров плюс очереди и задачи."""
+    if not ws_manager.redis_client:
+        raise HTTPException(status_code=503, detail="Redis недоступен: метрики процессов собираются через Redis")
+    if not database.is_connected:
+        await database.connect()
+    depths = await queue_depths(ws_manager.redis_client)
+    by_status = await database.fetch_all(select(task_table.c.status, func.count().label("tasks"))
+                                         .group_by(task_table.c.status))
+    computed = {
+        "rar_queue_depth": [({"queue": queue}, depth) for queue, depth in depths.items()],
+        "rar_deferred_tasks": [({}, await ws_manager.redis_client.llen(DEFERRED_QUEUE_KEY))],
+        "rar_tasks": [({"status": row["status"]}, row["tasks"]) for row in by_status],
+    }
+    return PlainTextResponse(await render_metrics(ws_manager.redis_client, computed),
+                             media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@router.get("/eta/{task_id}", response_model=TaskEta)
+async def get_eta_route(task_id: int):
+    """Оценка длительности перебора: размер пространства, текущая скорость и оставшееся время."""
+    logger.info(f"GET /eta/{task_id}")
+    task_data = await get_task_status(task_id, ws_manager.redis_client)
+    if task_data is None:
+        raise HTTPException(status_code=404, detail=f"Task with id {task_id} not found")
+    # Последователь перебирается основной задачей - оценка берется у нее
+    source_id_str = await get_primary_task(ws_manager.redis_client, str(task_id)) if ws_manager.redis_client else None
+    source_id_str = source_id_str or str(task_id)
+    estimate = await load_estimate(ws_manager.redis_client, source_id_str)
+    if estimate is None:
+        raise HTTPException(status_code=404, detail=f"Для задачи {task_id} нет оценки длительности")
+    processed, cps = await get_live_progress(ws_manager.redis_client, source_id_str)
+    return TaskEta(task_id=task_id, status=task_data.status, keyspace=estimate.keyspace, candidates=estimate.candidates,
+                   processed=processed, combinations_per_second=cps, estimated_cps_per_slot=estimate.cps_per_slot,
+                   measured=estimate.measured, eta_seconds=_eta_for_status(task_data.status, estimate, processed, cps))
+
+
+def _eta_for_status(status: str, estimate, processed: int, cps: float) -> Optional[float]:
+    """ETA есть только у задач, которые идут или ждут в очереди воркеров (у отложенной время ожидания неизвестно)."""
+    if status not in ("pending", "running"):
+        return None
+    return round(eta_seconds(estimate, processed, cps), 1)
+
+
+async def _task_owner(task_id_str: str) -> str:
+    owner = await ws_manager.redis_client.get(owner_key(task_id_str))
+    return owner.decode("utf-8") if owner is not None else "anonymous"
+
+
+async def _task_eta(task_id_str: str, status: str) -> Optional[float]:
+    if not ws_manager.redis_client or status not in ("pending", "running"):
+        return None
+    source_id_str = await get_primary_task(ws_manager.redis_client, task_id_str) or task_id_str
+    estimate = await load_estimate(ws_manager.redis_client, source_id_str)
+    if estimate is None:
+        return None
+    processed, cps = await get_live_progress(ws_manager.redis_client, source_id_str)
+    return _eta_for_status(status, estimate, processed, cps)
+
+
 @router.websocket("/ws/{task_id_str}") # task_id здесь будет строкой из URL
-async def websocket_endpoint(websocket: WebSocket, task_id_str: str):
+async def websocket_endpoint(websocket: WebSocket, task_id_str: str,
+                             last_event_id: Optional[str] = None): # event_id последнего полученного уведомления (при переподключении)
     # task_id_str - это ID задачи, полученный от клиента (строка)
     # Убедимся, что такая задача существует (опционально, но полезно)
     # try:
@@ -95,25 +639,14 @@ async def websocket_endpoint(websocket: WebSocket, task_id_str: str):
     #     await websocket.close(code=1007) # Invalid frame payload data
     #     return
 
-    await ws_manager.connect(task_id_str, websocket)
+    await ws_manager.connect(task_id_str, websocket, last_event_id)
     logger.info(f"WebSocket /ws/{task_id_str}: клиент подключен.")
     try:
         while True:
-            # Здесь можно обрабатывать команды от клиента, если они нужны (pause/resume/cancel)
-            # data = await websocket.receive_text()
-            # logger.info(f"WebSocket /ws/{task_id_str}: получено сообщение от клиента: {data}")
-            # if data == "pause": ...
-            await websocket.receive_text() # Просто держим соединение открытым для получения сообщений от сервера
-            # Для данной задачи клиент в основном слушает, а не шлет команды после подключения.
-            # Если команды не нужны, можно заменить на asyncio.sleep в цикле или просто ждать disconnect.
-            # Если ты не ожидаешь сообщений от клиента, то можно убрать receive_text() и положиться на keepalive пинги
-            # или на то, что соединение будет разорвано клиентом или по таймауту.
-            # Однако, receive_text() также обрабатывает закрытие соединения клиентом.
-            # Если не нужен прием команд, но нужно отслеживать разрыв:
-            # try:
-            #     while True: await asyncio.sleep(3600) # Ждем очень долго
-            # except asyncio.CancelledError: raise # Позволяем FastAPI отменить задачу
-            # finally: await ws_manager.disconnect(task_id_str, websocket)
+            # Клиент шлет команды управления задачей: {"command": "pause|resume|cancel"}
+            data = await websocket.receive_text()
+            logger.info(f"WebSocket /ws/{task_id_str}: получено сообщение от клиента: {data}")
+            await _handle_client_command(task_id_str, websocket, data)
 
     except WebSocketDisconnect:
         logger.info(f"WebSocket /ws/{task_id_str}: клиент отключился.")
@@ -122,4 +655,74 @@ async def websocket_endpoint(websocket: WebSocket, task_id_str: str):
     finally:
         # Убедимся, что соединение корректно закрывается и удаляется из менеджера
         await ws_manager.disconnect(task_id_str, websocket)
-        logger.info(f"WebSocket /ws/{task_id_str}: ресурсы соединения освобождены.")
\ No newline at end of file
+        logger.info(f"WebSocket /ws/{task_id_str}: ресурсы соединения освобождены.")
+
+
+async def _handle_client_command(task_id_str: str, websocket: WebSocket, data: str):
+    """Передает команду клиента воркерам задачи через канал управления Redis."""
+    try:
+        command = json.loads(data).get("command")
+    except (json.JSONDecodeError, AttributeError):
+        command = None
+    if command not in CONTROL_COMMANDS:
+        await ws_manager.send_to_client(task_id_str, websocket, {"status": "ERROR", "task_id": task_id_str,
+                                                                 "error": f"Неизвестная команда, ожидается одна из: {', '.join(CONTROL_COMMANDS)}"})
+        return
+    if not ws_manager.redis_client:
+        # Команды доходят до воркеров только через Redis
+        await ws_manager.send_to_client(task_id_str, websocket, {"status": "ERROR", "task_id": task_id_str,
+                                                                 "error": "Redis недоступен, команда не может быть выполнена"})
+        return
+
+    task = await get_task_status(int(task_id_str), ws_manager.redis_client) if task_id_str.isdigit() else None
+    if task is None or task.status in FINAL_TASK_STATUSES:
+        await ws_manager.send_to_client(task_id_str, websocket, {"status": "ERROR", "task_id": task_id_str,
+                                                                 "error": "Задача не найдена или уже завершена"})
+        return
+
+    client_task_id_str = task_id_str # Задача, к которой подключен клиент (ответы об ошибках - ему)
+    # Последователь (задача, присоединенная к такой же выполняющейся): отмена отсоединяет только его,
+    # остальные команды относятся к общему перебору основной задачи
+    primary_id_str = await get_primary_task(ws_manager.redis_client, task_id_str)
+    if primary_id_str is not None:
+        if command == "cancel":
+            await detach_follower(ws_manager.redis_client, task_id_str, primary_id_str)
+            if await cancel_paused_task(task.task_id, ws_manager.redis_client):
+                await ws_manager.send_message_via_redis({"status": "CANCELLED", "task_id": task_id_str}, task_id_str)
+            else:
+                await ws_manager.send_to_client(client_task_id_str, websocket, {"status": "ERROR", "task_id": task_id_str,
+                                                                                "error": "Не удалось отменить задачу"})
+            return
+        task_id_str = primary_id_str
+        task = await get_task_status(int(primary_id_str), ws_manager.redis_client) or task
+
+    paused_shards = await ws_manager.send_control_command(task_id_str, command)
+    if command == "resume" and paused_shards:
+        # Пауза вернула слоты воркеров в очередь - приостановленные шарды отправляются заново
+        estimate = await load_estimate(ws_manager.redis_client, task_id_str)
+        route = await route_for(ws_manager.redis_client, estimate.seconds, await _task_owner(task_id_str)) if estimate else None
+        await run_in_threadpool(resume_paused_shards, task.task_id, paused_shards, route)
+        await resume_paused_task([task.task_id] + await get_followers(ws_manager.redis_client, task_id_str), ws_manager.redis_client)
+        await ws_manager.send_message_via_redis({"status": "RESUMED", "task_id": task_id_str}, task_id_str)
+    elif command == "resume" and task.status == "paused":
+        # Параметры приостановленных шардов хранятся PAUSED_KEY_TTL - брошенную паузу можно только отменить
+        await ws_manager.send_to_client(client_task_id_str, websocket, {
+            "status": "ERROR", "task_id": client_task_id_str,
+            "error": "Параметры приостановленных шардов не найдены (пауза истекла), задачу можно только отменить"})
+    elif command == "cancel" and task.status in ("paused", "deferred"):
+        # Приостановленную или отложенную задачу не выполняет ни один воркер - отменяем ее здесь (вместе с последователями)
+        await release_job_async(ws_manager.redis_client, task_id_str)
+        await release_share_async(ws_manager.redis_client, task_id_str)
+        failed = []
+        for cancelled_id in [task.task_id] + await get_followers(ws_manager.redis_client, task_id_str):
+            # Ошибка одной задачи не прерывает отмену остальных (последователей)
+            if await cancel_paused_task(cancelled_id, ws_manager.redis_client):
+                await ws_manager.send_message_via_redis({"status": "CANCELLED", "task_id": str(cancelled_id)}, str(cancelled_id))
+            else:
+                failed.append(cancelled_id)
+        if failed:
+            await ws_manager.send_to_client(client_task_id_str, websocket, {
+                "status": "ERROR", "task_id": client_task_id_str,
+                "error": f"Не удалось отменить задачи: {', '.join(map(str, failed))}"})
+        await ws_manager.redis_client.delete(control_key(task_id_str))
+        await clear_followers_async(ws_manager.redis_client, task_id_str)
@@ -1,7 +1,14 @@
 # app/celery/celery.py
 from celery import Celery, signals
-from databases import Database # Используется 'databases'
-from app.db.database import DATABASE_URL # Убедись, что DATABASE_URL здесь доступен
+from app.db.database import create_database, create_missing_tables
+from app.db.progress_writer import progress_writer # Пакетная запись прогресса задач
+from app.services.metrics import metrics # Метрики процесса для /metrics
+from app.services.notifier import notifier # Пакетная отправка уведомлений задач
+from app.services.estimator import check_shard_time_budget # Согласованность бюджета задач и visibility_timeout
+from app.services.redis_pool import close_shared_redis # Общий пул соединений Redis процесса
+from app.core.config import settings
+from app.services.scheduling import SHORT_QUEUE, MEDIUM_QUEUE, LONG_QUEUE, BRUTEFORCE_QUEUES, MAX_PRIORITY
+from kombu import Queue
 import asyncio # для run_until_complete
 import logging
 
@@ -10,9 +17,10 @@ logger = logging.getLogger(__name__)
 # Создаем экземпляр Celery
 app = Celery(
     'tasks', # Имя твоего проекта Celery
-    broker='redis://localhost:6379/0', # URL твоего брокера Redis
-    backend='redis://localhost:6379/0', # URL твоего бэкенда Redis
-    include=['app.services.bruteforce'] # Список модулей с задачами Celery
+    # Тот же Redis, что у уведомлений и API: /metrics читает глубину очередей брокера через REDIS_URL
+    broker=settings.REDIS_URL,
+    backend=settings.REDIS_URL,
+    include=['app.services.bruteforce', 'app.services.archive_store', 'app.services.admission'] # Список модулей с задачами Celery
 )
 
 # Конфигурация Celery (некоторые параметры)
@@ -22,14 +30,95 @@ app.conf.update(
     result_serializer='json',
     timezone='Europe/Moscow', # Укажи свой часовой пояс
     enable_utc=True, # Рекомендуется использовать UTC
+    # Подтверждение сообщения только после выполнения: если воркер упал посреди перебора,
+    # брокер передоставит задачу, и она продолжит с контрольной точки из БД
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    worker_prefetch_multiplier=1, # Длинные задачи не резервируем про запас (профили ниже переопределяют)
+    # Очереди по оценке длительности задачи (app/services/scheduling.py); служебные задачи - в очередь коротких
+    task_queues=[Queue(name) for name in BRUTEFORCE_QUEUES],
+    task_default_queue=SHORT_QUEUE,
+    broker_transport_options={
+        # Сообщение без подтверждения передоставляется через visibility_timeout - он должен быть больше самого долгого перебора
+        'visibility_timeout': settings.BROKER_VISIBILITY_TIMEOUT,
+        # Приоритеты сообщений внутри очереди (у Redis 0 - самый высокий): размер задачи и fair share пользователя
+        'priority_steps': list(range(MAX_PRIORITY + 1)),
+        'sep': ':',
+        'queue_order_strategy': 'priority',
+    },
+    # Периодические задачи (нужен запущенный celery beat)
+    beat_schedule={
+        # Сборка мусора в хранилище архивов
+        'gc-archive-store': {
+            'task': 'app.services.archive_store.gc_archive_store',
+            'schedule': settings.ARCHIVE_GC_INTERVAL_SECONDS,
+        },
+        # Отправка отложенных задач, когда очередь освобождается
+        'admit-deferred-tasks': {
+            'task': 'app.services.admission.admit_deferred_tasks',
+            'schedule': settings.ADMISSION_CHECK_INTERVAL_SECONDS,
+        },
+    },
     # Ограничение на количество одновременно выполняемых задач на одном воркере, если нужно
     # worker_concurrency=4, # Зависит от CPU и типа задач (I/O bound vs CPU bound)
 )
 
+# Профили воркеров: какие очереди разбирать, сколько процессов и сколько сообщений резервировать на процесс.
+# Воркер выбирает профиль переменной WORKER_PROFILE, например:
+#     WORKER_PROFILE=short celery -A app.celery.celery worker   - только короткие задачи, низкая задержка
+#     WORKER_PROFILE=all celery -A app.celery.celery worker     - все очереди: большие задачи забирают оставшуюся емкость
+# Короткие задачи можно резервировать пачкой, длинные - по одной (иначе они ждут за чужим многочасовым перебором).
+# Задачи с local_pool=True перебирают пулом процессов, а процессы prefork-пула Celery являются daemon и
+# своих процессов создавать не могут - такие задачи идут в одном процессе (клиент получает local_pool="degraded"
+# в STARTED). Воркер для local_pool запускается с --pool=solo, по одной задаче на хост (пул и так займет все ядра):
+#     WORKER_PROFILE=long celery -A app.celery.celery worker --pool=solo
+WORKER_PROFILES = {
+    "short": {"queues": [SHORT_QUEUE], "concurrency": settings.WORKER_SHORT_CONCURRENCY,
+              "prefetch": settings.WORKER_SHORT_PREFETCH},
+    "medium": {"queues": [MEDIUM_QUEUE, SHORT_QUEUE], "concurrency": settings.WORKER_MEDIUM_CONCURRENCY,
+               "prefetch": settings.WORKER_MEDIUM_PREFETCH},
+    "long": {"queues": [LONG_QUEUE], "concurrency": settings.WORKER_LONG_CONCURRENCY,
+             "prefetch": settings.WORKER_LONG_PREFETCH},
+    "all": {"queues": list(BRUTEFORCE_QUEUES), "concurrency": 0, "prefetch": 1},
+}
+
+
+def _worker_profile():
+    profile = WORKER_PROFILES.get(settings.WORKER_PROFILE)
+    if profile is None:
+        raise ValueError(f"Неизвестный профиль воркера '{settings.WORKER_PROFILE}'. Доступны: {', '.join(WORKER_PROFILES)}")
+    return profile
+
+# Число процессов и предвыборку командная строка воркера берет из конфигурации при разборе опций,
+# поэтому они задаются здесь, при импорте (явные -c / --prefetch-multiplier по-прежнему важнее).
+# Модуль импортируют и FastAPI, и beat - неизвестный профиль здесь не ошибка, воркер упадет в apply_worker_profile
+_profile = WORKER_PROFILES.get(settings.WORKER_PROFILE)
+if _profile is None:
+    logger.error(f"Неизвестный профиль воркера '{settings.WORKER_PROFILE}', используются настройки профиля 'all'")
+    _profile = WORKER_PROFILES["all"]
+if _profile["concurrency"]:
+    app.conf.worker_concurrency = _profile["concurrency"]
+app.conf.worker_prefetch_multiplier = _profile["prefetch"]
+
+@signals.celeryd_init.connect
+def apply_worker_profile(sender=None, instance=None, conf=None, options=None, **kwargs):
+    """Выбирает очереди воркера по профилю WORKER_PROFILE (явный -Q в командной строке важнее профиля)."""
+    try:
+        check_shard_time_budget() # Шард должен успевать до передоставки брокером (task_acks_late)
+        profile = _worker_profile()
+    except (RuntimeError, ValueError) as e:
+        # Исключение обработчика сигнала Celery только записывает в лог - воркер запустился бы со всеми очередями
+        logger.critical(f"Celery Worker {sender}: {e}")
+        raise SystemExit(1) from e
+    if not (options or {}).get("queues"):
+        instance.app.amqp.queues.select(profile["queues"])
+    logger.info(f"Celery Worker {sender}: профиль '{settings.WORKER_PROFILE}', очереди {profile['queues']}, "
+                f"процессов {conf.worker_concurrency or 'по числу ядер'}, предвыборка {conf.worker_prefetch_multiplier}")
+
 # Глобальный экземпляр базы данных для Celery воркеров
 # Этот экземпляр будет подключаться/отключаться с помощью сигналов воркера
-# Важно: DATABASE_URL должен быть тем же, что и для FastAPI
-celery_db_instance = Database(DATABASE_URL)
+# Важно: DATABASE_URL (app/core/config.py) общий для FastAPI и воркеров
+celery_db_instance = create_database()
 
 @signals.worker_process_init.connect
 def init_db_connection(**kwargs):
@@ -39,6 +128,7 @@ def init_db_connection(**kwargs):
         # 'databases' требует асинхронного контекста
         loop = asyncio.get_event_loop()
         loop.run_until_complete(celery_db_instance.connect())
+        create_missing_tables() # Таблица контрольных точек нужна до первой задачи
         logger.info("Celery Worker: Соединение с БД установлено.")
     except Exception as e:
         logger.error(f"Celery Worker: Ошибка подключения к БД: {e}", exc_info=True)
@@ -50,6 +140,10 @@ def close_db_connection(**kwargs):
     """Закрытие соединения с БД при завершении работы процесса воркера Celery."""
     logger.info("Celery Worker: Закрытие соединения с БД...")
     try:
+        progress_writer.close() # Дописываем накопленный прогресс задач
+        notifier.close() # Накопленные уведомления
+        metrics.close() # И накопленные метрики
+        close_shared_redis()
         if celery_db_instance.is_connected:
             loop = asyncio.get_event_loop()
             loop.run_until_complete(celery_db_instance.disconnect())
@@ -1,8 +1,9 @@
 # app/db/database.py
-from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String
+from sqlalchemy import create_engine, event, MetaData, Table, Column, Index, Integer, BigInteger, String, Float
 from databases import Database
+from app.core.config import DATABASE_URL, settings # Адрес БД задается переменной окружения DATABASE_URL
 
-DATABASE_URL = "sqlite:///./test.db"
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
 
 metadata = MetaData()
 
@@ -18,5 +19,76 @@ task_table = Table(
     Column("progress", Integer),
     Column("result", String, nullable=True),
 )
-engine = create_engine(DATABASE_URL)
-database = Database(DATABASE_URL)
+# Поиск уже найденного пароля по sha256 архива (tasks.hash). Для существующей таблицы индекс
+# нужно создать вручную: CREATE INDEX ix_tasks_hash_status ON tasks (hash, status)
+Index("ix_tasks_hash_status", task_table.c.hash, task_table.c.status)
+
+# Статусы задач: итоговые больше не меняются; незавершенной задаче (в том числе приостановленной
+# или отложенной допуском в очередь) еще понадобится архив, и ее статус нельзя перезаписывать прогрессом
+FINAL_TASK_STATUSES = ("completed", "failed", "cancelled")
+UNFINISHED_TASK_STATUSES = ("pending", "running", "paused", "deferred")
+
+# Контрольные точки перебора: для каждого шарда задачи (shard_index=0 у задачи без шардов)
+# все ранги [start_index, checked_until) уже проверены, с checked_until перебор продолжается после рестарта
+task_checkpoint_table = Table(
+    "task_checkpoints",
+    metadata,
+    Column("task_id", Integer, primary_key=True),
+    Column("shard_index", Integer, primary_key=True),
+    Column("start_index", BigInteger),
+    Column("end_index", BigInteger),
+    Column("checked_until", BigInteger),
+    Column("updated_at", Float),
+)
+
+# Куда ушло время задачи (app/services/profiling.py): разбивка по фазам (JSON: фаза -> секунды)
+# и профили шардов, если задача профилировалась (JSON: [{"host", "path"}]). Пишется при завершении задачи
+task_timings_table = Table(
+    "task_timings",
+    metadata,
+    Column("task_id", Integer, primary_key=True),
+    Column("timings", String),
+    Column("profiles", String, nullable=True),
+    Column("updated_at", Float),
+)
+
+
+def _create_engine():
+    """Синхронный движок SQLAlchemy: создание таблиц и пакетная запись прогресса из воркеров."""
+    if IS_SQLITE:
+        sqlite_engine = create_engine(DATABASE_URL, connect_args={"timeout": settings.DB_POOL_TIMEOUT,
+                                                                  "check_same_thread": False})
+
+        @event.listens_for(sqlite_engine, "connect")
+        def _set_sqlite_pragmas(dbapi_connection, connection_record):
+            # WAL: читатели не блокируют писателя, а запись прогресса не блокирует чтение статусов
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.close()
+
+        return sqlite_engine
+    return create_engine(
+        DATABASE_URL,
+        pool_size=settings.DB_POOL_MAX_SIZE,
+        max_overflow=0,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_pre_ping=True, # Соединения, закрытые сервером БД, отбрасываются до использования
+    )
+
+
+def create_database() -> Database:
+    """Асинхронное подключение (databases) с настройками пула из конфигурации."""
+    if IS_SQLITE:
+        # aiosqlite: ждать освобождения блокировки, а не сразу падать с "database is locked"
+        return Database(DATABASE_URL, timeout=settings.DB_POOL_TIMEOUT)
+    return Database(DATABASE_URL, min_size=settings.DB_POOL_MIN_SIZE, max_size=settings.DB_POOL_MAX_SIZE)
+
+
+engine = _create_engine()
+database = create_database()
+
+
+def create_missing_tables():
+    """Создает только отсутствующие таблицы (существующие, например tasks в test.db, не трогает)."""
+    metadata.create_all(engine, checkfirst=True)
@@ -0,0 +1,103 @@
+# app/db/progress_writer.py
+import threading
+import time
+import logging
+from typing import Dict, Tuple
+from sqlalchemy import text
+from app.core.config import settings
+from app.db.database import FINAL_TASK_STATUSES, engine
+from app.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+PROTECTED_STATUSES = (*FINAL_TASK_STATUSES, "paused", "deferred") # Пакет прогресса их не перезаписывает
+
+
+class ProgressWriter:
+    """
+    Пакетная запись прогресса задач одного процесса воркера.
+    Обновления копятся в словаре (для каждой задачи остается только последнее), и раз в
+    PROGRESS_FLUSH_INTERVAL_SECONDS фоновый поток пишет их все одним UPDATE ... FROM (VALUES ...)
+    через пул синхронного движка - вместо отдельного UPDATE от каждой задачи каждую секунду.
+    Итоговые статусы (completed/failed/paused/cancelled) пишутся сразу, мимо пакета - перед
+    такой записью нужно вызвать discard(), чтобы старый прогресс не перезаписал итог. discard() видит
+    только пакет своего процесса, поэтому пакет и сам не перезаписывает итоговые статусы, paused и deferred
+    (прогресс шарда из другого процесса может прийти уже после паузы задачи).
+    """
+
+    def __init__(self, interval: float):
+        self._interval = interval
+        self._pending: Dict[int, Tuple[str, int]] = {} # task_id -> (status, progress)
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock() # Держится все время записи пакета
+        self._finished = threading.Event()
+        self._thread = None
+
+    def queue(self, task_id: int, status: str, progress: int):
+        with self._pending_lock:
+            self._pending[task_id] = (status, progress)
+            if self._thread is None:
+                # Поток запускается лениво - в процессе воркера, а не при импорте модуля
+                self._thread = threading.Thread(target=self._run, name="progress-writer", daemon=True)
+                self._thread.start()
+
+    def discard(self, task_id: int):
+        """Убирает накопленный прогресс задачи и дожидается записи пакета, который уже пишется."""
+        with self._flush_lock:
+            with self._pending_lock:
+                self._pending.pop(task_id, None)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._pending_lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            statement, params = _batched_update(pending)
+            try:
+                started = time.perf_counter()
+                with engine.begin() as connection:
+                    connection.execute(statement, params)
+                metrics.observe("rar_db_write_seconds", time.perf_counter() - started, operation="progress_batch")
+                logger.debug(f"[DB Progress] Прогресс записан одним запросом для задач: {len(pending)}")
+            except Exception as e:
+                logger.error(f"[DB Progress] Ошибка пакетной записи прогресса: {e}")
+                # Не теряем обновления: вернем их, если за это время не пришли более новые
+                with self._pending_lock:
+                    for task_id, values in pending.items():
+                        self._pending.setdefault(task_id, values)
+
+    def close(self):
+        """Останавливает поток и дописывает накопленное (при завершении процесса воркера)."""
+        self._finished.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while not self._finished.wait(self._interval):
+            self.flush()
+
+
+def _batched_update(pending: Dict[int, Tuple[str, int]]):
+    """
+    WITH v(id, status, progress) AS (VALUES ...) UPDATE tasks ... FROM v - один запрос на все задачи.
+    Синтаксис работает и в PostgreSQL, и в SQLite >= 3.33. Итоговые статусы, paused и deferred не перезаписываются -
+    из paused в running задачу переводит resume (resume_paused_task), а не прогресс.
+    """
+    rows = []
+    params = {}
+    for i, (task_id, (status, progress)) in enumerate(pending.items()):
+        rows.append(f"(CAST(:id{i} AS INTEGER), CAST(:status{i} AS VARCHAR), CAST(:progress{i} AS INTEGER))")
+        params[f"id{i}"] = task_id
+        params[f"status{i}"] = status
+        params[f"progress{i}"] = progress
+    statement = text(
+        f"WITH v(id, status, progress) AS (VALUES {', '.join(rows)}) "
+        "UPDATE tasks SET status = v.status, progress = v.progress FROM v "
+        f"WHERE tasks.id = v.id AND tasks.status NOT IN ({', '.join(repr(status) for status in PROTECTED_STATUSES)})"
+    )
+    return statement, params
+
+
+progress_writer = ProgressWriter(settings.PROGRESS_FLUSH_INTERVAL_SECONDS)
@@ -1,12 +1,78 @@
 # app/schemas/task.py
-from pydantic import BaseModel, Field
-from typing import Optional
+from pydantic import BaseModel, ConfigDict, Field
+from typing import List, Optional
+from app.core.config import settings
 
 class TaskStatus(BaseModel):
     """
     Схема для статуса задачи.
     """
     task_id: int
-    status: str  # running/completed/failed
+    status: str  # pending/deferred/running/paused/completed/failed/cancelled
     progress: int = Field(ge=0, le=100)
     result: Optional[str] = Field(default=None)
+    eta_seconds: Optional[float] = Field(default=None) # Оценка оставшегося времени (None - нет оценки или задача не идет)
+
+
+class TaskEta(BaseModel):
+    """
+    Оценка длительности перебора задачи.
+    """
+    task_id: int
+    status: str
+    keyspace: int # Рангов в пространстве перебора
+    candidates: int # Кандидатов (оценка для словаря с правилами)
+    processed: int # Пройдено рангов
+    combinations_per_second: float # Текущая суммарная скорость шардов (0 - задача не выполняется)
+    estimated_cps_per_slot: float # Скорость одного слота воркера, по которой сделана оценка
+    measured: bool # Скорость измерена воркерами (иначе - значение по умолчанию)
+    eta_seconds: Optional[float] = Field(default=None)
+
+
+class TaskStatusBulkRequest(BaseModel):
+    """
+    Запрос статусов нескольких задач.
+    """
+    task_ids: List[int] = Field(min_length=1)
+
+
+class TaskBatchItemOptions(BaseModel):
+    """
+    Параметры перебора одного архива пачки (заданные поля переопределяют общие параметры запроса).
+    """
+    model_config = ConfigDict(extra="forbid")
+
+    charset: Optional[str] = None
+    max_length: Optional[int] = Field(default=None, ge=1, le=8)
+    shards: Optional[int] = Field(default=None, ge=1, le=settings.BRUTEFORCE_MAX_SHARDS)
+    local_pool: Optional[bool] = None
+    wordlist_name: Optional[str] = None
+    rules: Optional[str] = None
+    mask: Optional[str] = None
+    custom_charset1: Optional[str] = None
+    custom_charset2: Optional[str] = None
+    custom_charset3: Optional[str] = None
+    custom_charset4: Optional[str] = None
+    hybrid_mode: Optional[str] = None
+    ordering: Optional[str] = None
+    ordering_corpus_name: Optional[str] = None
+
+
+class TaskBatchItem(BaseModel):
+    """
+    Итог постановки одного архива пачки.
+    """
+    filename: str
+    task_id: Optional[int] = Field(default=None) # None - архив отклонен (причина в error)
+    status: str # Статус задачи или rejected
+    progress: int = Field(default=0, ge=0, le=100)
+    result: Optional[str] = Field(default=None)
+    eta_seconds: Optional[float] = Field(default=None)
+    error: Optional[str] = Field(default=None)
+
+
+class TaskBatch(BaseModel):
+    """
+    Ответ на постановку пачки задач (в порядке архивов запроса).
+    """
+    tasks: List[TaskBatchItem]
@@ -0,0 +1,123 @@
+# app/services/admission.py
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import logging
+import redis.asyncio as aioredis # Асинхронный клиент для FastAPI
+from celery import shared_task
+from sqlalchemy import select
+from app.core.config import settings
+from app.db.database import database, engine, task_table
+from app.services.dedupe import primary_key, refresh_jobs # Последователи не занимают воркер; ключи ждущих задач
+from app.services.redis_pool import shared_redis # Общий пул соединений процесса
+from app.services.status_cache import cache_task_status, cache_task_status_async
+
+logger = logging.getLogger(__name__)
+
+# Допуск задач в очередь:
+# - задача, оценка которой больше ADMISSION_MAX_ESTIMATED_SECONDS, отклоняется сразу;
+# - если в работе (pending/running, без последователей - они не занимают воркер) уже ADMISSION_MAX_ACTIVE_TASKS задач, новая задача либо
+#   отклоняется (ADMISSION_SATURATED_POLICY=reject), либо откладывается (defer): получает статус
+#   "deferred", а параметры отправки ложатся в список admission:deferred. Периодическая задача
+#   admit_deferred_tasks (Celery beat) отправляет отложенные задачи по мере освобождения очереди.
+ACTIVE_TASK_STATUSES = ("pending", "running")
+WAITING_TASK_STATUSES = ("deferred", "paused") # Не перебираются, но ключи дедупликации должны жить
+DEFERRED_QUEUE_KEY = "admission:deferred"
+
+
+def _active_tasks_query():
+    return select(task_table.c.id).where(task_table.c.status.in_(ACTIVE_TASK_STATUSES))
+
+
+async def active_tasks(redis_client: Optional[aioredis.Redis]) -> int:
+    """
+    Задач, которые занимают воркеры: pending/running, кроме последователей (у них свой статус
+    в БД, но перебирает основная задача).
+    """
+    task_ids = [row["id"] for row in await database.fetch_all(_active_tasks_query())]
+    if not redis_client or not task_ids:
+        return len(task_ids)
+    pipe = redis_client.pipeline(transaction=False)
+    for task_id in task_ids:
+        pipe.exists(primary_key(str(task_id)))
+    return sum(not is_follower for is_follower in await pipe.execute())
+
+
+async def free_slots(redis_client: Optional[aioredis.Redis]) -> int:
+    """Сколько задач еще можно отправить воркерам до ADMISSION_MAX_ACTIVE_TASKS."""
+    return max(settings.ADMISSION_MAX_ACTIVE_TASKS - await active_tasks(redis_client), 0)
+
+
+async def queue_saturated(redis_client: Optional[aioredis.Redis]) -> bool:
+    return await free_slots(redis_client) == 0
+
+
+async def defer_task(redis_client: aioredis.Redis, task_id: int, dispatch_args: Dict[str, Any]):
+    """Откладывает отправку задачи; dispatch_args - аргументы dispatch_bruteforce."""
+    await defer_tasks(redis_client, [(task_id, dispatch_args)])
+
+
+async def defer_tasks(redis_client: aioredis.Redis, entries: List[Tuple[int, Dict[str, Any]]]):
+    """Откладывает пачку задач: один UPDATE и один RPUSH."""
+    if not entries:
+        return
+    task_ids = [task_id for task_id, _ in entries]
+    await database.execute(task_table.update().where(task_table.c.id.in_(task_ids)).values(status="deferred"))
+    await cache_task_status_async(redis_client, task_ids, "deferred")
+    await redis_client.rpush(DEFERRED_QUEUE_KEY, *(json.dumps({"task_id": task_id, **dispatch_args})
+                                                   for task_id, dispatch_args in entries))
+    logger.info(f"Отложены задачи (очередь заполнена): {', '.join(map(str, task_ids))}")
+
+
+# --- Сторона воркера (beat) ---
+
+def _move_status(task_id: int, current: str, new: str) -> bool:
+    """
+    Переводит задачу из current в new одним условным UPDATE. False - статус уже другой
+    (например, задачу отменили) - проверка и смена статуса не разделены гонкой.
+    """
+    with engine.begin() as connection:
+        result = connection.execute(task_table.update()
+                                    .where((task_table.c.id == task_id) & (task_table.c.status == current))
+                                    .values(status=new))
+    return result.rowcount == 1
+
+
+@shared_task(name='app.services.admission.admit_deferred_tasks')
+def admit_deferred_tasks() -> int:
+    """Отправляет отложенные задачи, пока в работе меньше ADMISSION_MAX_ACTIVE_TASKS. Возвращает число отправленных."""
+    from app.services.dispatch import dispatch_bruteforce # Импорт здесь: dispatch импортирует экземпляр Celery
+
+    redis_client = shared_redis()
+    admitted = 0
+    with engine.connect() as connection:
+        task_ids = [row[0] for row in connection.execute(_active_tasks_query())]
+        waiting_ids = [row[0] for row in connection.execute(
+            select(task_table.c.id).where(task_table.c.status.in_(WAITING_TASK_STATUSES)))]
+    # Ключи перебирающих задач продлевает воркер, а отложенные и приостановленные не перебираются
+    refresh_jobs(redis_client, [str(task_id) for task_id in waiting_ids])
+    pipe = redis_client.pipeline(transaction=False)
+    for task_id in task_ids:
+        pipe.exists(primary_key(str(task_id)))
+    active = sum(not is_follower for is_follower in pipe.execute()) # Последователи не занимают воркер
+    while active < settings.ADMISSION_MAX_ACTIVE_TASKS:
+        raw = redis_client.lpop(DEFERRED_QUEUE_KEY)
+        if raw is None:
+            break
+        entry = json.loads(raw)
+        task_id = entry.pop("task_id")
+        # Задача захватывается до отправки: отмененная, пока ждала в очереди (или во время захвата), не отправится
+        if not _move_status(task_id, "deferred", "pending"):
+            continue
+        try:
+            cache_task_status(redis_client, [task_id], "pending", None)
+            dispatch_bruteforce(task_id, **entry)
+        except Exception:
+            # Вернем в начало очереди, попробуем на следующем запуске (если задачу тем временем не отменили)
+            if _move_status(task_id, "pending", "deferred"):
+                cache_task_status(redis_client, [task_id], "deferred", None)
+                redis_client.lpush(DEFERRED_QUEUE_KEY, raw)
+            raise
+        admitted += 1
+        active += 1
+        logger.info(f"Отложенная задача {task_id} отправлена в очередь")
+    return admitted
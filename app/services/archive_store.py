@@ -0,0 +1,235 @@
+# app/services/archive_store.py
+import hashlib
+import os
+import tarfile
+import tempfile
+import time
+import zipfile
+import logging
+from typing import BinaryIO, List, Optional, Tuple
+from celery import shared_task
+from sqlalchemy import select
+from app.core.config import settings
+from app.db.database import UNFINISHED_TASK_STATUSES, engine, task_table
+
+logger = logging.getLogger(__name__)
+
+# Хранилище архивов по содержимому (content-addressed):
+# - /brut_hash пишет загрузку потоком, кусками, сразу считая sha256, и кладет архив в ARCHIVE_STORE_DIR
+#   как {sha[:2]}/{sha}.rar - одинаковые загрузки хранятся один раз;
+# - задаче (и воркеру) передается не локальный путь API-хоста, а ссылка "sha256:<hex>";
+# - воркер копирует архив из хранилища в свой локальный кэш ARCHIVE_CACHE_DIR (с проверкой sha256)
+#   и дальше читает только локальную копию; кэш ограничен ARCHIVE_CACHE_MAX_BYTES (вытесняются давно не использованные);
+# - gc_archive_store (Celery beat) удаляет архивы, на которые не ссылается ни одна незавершенная задача,
+#   спустя ARCHIVE_RETENTION_SECONDS после последней загрузки.
+# ARCHIVE_STORE_DIR - локальный каталог; на нескольких хостах это общий том (NFS/SMB и т.п.).
+
+ARCHIVE_REF_PREFIX = "sha256:"
+COPY_CHUNK_SIZE = 1024 * 1024
+STALE_PART_SECONDS = 24 * 3600 # Недописанные загрузки (.part) старше этого удаляются
+
+
+def archive_ref(sha256: str) -> str:
+    return f"{ARCHIVE_REF_PREFIX}{sha256}"
+
+
+def ref_sha256(ref: str) -> Optional[str]:
+    """sha256 из ссылки на архив; None - это обычный путь к файлу (задачи, поставленные до хранилища)."""
+    return ref[len(ARCHIVE_REF_PREFIX):] if ref.startswith(ARCHIVE_REF_PREFIX) else None
+
+
+def store_path(sha256: str) -> str:
+    return os.path.join(settings.ARCHIVE_STORE_DIR, sha256[:2], f"{sha256}.rar")
+
+
+def _copy_hashing(source: BinaryIO, target: BinaryIO) -> str:
+    sha = hashlib.sha256()
+    for chunk in iter(lambda: source.read(COPY_CHUNK_SIZE), b""):
+        sha.update(chunk)
+        target.write(chunk)
+    return sha.hexdigest()
+
+
+# --- Сторона API ---
+
+def receive_upload(source: BinaryIO) -> Tuple[str, str]:
+    """
+    Пишет загруженный архив потоком во временный файл рядом с хранилищем, считая sha256 по пути.
+    Возвращает (путь к временному файлу, sha256). Дальше - commit_upload() или discard_upload().
+    """
+    os.makedirs(settings.ARCHIVE_STORE_DIR, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=settings.ARCHIVE_STORE_DIR, suffix=".part", delete=False) as target:
+        try:
+            sha256 = _copy_hashing(source, target)
+        except BaseException:
+            os.unlink(target.name)
+            raise
+        return target.name, sha256
+
+
+def commit_upload(tmp_path: str, sha256: str) -> str:
+    """Кладет проверенную загрузку в хранилище под ее sha256. Возвращает ссылку на архив для задачи."""
+    path = store_path(sha256)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        # Такой архив уже загружали - копия не нужна, только продлеваем срок хранения
+        os.unlink(tmp_path)
+        os.utime(path)
+    else:
+        os.replace(tmp_path, path) # Атомарно: воркер не увидит недописанный архив
+    return archive_ref(sha256)
+
+
+def discard_upload(tmp_path: str):
+    if os.path.exists(tmp_path):
+        os.unlink(tmp_path)
+
+
+def receive_bundle(source: BinaryIO, max_archives: int) -> List[Tuple[str, str, str]]:
+    """
+    Принимает zip или tar (в том числе сжатый) с архивами: каждый файл пачки пишется потоком, как receive_upload.
+    Возвращает [(имя файла в пачке, путь к временному файлу, sha256)]. ValueError - не пачка или в ней больше max_archives файлов.
+    """
+    received = []
+    try:
+        if zipfile.is_zipfile(source):
+            source.seek(0)
+            with zipfile.ZipFile(source) as bundle:
+                for info in bundle.infolist():
+                    if info.is_dir() or _skip_bundle_member(info.filename):
+                        continue
+                    _check_bundle_size(received, max_archives)
+                    with bundle.open(info) as member:
+                        received.append((info.filename, *receive_upload(member)))
+        else:
+            source.seek(0)
+            try:
+                bundle = tarfile.open(fileobj=source, mode="r:*")
+            except tarfile.TarError:
+                raise ValueError("Пачка архивов должна быть zip или tar")
+            with bundle:
+                for info in bundle:
+                    if not info.isfile() or _skip_bundle_member(info.name):
+                        continue
+                    _check_bundle_size(received, max_archives)
+                    received.append((info.name, *receive_upload(bundle.extractfile(info))))
+    except BaseException:
+        for _, tmp_path, _ in received:
+            discard_upload(tmp_path)
+        raise
+    return received
+
+
+def _skip_bundle_member(name: str) -> bool:
+    # Служебные файлы архиваторов (__MACOSX/, ._file, .DS_Store)
+    return name.startswith("__MACOSX/") or os.path.basename(name).startswith(".")
+
+
+def _check_bundle_size(received: list, max_archives: int):
+    if len(received) >= max_archives:
+        raise ValueError(f"В пачке больше {max_archives} архивов")
+
+
+# --- Сторона воркера ---
+
+def _cache_path(sha256: str) -> str:
+    return os.path.join(settings.ARCHIVE_CACHE_DIR, f"{sha256}.rar")
+
+
+def fetch_archive(ref: str) -> str:
+    """
+    Локальный путь к архиву по ссылке: из кэша воркера, а при промахе - копия из хранилища
+    (с проверкой sha256). Обычный путь (не ссылка) возвращается как есть.
+    """
+    sha256 = ref_sha256(ref)
+    if sha256 is None:
+        return ref
+    cached = _cache_path(sha256)
+    if os.path.exists(cached):
+        os.utime(cached) # Время использования - для вытеснения из кэша
+        return cached
+
+    source_path = store_path(sha256)
+    if not os.path.exists(source_path):
+        raise FileNotFoundError(f"Архив {sha256} не найден в хранилище (удален сборщиком или хранилище недоступно)")
+    os.makedirs(settings.ARCHIVE_CACHE_DIR, exist_ok=True)
+    with open(source_path, "rb") as source, \
+            tempfile.NamedTemporaryFile(dir=settings.ARCHIVE_CACHE_DIR, suffix=".part", delete=False) as target:
+        try:
+            copied_sha256 = _copy_hashing(source, target)
+        except BaseException:
+            os.unlink(target.name)
+            raise
+    if copied_sha256 != sha256:
+        os.unlink(target.name)
+        raise ValueError(f"Архив {sha256} в хранилище поврежден: sha256 копии {copied_sha256}")
+    os.replace(target.name, cached) # Параллельная загрузка тем же архивом в другом процессе безопасна
+    logger.info(f"Архив {sha256} скопирован из хранилища в локальный кэш воркера: {cached}")
+    trim_worker_cache(keep=cached)
+    return cached
+
+
+def trim_worker_cache(keep: Optional[str] = None):
+    """Вытесняет из кэша воркера давно не использованные архивы, пока кэш больше ARCHIVE_CACHE_MAX_BYTES."""
+    try:
+        entries = [entry for entry in os.scandir(settings.ARCHIVE_CACHE_DIR)
+                   if entry.is_file() and entry.name.endswith(".rar")]
+    except FileNotFoundError:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    total = sum(entry.stat().st_size for entry in entries)
+    for entry in entries:
+        if total <= settings.ARCHIVE_CACHE_MAX_BYTES:
+            break
+        if entry.path == keep:
+            continue
+        total -= entry.stat().st_size # DirEntry.stat() закэширован при сортировке
+        try:
+            os.unlink(entry.path) # Открытые копии (mmap в других задачах) остаются доступны до закрытия
+            logger.info(f"Архив {entry.name} вытеснен из кэша воркера")
+        except FileNotFoundError:
+            pass # Уже вытеснил другой процесс воркера
+
+
+# --- Сборка мусора ---
+
+def _active_hashes() -> set:
+    """sha256 архивов, которые еще нужны незавершенным задачам."""
+    query = select(task_table.c.hash).where(task_table.c.status.in_(UNFINISHED_TASK_STATUSES))
+    with engine.connect() as connection:
+        return {row[0] for row in connection.execute(query) if row[0]}
+
+
+def collect_garbage(now: Optional[float] = None) -> int:
+    """Удаляет из хранилища архивы завершенных задач старше ARCHIVE_RETENTION_SECONDS. Возвращает число удаленных."""
+    now = now or time.time()
+    if not os.path.isdir(settings.ARCHIVE_STORE_DIR):
+        return 0
+    active = _active_hashes()
+    removed = 0
+    for root, _, files in os.walk(settings.ARCHIVE_STORE_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                age = now - os.stat(path).st_mtime
+                if name.endswith(".part"):
+                    if age > STALE_PART_SECONDS:
+                        os.unlink(path)
+                    continue
+                sha256 = name[:-len(".rar")] if name.endswith(".rar") else None
+                if sha256 is None or sha256 in active or age < settings.ARCHIVE_RETENTION_SECONDS:
+                    continue
+                os.unlink(path)
+                removed += 1
+            except FileNotFoundError:
+                continue # Удалил параллельный сборщик
+    return removed
+
+
+@shared_task(name='app.services.archive_store.gc_archive_store')
+def gc_archive_store():
+    """Периодическая задача (Celery beat): сборка мусора в хранилище архивов и в кэше этого воркера."""
+    removed = collect_garbage()
+    trim_worker_cache()
+    logger.info(f"Сборка мусора в хранилище архивов: удалено архивов: {removed}")
+    return removed
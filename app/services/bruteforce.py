@@ -1,172 +1,604 @@
 # app/services/bruteforce.py
-from typing import Optional, Dict, Any
-from app.db.database import task_table # Определение таблицы tasks
+from typing import Optional, Dict, Any, List, Sequence, Tuple, Callable, Union
+from app.db.database import task_table, task_checkpoint_table, task_timings_table # Определение таблиц tasks, task_checkpoints и task_timings
 from app.celery.celery import celery_db_instance # БД для Celery
-import itertools
+from app.db.progress_writer import progress_writer # Пакетная запись прогресса
+from app.core.config import settings
 import time
+import json
+import threading
 from celery import shared_task
 import logging
-from app.services.rar_tools import check_rar_password # Твой модуль для RAR
+from app.services.rar_tools import RarPasswordVerifier, get_verification_plan # Проверка паролей в памяти
+from app.services.keyspace import CandidateSpace, HybridSpace, SearchResult, build_candidate_space, attack_mode_name # Пространства кандидатов
+from app.services.wordlist import WordlistSpace # Атака по словарю
+from app.services.local_pool import search_range_in_pool, local_pool_available, pool_size # Локальный пул процессов
+from app.services.progress import ProgressReporter # Фоновая отправка прогресса
+from app.services.archive_store import fetch_archive, ref_sha256 # Архивы из общего хранилища
+from app.services.estimator import record_throughput # Измеренная скорость для оценки длительности задач
+from app.services.dedupe import task_followers, release_job, clear_followers, refresh_jobs # Задачи-последователи с тем же архивом
+from app.services.scheduling import release_share # Доля пользователя в кластере (fair share)
+from app.services.notifier import notifier # Пакетная отправка уведомлений процесса воркера
+from app.services.redis_pool import shared_redis # Общий пул соединений Redis процесса
+from app.services.metrics import metrics, process_label # Метрики для /metrics
+from app.services.status_cache import cache_task_status, cache_task_status_async, get_cached_statuses, populate_statuses # Кэш статусов для /get_status
+from app.services.control import ControlListener, mark_paused, control_key, paused_key # Команды pause/resume/cancel
+from app.services.profiling import (PhaseTimings, SamplingProfiler, merge_timings, profile_flag_key, profile_location,
+                                    profile_path, profiling_requested) # Разбивка времени по фазам и профилирование
 from asgiref.sync import async_to_sync # Для вызова async DB операций из sync Celery
 import redis # Синхронный клиент Redis для Celery
-import json
 
 logger = logging.getLogger(__name__)
 
 # --- Функция для публикации в Redis из Celery ---
-def _publish_notification_to_redis(redis_client: redis.Redis, task_id_str: str, message_content: Dict[str, Any]):
-    """Отправляет уведомление в Redis."""
+def _publish_notification_to_redis(redis_client: redis.Redis, task_id_str: str, message_content: Dict[str, Any],
+                                   followers: Optional[List[int]] = None):
+    """
+    Отправляет уведомление в Redis (и в каналы задач-последователей, присоединенных к этой задаче)
+    через общий для процесса notifier: PROGRESS уходит пакетом с фонового потока, остальные статусы - сразу.
+    """
     if not redis_client:
         logger.warning(f"[Task {task_id_str}] Redis клиент недоступен. Пропуск уведомления: {message_content.get('status')}")
         return
-    
-    channel_name = f"ws:{task_id_str}"
-    # Структура сообщения, которую ожидает WebSocketManager в _listen_redis
-    payload_to_redis = {
-        'task_id': task_id_str,
-        'message': message_content
-    }
+    if followers is None:
+        followers = task_followers(redis_client, task_id_str)
+    notifier.publish(task_id_str, message_content, followers)
+    # PROGRESS публикуется каждую секунду - в INFO только остальные статусы (скорость видна в /metrics)
+    logger.log(logging.DEBUG if message_content.get("status") == "PROGRESS" else logging.INFO,
+               f"[Task {task_id_str}] Уведомление для канала 'ws:{task_id_str}' передано в отправку: статус {message_content.get('status')}")
+
+
+# --- Координация шардов одной задачи через Redis ---
+# Все шарды задачи task_id пишут свой прогресс в общие хеши, а шард, нашедший пароль,
+# выставляет стоп-ключ, который остальные проверяют при каждом обновлении прогресса.
+COORDINATION_KEYS_TTL = 24 * 3600 # Ключи координации живут не дольше суток
+
+def _progress_key(task_id_str: str) -> str:
+    return f"bruteforce:{task_id_str}:progress" # hash: номер шарда -> проверено комбинаций
+
+def _cps_key(task_id_str: str) -> str:
+    return f"bruteforce:{task_id_str}:cps" # hash: номер шарда -> комбинаций в секунду
+
+def _stop_key(task_id_str: str) -> str:
+    return f"bruteforce:{task_id_str}:stop"
+
+def _started_key(task_id_str: str) -> str:
+    return f"bruteforce:{task_id_str}:started" # время запуска первого шарда
+
+
+def _mark_started(redis_client: Optional[redis.Redis], task_id_str: str, start_time: float) -> bool:
+    """Возвращает True только для первого запустившегося шарда задачи."""
+    if not redis_client:
+        return True
     try:
-        json_payload = json.dumps(payload_to_redis)
-        redis_client.publish(channel_name, json_payload)
-        logger.info(f"[Task {task_id_str}] Опубликовано в Redis канал '{channel_name}': статус {message_content.get('status')}")
+        return bool(redis_client.set(_started_key(task_id_str), start_time, nx=True, ex=COORDINATION_KEYS_TTL))
     except redis.exceptions.RedisError as e:
-        logger.error(f"[Task {task_id_str}] Ошибка Redis при публикации в канал '{channel_name}': {e}")
-    except Exception as e:
-        logger.error(f"[Task {task_id_str}] Непредвиденная ошибка при публикации в Redis (канал '{channel_name}'): {e}", exc_info=True)
+        logger.error(f"[Task {task_id_str}] Ошибка Redis при отметке запуска: {e}")
+        return True
+
+
+def _get_started_at(redis_client: Optional[redis.Redis], task_id_str: str) -> Optional[float]:
+    if not redis_client:
+        return None
+    try:
+        value = redis_client.get(_started_key(task_id_str))
+        return float(value) if value is not None else None
+    except redis.exceptions.RedisError as e:
+        logger.error(f"[Task {task_id_str}] Ошибка Redis при чтении времени запуска: {e}")
+        return None
+
+
+def _report_shard_progress(redis_client: Optional[redis.Redis], task_id_str: str, shard_index: int,
+                           processed: int, cps: float) -> Tuple[int, float]:
+    """Сохраняет прогресс шарда и возвращает суммарные (проверено, CPS) по всем шардам задачи."""
+    if not redis_client:
+        return processed, cps
+    try:
+        pipe = redis_client.pipeline()
+        pipe.hset(_progress_key(task_id_str), str(shard_index), processed)
+        pipe.hset(_cps_key(task_id_str), str(shard_index), round(cps, 2))
+        pipe.expire(_progress_key(task_id_str), COORDINATION_KEYS_TTL)
+        pipe.expire(_cps_key(task_id_str), COORDINATION_KEYS_TTL)
+        pipe.hvals(_progress_key(task_id_str))
+        pipe.hvals(_cps_key(task_id_str))
+        results = pipe.execute()
+        return sum(int(v) for v in results[-2]), sum(float(v) for v in results[-1])
+    except redis.exceptions.RedisError as e:
+        logger.error(f"[Task {task_id_str}] Ошибка Redis при обновлении прогресса шарда {shard_index}: {e}")
+        return processed, cps
+
+
+def _request_stop(redis_client: Optional[redis.Redis], task_id_str: str, reason: str):
+    """Просит остальные шарды задачи остановиться."""
+    if not redis_client:
+        return
+    try:
+        redis_client.set(_stop_key(task_id_str), reason, ex=COORDINATION_KEYS_TTL)
+    except redis.exceptions.RedisError as e:
+        logger.error(f"[Task {task_id_str}] Ошибка Redis при установке стоп-ключа: {e}")
+
+
+def _stop_requested(redis_client: Optional[redis.Redis], task_id_str: str) -> bool:
+    if not redis_client:
+        return False
+    try:
+        return redis_client.exists(_stop_key(task_id_str)) > 0
+    except redis.exceptions.RedisError as e:
+        logger.error(f"[Task {task_id_str}] Ошибка Redis при проверке стоп-ключа: {e}")
+        return False
+
+
+def _cleanup_coordination_keys(redis_client: Optional[redis.Redis], task_id_str: str):
+    if not redis_client:
+        return
+    try:
+        redis_client.delete(_progress_key(task_id_str), _cps_key(task_id_str),
+                            _stop_key(task_id_str), _started_key(task_id_str),
+                            control_key(task_id_str), paused_key(task_id_str), profile_flag_key(task_id_str))
+    except redis.exceptions.RedisError as e:
+        logger.error(f"[Task {task_id_str}] Ошибка Redis при очистке ключей координации: {e}")
+    clear_followers(redis_client, task_id_str)
+
+
+def _control_command(redis_client: Optional[redis.Redis], task_id_str: str) -> Optional[str]:
+    """Текущая команда управления задачей ("pause", "cancel") или None."""
+    if not redis_client:
+        return None
+    try:
+        value = redis_client.get(control_key(task_id_str))
+        return value.decode("utf-8") if value is not None else None
+    except redis.exceptions.RedisError as e:
+        logger.error(f"[Task {task_id_str}] Ошибка Redis при чтении команды управления: {e}")
+        return None
+
+
+def _format_elapsed(start_time: float) -> str:
+    elapsed_time_seconds = time.time() - start_time
+    return time.strftime("%H:%M:%S", time.gmtime(elapsed_time_seconds))
+
+
+def _update_task_status(redis_client: Optional[redis.Redis], task_id: int, status: str, progress: Optional[int],
+                        result: Optional[str] = None, followers: Optional[List[int]] = None):
+    """Обновляет статус задачи в БД и в кэше статусов вместе с ее последователями."""
+    if followers is None:
+        followers = task_followers(redis_client, str(task_id))
+    async_to_sync(update_task_db_status)(task_id, status, progress, result=result, follower_ids=followers)
+    # Прогресс в БД пишется пакетами, поэтому /get_status читает свежее значение из кэша
+    cache_task_status(redis_client, [task_id, *followers], status, progress, result)
+
+
+def _record_timings(task_id: int, message: Dict[str, Any], timings: Optional[Dict[str, float]],
+                    profiles: Sequence[Dict[str, str]]):
+    """Добавляет разбивку времени по фазам (и где лежат профили) в итоговое уведомление и в task_timings."""
+    if timings is None:
+        return
+    message["timings"] = timings
+    if profiles:
+        message["profiles"] = list(profiles)
+    logger.info(f"[Task {task_id}] Время по фазам, с: {timings}")
+    async_to_sync(save_task_timings)(task_id, timings, profiles)
+
+
+def _complete_task(redis_client: Optional[redis.Redis], task_id: int, password_found: Optional[str],
+                   start_time: float, timings: Optional[Dict[str, float]] = None,
+                   profiles: Sequence[Dict[str, str]] = ()) -> Dict[str, Any]:
+    """Записывает итог перебора в БД и публикует COMPLETED (timings - разбивка времени по фазам)."""
+    task_id_str = str(task_id)
+    elapsed_time_formatted = _format_elapsed(start_time)
+    async_to_sync(delete_checkpoints)(task_id)
+    release_job(redis_client, task_id_str) # Сначала снимаем ключ, потом читаем последователей - итог получат все
+    release_share(redis_client, task_id_str)
+    followers = task_followers(redis_client, task_id_str)
+
+    if password_found is not None:
+        _update_task_status(redis_client, task_id, "completed", 100, result=password_found, followers=followers)
+        completed_message = {
+            "status": "COMPLETED", "task_id": task_id_str, "result": password_found,
+            "elapsed_time": elapsed_time_formatted
+        }
+        _record_timings(task_id, completed_message, timings, profiles)
+        _publish_notification_to_redis(redis_client, task_id_str, completed_message, followers)
+        return {"status": "COMPLETED", "result": password_found, "task_id": task_id_str}
+    else:
+        _update_task_status(redis_client, task_id, "failed", 100, result="Password not found", followers=followers) # или другой статус
+        failed_message = { # Используй "FAILED" или "NOT_FOUND" как в требованиях
+            "status": "COMPLETED", # По условию, если не найден, тоже COMPLETED, но без result
+            "task_id": task_id_str, 
+            "result": None, # Пароль не найден
+            "elapsed_time": elapsed_time_formatted
+            # "error": "Password not found" # Можно добавить поле error если нужно
+        }
+        # Если в требованиях для ненайденного пароля другой статус (например, FAILED), измени здесь
+        # failed_message["status"] = "FAILED"
+        # failed_message["error"] = "Password not found"
+
+        _record_timings(task_id, failed_message, timings, profiles)
+        _publish_notification_to_redis(redis_client, task_id_str, failed_message, followers)
+        return {"status": failed_message["status"], "result": None, "task_id": task_id_str}
+
+
+def _fail_task(redis_client: Optional[redis.Redis], task_id: int, error: str, start_time: float,
+               timings: Optional[Dict[str, float]] = None, profiles: Sequence[Dict[str, str]] = ()):
+    """Записывает ошибку в БД и публикует FAILED (timings - разбивка времени по фазам)."""
+    task_id_str = str(task_id)
+    release_job(redis_client, task_id_str)
+    release_share(redis_client, task_id_str)
+    followers = task_followers(redis_client, task_id_str)
+    _update_task_status(redis_client, task_id, "failed", 100, result=error, followers=followers) # Обновляем БД с ошибкой
+    async_to_sync(delete_checkpoints)(task_id)
+
+    error_message_payload = {
+        "status": "FAILED", "task_id": task_id_str, "error": error,
+        "elapsed_time": _format_elapsed(start_time)
+    }
+    _record_timings(task_id, error_message_payload, timings, profiles)
+    _publish_notification_to_redis(redis_client, task_id_str, error_message_payload, followers)
+
+
+def _pause_task(redis_client: Optional[redis.Redis], task_id: int) -> Dict[str, Any]:
+    """Записывает паузу в БД и публикует PAUSED (прогресс в БД остается последним сохраненным)."""
+    task_id_str = str(task_id)
+    _update_task_status(redis_client, task_id, "paused", None)
+    _publish_notification_to_redis(redis_client, task_id_str, {"status": "PAUSED", "task_id": task_id_str})
+    return {"status": "PAUSED", "result": None, "task_id": task_id_str}
+
+
+def _cancel_task(redis_client: Optional[redis.Redis], task_id: int, start_time: float) -> Dict[str, Any]:
+    """Записывает отмену в БД и публикует CANCELLED."""
+    task_id_str = str(task_id)
+    release_job(redis_client, task_id_str)
+    release_share(redis_client, task_id_str)
+    followers = task_followers(redis_client, task_id_str)
+    _update_task_status(redis_client, task_id, "cancelled", None, followers=followers)
+    async_to_sync(delete_checkpoints)(task_id)
+    _publish_notification_to_redis(redis_client, task_id_str, {
+        "status": "CANCELLED", "task_id": task_id_str, "elapsed_time": _format_elapsed(start_time)
+    }, followers)
+    return {"status": "CANCELLED", "result": None, "task_id": task_id_str}
+
+
+def _save_profile(profiler: Optional[SamplingProfiler], task_id: int, shard_index: Optional[int]) -> Optional[Dict[str, str]]:
+    """Останавливает профилировщик шарда и сохраняет профиль; возвращает, где он лежит."""
+    if profiler is None:
+        return None
+    profiler.stop()
+    try:
+        path = profiler.save(profile_path(task_id, shard_index))
+    except OSError as e:
+        logger.error(f"[Task {task_id}] Не удалось сохранить профиль шарда {shard_index}: {e}")
+        return None
+    logger.info(f"[Task {task_id}] Профиль шарда {shard_index} сохранен: {path} (снимков: {profiler.samples})")
+    return profile_location(path)
+
+
+# Кандидаты проверяются пакетами: счетчики прогресса и флаги остановки смотрятся раз в пакет, а не на каждый кандидат.
+# Размер пакета подстраивается под CPS (его считает ProgressReporter), чтобы пакет занимал ~BATCH_TARGET_SECONDS.
+BATCH_TARGET_SECONDS = 0.25
+MIN_BATCH_SIZE = 16
+MAX_BATCH_SIZE = 65536
+
+def _search_range(verifier: RarPasswordVerifier, space: Union[CandidateSpace, WordlistSpace, HybridSpace], start: int, end: int,
+                  reporter: ProgressReporter, should_stop: Optional[Callable[[], bool]] = None,
+                  timings: Optional[PhaseTimings] = None) -> SearchResult:
+    """
+    Перебор диапазона рангов [start, end) в текущем процессе.
+    Цикл только сдвигает счетчики reporter; CPS и запись прогресса в БД/Redis делает поток ProgressReporter.
+    Перебор прерывается перед очередным пакетом, если reporter.stop_requested или should_stop() (пауза/отмена).
+    Время генерации и проверки кандидатов добавляется в timings раз в пакет.
+    """
+    batch = space.new_batch(MAX_BATCH_SIZE)
+    batch_size = MIN_BATCH_SIZE
+    rank = start
+    candidates = 0
+    # Проверка пароля
+    # ВНИМАНИЕ: для архивов без проверочного значения verifier откатывается на unrar,
+    # и тогда проверка может быть долгой блокирующей операцией.
+    check = verifier.check
+
+    while rank < end:
+        if reporter.stop_requested or (should_stop is not None and should_stop()):
+            return SearchResult(None, rank - start, True, rank)
+        generation_started = time.perf_counter()
+        next_rank = space.next_batch(batch, rank, end, batch_size)
+        verification_started = time.perf_counter()
+        found = None
+        for i, candidate in enumerate(batch):
+            if check(candidate):
+                found = i
+                break
+        if timings is not None:
+            verification_finished = time.perf_counter()
+            timings.add("generation", verification_started - generation_started)
+            timings.add("verification", verification_finished - verification_started)
+        if found is not None:
+            return SearchResult(batch.password(found).decode("utf-8", errors="replace"), next_rank - start, False, next_rank)
+        rank = next_rank
+        candidates += len(batch)
+        reporter.processed = rank - start
+        reporter.candidates = candidates
+        reporter.checked_until = rank
+
+        cps = reporter.cps
+        if cps:
+            batch_size = int(min(MAX_BATCH_SIZE, max(MIN_BATCH_SIZE, cps * BATCH_TARGET_SECONDS)))
+
+    return SearchResult(None, rank - start, False, rank)
 
 
 @shared_task(bind=True, name='app.services.bruteforce.bruteforce_rar_task')
-def bruteforce_rar_task(self, rar_path: str, charset: str, max_length: int, task_id: int): # task_id из БД (int)
+def bruteforce_rar_task(self, rar_path: str, charset: str, max_length: int, task_id: int, # task_id из БД (int)
+                        shard_index: Optional[int] = None, start_index: int = 0, end_index: Optional[int] = None,
+                        local_pool: bool = False, attack_options: Optional[Dict[str, Any]] = None,
+                        submitted_at: Optional[float] = None):
+    """
+    Перебор паролей в диапазоне индексов [start_index, end_index).
+    Без shard_index задача перебирает все пространство и сама публикует итог.
+    С shard_index задача - один шард из группы: она возвращает результат шарда,
+    а итог публикует finalize_bruteforce_task.
+    С local_pool=True диапазон перебирается пулом процессов на все ядра хоста.
+    attack_options (параметры build_candidate_space) задают атаку по словарю, маске или гибридную
+    вместо перебора charset/max_length.
+    submitted_at - время постановки задачи (для метрики задержки запуска).
+    Время по фазам (генерация, проверка, БД, Redis) уходит в итог задачи или в результат шарда;
+    если для задачи включено профилирование, профиль шарда сохраняется в PROFILE_DIR.
+    """
     task_id_str = str(task_id) # Для Redis каналов и сообщений используем строку
+    sharded = shard_index is not None
     start_time = time.time()
-    logger.info(f"[Task {task_id_str}] Запуск bruteforce: rar_path={rar_path}, charset_len={len(charset)}, max_len={max_length}")
-
-    # Инициализация синхронного клиента Redis для Celery задачи
-    # ВАЖНО: вынеси параметры подключения (host, port, db) в конфигурацию
-    redis_client = None
-    try:
-        redis_client = redis.Redis(host='localhost', port=6379, db=0)
-        redis_client.ping() # Проверка соединения
-        logger.info(f"[Task {task_id_str}] Синхронный Redis клиент для Celery подключен.")
-    except redis.exceptions.ConnectionError as e:
-        logger.error(f"[Task {task_id_str}] Не удалось подключиться к Redis для уведомлений: {e}")
-        # Можно решить, должна ли задача падать или продолжаться без уведомлений.
-        # Для этой лабораторной уведомления важны.
-        redis_client = None 
-
-    # Отправка начального статуса
-    start_message = {
-        "status": "STARTED", "task_id": task_id_str, "hash_type": "rar",
-        "charset_length": len(charset), "max_length": max_length
-    }
-    _publish_notification_to_redis(redis_client, task_id_str, start_message)
-
-    # Обновление статуса задачи в БД (используем async_to_sync с celery_db_instance)
-    async_to_sync(update_task_db_status)(task_id, "running", 0)
-
-    try:
-        total_combinations = sum(len(charset)**l for l in range(1, max_length + 1))
-        processed_combinations = 0
-        last_progress_update_time = time.time()
-        password_found = None
-        combinations_in_last_second = 0 # Счетчик комбинаций для CPS
-
-        for length in range(1, max_length + 1):
-            if password_found: break
-            for attempt_tuple in itertools.product(charset, repeat=length):
-                if password_found: break
-
-                current_password = "".join(attempt_tuple)
-                processed_combinations += 1
-                combinations_in_last_second +=1
-
-                current_time = time.time()
-                # Обновление прогресса (например, каждую секунду)
-                time_since_last_update = current_time - last_progress_update_time
-                if time_since_last_update >= 1.0:
-                    progress_percentage = int((processed_combinations / total_combinations) * 100) if total_combinations > 0 else 0
-                    cps = combinations_in_last_second / time_since_last_update if time_since_last_update > 0 else 0
-                    
-                    progress_message = {
-                        "status": "PROGRESS", "task_id": task_id_str, "progress": progress_percentage,
-                        "current_combination": current_password, # Может быть слишком частым, можно убрать или слать реже
-                        "combinations_per_second": round(cps, 2)
-                    }
-                    _publish_notification_to_redis(redis_client, task_id_str, progress_message)
-                    
-                    # Обновление прогресса в БД
-                    async_to_sync(update_task_db_status)(task_id, "running", progress_percentage)
-                    
-                    combinations_in_last_second = 0 # Сброс счетчика CPS
-                    last_progress_update_time = current_time
-
-                # Проверка пароля
-                # ВНИМАНИЕ: `check_rar_password` может быть блокирующей операцией.
-                # Если она очень долгая, это может замедлить Celery воркер.
-                if check_rar_password(rar_path, current_password):
-                    password_found = current_password
-                    logger.info(f"[Task {task_id_str}] Пароль НАЙДЕН: {password_found}")
-                    break 
-            if password_found: break
-        
-        elapsed_time_seconds = time.time() - start_time
-        elapsed_time_formatted = time.strftime("%H:%M:%S", time.gmtime(elapsed_time_seconds))
-
-        if password_found:
-            async_to_sync(update_task_db_status)(task_id, "completed", 100, result=password_found)
-            completed_message = {
-                "status": "COMPLETED", "task_id": task_id_str, "result": password_found,
-                "elapsed_time": elapsed_time_formatted
-            }
-            _publish_notification_to_redis(redis_client, task_id_str, completed_message)
-            return {"status": "COMPLETED", "result": password_found, "task_id": task_id_str}
-        else:
-            async_to_sync(update_task_db_status)(task_id, "failed", 100, result="Password not found") # или другой статус
-            failed_message = { # Используй "FAILED" или "NOT_FOUND" как в требованиях
-                "status": "COMPLETED", # По условию, если не найден, тоже COMPLETED, но без result
-                "task_id": task_id_str, 
-                "result": None, # Пароль не найден
-                "elapsed_time": elapsed_time_formatted
-                # "error": "Password not found" # Можно добавить поле error если нужно
+    timings = PhaseTimings()
+    attack_options = attack_options or {}
+    attack_mode = attack_mode_name(attack_options)
+    space = build_candidate_space(charset, max_length, **attack_options)
+    total_combinations = space.size
+    if end_index is None:
+        end_index = total_combinations
+    logger.info(f"[Task {task_id_str}] Запуск {attack_mode}: rar_path={rar_path}, charset_len={len(charset)}, max_len={max_length}, "
+                f"options={attack_options}, shard={shard_index}, range=[{start_index}, {end_index}), local_pool={local_pool}")
+
+    # Общий клиент Redis процесса воркера: пул соединений из настроек, переподключение при обрывах
+    redis_client = shared_redis()
+
+    profiler = None
+    if profiling_requested(redis_client, task_id_str):
+        profiler = SamplingProfiler(settings.PROFILE_SAMPLE_INTERVAL_SECONDS)
+        profiler.watch(threading.current_thread())
+        profiler.start()
+        logger.info(f"[Task {task_id_str}] Профилирование шарда {shard_index} включено")
+    profile = None
+    # Процесс prefork-пула Celery (daemon) не может создать пул процессов - шард пойдет в одном процессе
+    pool_degraded = local_pool and not local_pool_available()
+
+    # Начальный статус отправляет только первый запустившийся шард
+    with timings.measure("redis"):
+        first_shard = _mark_started(redis_client, task_id_str, start_time)
+    if first_shard:
+        if submitted_at is not None:
+            metrics.observe("rar_task_start_delay_seconds", max(start_time - submitted_at, 0.0),
+                            queue=(self.request.delivery_info or {}).get("routing_key", "unknown"))
+        start_message = {
+            "status": "STARTED", "task_id": task_id_str, "hash_type": "rar",
+            "charset_length": len(charset), "max_length": max_length
+        }
+        if attack_options:
+            start_message.update({"attack_mode": attack_mode, "keyspace_size": total_combinations})
+        if pool_degraded:
+            # Клиент просил local_pool - сообщаем, что перебор идет медленнее ожидаемого
+            start_message.update({"local_pool": "degraded",
+                                  "warning": "Локальный пул недоступен на воркере (нужен --pool=solo), перебор в одном процессе"})
+        with timings.measure("redis"):
+            _publish_notification_to_redis(redis_client, task_id_str, start_message)
+
+        # Обновление статуса задачи в БД (используем async_to_sync с celery_db_instance)
+        with timings.measure("db"):
+            _update_task_status(redis_client, task_id, "running", 0)
+
+    verifier = None
+    checkpoint_shard = shard_index or 0
+    paused = False
+    worker_label = process_label()
+    # Команды pause/resume/cancel от клиента приходят через канал управления
+    control = ControlListener(redis_client, task_id_str)
+    try:
+        # rar_path - ссылка на архив в хранилище: воркер работает с локальной копией из своего кэша
+        local_rar_path = fetch_archive(rar_path)
+        # План проверки берется из кэша (его строит /brut_hash), дальше кандидаты проверяются в памяти
+        plan = get_verification_plan(local_rar_path, redis_client, sha256=ref_sha256(rar_path))
+
+        # После падения воркера или передоставки сообщения (acks_late) продолжаем с контрольной точки
+        with timings.measure("db"):
+            resume_from = async_to_sync(load_checkpoint)(task_id, checkpoint_shard, start_index, end_index)
+        already_checked = resume_from - start_index
+        if already_checked > 0:
+            logger.info(f"[Task {task_id_str}] Продолжение перебора с контрольной точки: ранг {resume_from} "
+                        f"(уже проверено {already_checked} комбинаций)")
+        last_checkpoint_time = time.time()
+        last_db_progress = None
+        use_pool = local_pool and not pool_degraded
+
+        def on_tick(processed_combinations: int, checked_until: int, cps: float) -> bool:
+            """
+            Отчет о прогрессе из потока ProgressReporter (раз в секунду).
+            Возвращает True, если перебор нужно прервать.
+            """
+            nonlocal last_checkpoint_time, last_db_progress
+            metrics.set_gauge("rar_candidates_per_second", cps, worker=worker_label, task_id=task_id_str, shard=checkpoint_shard)
+            # Прогресс и CPS суммируются по всем шардам задачи
+            with timings.measure("redis"):
+                total_processed, total_cps = _report_shard_progress(
+                    redis_client, task_id_str, checkpoint_shard, already_checked + processed_combinations, cps
+                )
+            progress_percentage = min(int((total_processed / total_combinations) * 100), 100) if total_combinations > 0 else 0
+            # Последняя проверенная подряд комбинация - для отображения клиенту
+            current_password = space.password_at(checked_until - 1).decode("utf-8", errors="replace") if checked_until > start_index else None
+
+            progress_message = {
+                "status": "PROGRESS", "task_id": task_id_str, "progress": progress_percentage,
+                "current_combination": current_password,
+                "combinations_per_second": round(total_cps, 2)
             }
-            # Если в требованиях для ненайденного пароля другой статус (например, FAILED), измени здесь
-            # failed_message["status"] = "FAILED"
-            # failed_message["error"] = "Password not found"
+            with timings.measure("redis"):
+                followers = task_followers(redis_client, task_id_str)
+                _publish_notification_to_redis(redis_client, task_id_str, progress_message, followers)
+
+            # В БД пишем только изменившийся процент - лишние UPDATE не нужны
+            if progress_percentage != last_db_progress:
+                with timings.measure("db"):
+                    _update_task_status(redis_client, task_id, "running", progress_percentage, followers=followers)
+                last_db_progress = progress_percentage
+
+            # Контрольная точка - реже, чем прогресс
+            if time.time() - last_checkpoint_time >= settings.CHECKPOINT_INTERVAL_SECONDS:
+                with timings.measure("db"):
+                    async_to_sync(save_checkpoint)(task_id, checkpoint_shard, checked_until)
+                # Скорость одного слота (процесса) - для оценки длительности новых задач
+                with timings.measure("redis"):
+                    record_throughput(redis_client, plan, cps / (pool_size() if use_pool else 1), task_id_str)
+                    refresh_jobs(redis_client, [task_id_str]) # Перебор может идти дольше JOB_KEY_TTL
+                last_checkpoint_time = time.time()
+
+            # Другой шард уже нашел пароль - дальше перебирать бессмысленно
+            if sharded:
+                with timings.measure("redis"):
+                    found_elsewhere = _stop_requested(redis_client, task_id_str)
+                if found_elsewhere:
+                    logger.info(f"[Task {task_id_str}] Шард {shard_index} остановлен: пароль найден другим шардом.")
+                    return True
+            return False
+
+        # Прогресс отправляется из отдельного потока и не тормозит проверку паролей
+        with ProgressReporter(on_tick, name=f"progress-{task_id_str}-{checkpoint_shard}").start(resume_from) as reporter:
+            if profiler is not None:
+                profiler.watch(reporter.thread)
+            if use_pool:
+                # Генерация и проверка идут в процессах пула - их общее время считается проверкой
+                with timings.measure("verification"):
+                    search_result = search_range_in_pool(
+                        local_rar_path, plan, {"charset": charset, "max_length": max_length, **attack_options},
+                        resume_from, end_index, reporter,
+                        should_stop=control.should_stop
+                    )
+            else:
+                if pool_degraded:
+                    logger.warning(f"[Task {task_id_str}] Локальный пул недоступен в daemon-процессе (prefork), перебор в одном процессе. "
+                                   f"Для локального режима запускайте воркер с --pool=solo")
+                verifier = RarPasswordVerifier(local_rar_path, plan=plan)
+                search_result = _search_range(verifier, space, resume_from, end_index, reporter,
+                                              should_stop=control.should_stop, timings=timings)
+        profile = _save_profile(profiler, task_id, shard_index)
+        profiler = None
+        password_found = search_result.password
+        processed_combinations = already_checked + search_result.processed
+        command = control.poll() if search_result.stopped else None
+
+        if command == "pause":
+            # Воркер освобождается, позиция остается в контрольной точке; resume отправит шард в очередь заново
+            paused = True
+            async_to_sync(save_checkpoint)(task_id, checkpoint_shard, search_result.checked_until)
+            _report_shard_progress(redis_client, task_id_str, checkpoint_shard, processed_combinations, 0)
+            mark_paused(redis_client, task_id_str, shard_index, {
+                "rar_path": rar_path, "charset": charset, "max_length": max_length, "shard_index": shard_index,
+                "start_index": start_index, "end_index": end_index, "local_pool": local_pool,
+                "attack_options": attack_options
+            })
+            logger.info(f"[Task {task_id_str}] Шард {shard_index} приостановлен на ранге {search_result.checked_until}")
+            if sharded:
+                return {"status": "PAUSED", "result": None, "task_id": task_id_str,
+                        "shard": shard_index, "processed": processed_combinations,
+                        "timings": timings.snapshot(), "profile": profile}
+            return _pause_task(redis_client, task_id)
+
+        if command == "cancel":
+            logger.info(f"[Task {task_id_str}] Шард {shard_index} остановлен: задача отменена.")
+            if sharded:
+                return {"status": "CANCELLED", "result": None, "task_id": task_id_str, "shard": shard_index}
+            return _cancel_task(redis_client, task_id, start_time)
+
+        if password_found is not None:
+            logger.info(f"[Task {task_id_str}] Пароль НАЙДЕН: {password_found}")
+            if sharded:
+                _request_stop(redis_client, task_id_str, "found")
+
+        if sharded:
+            _report_shard_progress(redis_client, task_id_str, checkpoint_shard, processed_combinations, 0)
+            if password_found is not None:
+                shard_status = "FOUND"
+            elif search_result.stopped:
+                shard_status = "STOPPED"
+            else:
+                shard_status = "EXHAUSTED"
+            # Диапазон шарда закрыт - при передоставке сообщения повторять его не нужно
+            async_to_sync(save_checkpoint)(task_id, checkpoint_shard, end_index)
+            return {"status": shard_status, "result": password_found, "task_id": task_id_str,
+                    "shard": shard_index, "processed": processed_combinations,
+                    "timings": timings.snapshot(), "profile": profile}
 
-            _publish_notification_to_redis(redis_client, task_id_str, failed_message)
-            return {"status": failed_message["status"], "result": None, "task_id": task_id_str}
+        return _complete_task(redis_client, task_id, password_found, start_time,
+                              timings=timings.snapshot(), profiles=[profile] if profile else [])
 
     except Exception as e:
         logger.error(f"[Task {task_id_str}] Ошибка во время bruteforce: {e}", exc_info=True)
-        elapsed_time_seconds = time.time() - start_time
-        elapsed_time_formatted = time.strftime("%H:%M:%S", time.gmtime(elapsed_time_seconds))
-        
-        async_to_sync(update_task_db_status)(task_id, "failed", 100, result=str(e)) # Обновляем БД с ошибкой
+        if profiler is not None:
+            profile = _save_profile(profiler, task_id, shard_index)
+            profiler = None
+        if sharded:
+            # Без этого диапазона результат задачи все равно неполный - останавливаем остальные шарды,
+            # а ошибку вернет finalize_bruteforce_task
+            _request_stop(redis_client, task_id_str, "failed")
+            return {"status": "FAILED", "error": str(e), "task_id": task_id_str, "shard": shard_index,
+                    "timings": timings.snapshot(), "profile": profile}
 
-        error_message_payload = {
-            "status": "FAILED", "task_id": task_id_str, "error": str(e),
-            "elapsed_time": elapsed_time_formatted
-        }
-        _publish_notification_to_redis(redis_client, task_id_str, error_message_payload)
+        _fail_task(redis_client, task_id, str(e), start_time,
+                   timings=timings.snapshot(), profiles=[profile] if profile else [])
         # Celery автоматически пометит задачу как FAILED, если возникло исключение
         raise # Перевыброс исключения, чтобы Celery обработал его как сбой задачи
     finally:
-        if redis_client:
-            try:
-                redis_client.close()
-                logger.info(f"[Task {task_id_str}] Синхронный Redis клиент для Celery закрыт.")
-            except Exception as e_close:
-                 logger.error(f"[Task {task_id_str}] Ошибка при закрытии Redis клиента: {e_close}")
+        if profiler is not None:
+            profiler.stop() # Прервано без результата (например, отменой) - профиль не нужен
+        metrics.set_gauge("rar_candidates_per_second", None, worker=worker_label, task_id=task_id_str, shard=checkpoint_shard)
+        control.close()
+        space.close()
+        if verifier is not None:
+            verifier.close()
+        if not sharded and not paused:
+            _cleanup_coordination_keys(redis_client, task_id_str)
+
+
+@shared_task(bind=True, name='app.services.bruteforce.finalize_bruteforce_task')
+def finalize_bruteforce_task(self, shard_results: List[Dict[str, Any]], task_id: int):
+    """Callback группы шардов (chord): объединяет результаты шардов и публикует итог задачи."""
+    task_id_str = str(task_id)
+    redis_client = shared_redis()
+    keep_coordination_keys = False
+    try:
+        start_time = _get_started_at(redis_client, task_id_str) or time.time()
+        statuses = {r.get("status") for r in shard_results}
+        password_found = next((r.get("result") for r in shard_results if r.get("status") == "FOUND"), None)
+        errors = [r.get("error") for r in shard_results if r.get("status") == "FAILED"]
+        timings = merge_timings(r.get("timings") for r in shard_results)
+        profiles = [r["profile"] for r in shard_results if r.get("profile")]
+        logger.info(f"[Task {task_id_str}] Все шарды завершены ({len(shard_results)}), найден пароль: {password_found is not None}")
+
+        if password_found is None and ("CANCELLED" in statuses or _control_command(redis_client, task_id_str) == "cancel"):
+            return _cancel_task(redis_client, task_id, start_time)
+        if password_found is None and errors:
+            _fail_task(redis_client, task_id, "; ".join(str(err) for err in errors), start_time,
+                       timings=timings, profiles=profiles)
+            return {"status": "FAILED", "result": None, "task_id": task_id_str}
+        if password_found is None and "PAUSED" in statuses:
+            keep_coordination_keys = True
+            # Если resume пришел, пока шарды останавливались, итог подведет группа возобновленных шардов
+            if _control_command(redis_client, task_id_str) != "pause":
+                logger.info(f"[Task {task_id_str}] Задача уже возобновлена, итог подведут возобновленные шарды.")
+                return {"status": "RESUMED", "result": None, "task_id": task_id_str}
+            return _pause_task(redis_client, task_id)
+        return _complete_task(redis_client, task_id, password_found, start_time, timings=timings, profiles=profiles)
+    finally:
+        if not keep_coordination_keys:
+            _cleanup_coordination_keys(redis_client, task_id_str)
 
 
 # --- Хелперы для обновления БД из Celery (асинхронные, вызываются через async_to_sync) ---
-async def update_task_db_status(task_id: int, status: str, progress: int, result: Optional[str] = None):
-    """Обновляет статус, прогресс и результат задачи в БД."""
-    values_to_update = {"status": status, "progress": progress}
-    if result is not None: # result может быть и пустой строкой, если пароль пустой
-        values_to_update["result"] = result
-    
+async def _ensure_celery_db_connected(task_id: int) -> bool:
     # Убедимся, что celery_db_instance подключен (хотя сигналы должны это гарантировать)
     if not celery_db_instance.is_connected:
         logger.warning(f"[DB Update Task {task_id}] celery_db_instance не подключен! Попытка подключения...")
@@ -174,11 +606,101 @@ async def update_task_db_status(task_id: int, status: str, progress: int, result
             await celery_db_instance.connect()
         except Exception as e_connect:
             logger.error(f"[DB Update Task {task_id}] Ошибка подключения celery_db_instance: {e_connect}")
-            return # Не можем обновить БД
+            return False
+    return True
+
 
-    query = task_table.update().where(task_table.c.id == task_id).values(**values_to_update)
+async def load_checkpoint(task_id: int, shard_index: int, start_index: int, end_index: int) -> int:
+    """
+    Возвращает ранг, с которого продолжать перебор диапазона шарда.
+    Если контрольной точки нет (или диапазон шарда изменился), создает ее в начале диапазона.
+    """
+    if not await _ensure_celery_db_connected(task_id):
+        return start_index
+    key = (task_checkpoint_table.c.task_id == task_id) & (task_checkpoint_table.c.shard_index == shard_index)
     try:
+        row = await celery_db_instance.fetch_one(task_checkpoint_table.select().where(key))
+        if row and row["start_index"] == start_index and row["end_index"] == end_index:
+            return min(max(row["checked_until"], start_index), end_index)
+        if row:
+            await celery_db_instance.execute(task_checkpoint_table.delete().where(key))
+        await celery_db_instance.execute(task_checkpoint_table.insert().values(
+            task_id=task_id, shard_index=shard_index, start_index=start_index, end_index=end_index,
+            checked_until=start_index, updated_at=time.time()
+        ))
+    except Exception as e_execute:
+        logger.error(f"[DB Checkpoint Task {task_id}] Ошибка чтения контрольной точки шарда {shard_index}: {e_execute}")
+    return start_index
+
+
+async def save_checkpoint(task_id: int, shard_index: int, checked_until: int):
+    """Сохраняет ранг, до которого диапазон шарда полностью проверен."""
+    if not await _ensure_celery_db_connected(task_id):
+        return
+    query = task_checkpoint_table.update().where(
+        (task_checkpoint_table.c.task_id == task_id) & (task_checkpoint_table.c.shard_index == shard_index)
+    ).values(checked_until=checked_until, updated_at=time.time())
+    try:
+        started = time.perf_counter()
         await celery_db_instance.execute(query)
+        metrics.observe("rar_db_write_seconds", time.perf_counter() - started, operation="checkpoint")
+        logger.info(f"[DB Checkpoint Task {task_id}] Шард {shard_index}: проверено до ранга {checked_until}")
+    except Exception as e_execute:
+        logger.error(f"[DB Checkpoint Task {task_id}] Ошибка сохранения контрольной точки: {e_execute}")
+
+
+async def save_task_timings(task_id: int, timings: Dict[str, float], profiles: Sequence[Dict[str, str]] = ()):
+    """Сохраняет разбивку времени задачи по фазам (и где лежат ее профили) в task_timings."""
+    if not await _ensure_celery_db_connected(task_id):
+        return
+    try:
+        await celery_db_instance.execute(task_timings_table.delete().where(task_timings_table.c.task_id == task_id))
+        await celery_db_instance.execute(task_timings_table.insert().values(
+            task_id=task_id, timings=json.dumps(timings), profiles=json.dumps(list(profiles)) if profiles else None,
+            updated_at=time.time()
+        ))
+    except Exception as e_execute:
+        logger.error(f"[DB Timings Task {task_id}] Ошибка сохранения разбивки времени: {e_execute}")
+
+
+async def delete_checkpoints(task_id: int):
+    """Удаляет контрольные точки завершенной задачи."""
+    if not await _ensure_celery_db_connected(task_id):
+        return
+    try:
+        await celery_db_instance.execute(task_checkpoint_table.delete().where(task_checkpoint_table.c.task_id == task_id))
+    except Exception as e_execute:
+        logger.error(f"[DB Checkpoint Task {task_id}] Ошибка удаления контрольных точек: {e_execute}")
+
+
+async def update_task_db_status(task_id: int, status: str, progress: Optional[int], result: Optional[str] = None,
+                                follower_ids: Sequence[int] = ()):
+    """
+    Обновляет статус, прогресс и результат задачи в БД (progress=None - прогресс не меняется).
+    follower_ids - задачи-последователи (тот же архив и пространство), получающие те же значения.
+    """
+    task_ids = [task_id, *follower_ids]
+    if status == "running" and progress is not None and result is None:
+        # Текущий прогресс копится и пишется пакетом вместе с прогрессом других задач воркера
+        for id_to_update in task_ids:
+            progress_writer.queue(id_to_update, status, progress)
+        return
+    for id_to_update in task_ids:
+        progress_writer.discard(id_to_update) # Накопленный прогресс не должен перезаписать итоговый статус
+    values_to_update = {"status": status}
+    if progress is not None:
+        values_to_update["progress"] = progress
+    if result is not None: # result может быть и пустой строкой, если пароль пустой
+        values_to_update["result"] = result
+    
+    if not await _ensure_celery_db_connected(task_id):
+        return # Не можем обновить БД
+
+    query = task_table.update().where(task_table.c.id.in_(task_ids)).values(**values_to_update)
+    try:
+        started = time.perf_counter()
+        await celery_db_instance.execute(query)
+        metrics.observe("rar_db_write_seconds", time.perf_counter() - started, operation="status")
         logger.info(f"[DB Update Task {task_id}] Статус обновлен: status={status}, progress={progress}, result='{result if result else 'N/A'}'")
     except Exception as e_execute:
         logger.error(f"[DB Update Task {task_id}] Ошибка выполнения запроса к БД: {e_execute}")
@@ -187,33 +709,87 @@ async def update_task_db_status(task_id: int, status: str, progress: int, result
 # Эта функция используется FastAPI эндпоинтом /get_status, поэтому она должна использовать `database` из FastAPI
 from app.db.database import database as fastapi_db_instance # импортируем с псевдонимом
 from app.schemas.task import TaskStatus as TaskStatusSchema # схема Pydantic
+from sqlalchemy import select
 
-async def get_task_status(task_id: int) -> Optional[TaskStatusSchema]:
-    """Получение статуса задачи из БД для FastAPI эндпоинта."""
-    if not fastapi_db_instance.is_connected:
-        # Это может быть излишним, если lifespan FastAPI гарантирует подключение для запросов
-        logger.warning(f"FastAPI DB (fastapi_db_instance) не подключена при вызове get_task_status для {task_id}, попытка подключения.")
+async def get_task_status(task_id: int, redis_client=None) -> Optional[TaskStatusSchema]:
+    """Получение статуса задачи для FastAPI эндпоинта: из кэша статусов, при промахе - из БД."""
+    return (await get_task_statuses([task_id], redis_client)).get(task_id)
+
+
+async def get_task_statuses(task_ids: Sequence[int], redis_client=None) -> Dict[int, TaskStatusSchema]:
+    """
+    Статусы нескольких задач: одно чтение кэша пайплайном и один запрос к БД для промахов.
+    Ненайденных задач в результате нет.
+    """
+    statuses: Dict[int, Dict[str, Any]] = {}
+    if redis_client:
         try:
+            statuses = await get_cached_statuses(redis_client, task_ids)
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"Кэш статусов недоступен, статусы читаются из БД: {e}")
+            redis_client = None
+
+    missing = [task_id for task_id in task_ids if task_id not in statuses]
+    if missing:
+        if not fastapi_db_instance.is_connected:
+            # Это может быть излишним, если lifespan FastAPI гарантирует подключение для запросов
+            logger.warning("FastAPI DB (fastapi_db_instance) не подключена при чтении статусов задач, попытка подключения.")
+            try:
+                await fastapi_db_instance.connect()
+            except Exception as e_connect_fastapi:
+                logger.error(f"Ошибка подключения fastapi_db_instance в get_task_statuses: {e_connect_fastapi}")
+                return {task_id: TaskStatusSchema(**row) for task_id, row in statuses.items()}
+
+        query = (select(task_table.c.id, task_table.c.status, task_table.c.progress, task_table.c.result)
+                 .where(task_table.c.id.in_(missing)))
+        rows = [{"task_id": row["id"], "status": row["status"], "progress": row["progress"], "result": row["result"]}
+                for row in await fastapi_db_instance.fetch_all(query)]
+        if redis_client and rows:
+            try:
+                await populate_statuses(redis_client, rows)
+            except redis.exceptions.RedisError as e:
+                logger.warning(f"Ошибка записи статусов в кэш: {e}")
+        statuses.update((row["task_id"], row) for row in rows)
+
+    return {task_id: TaskStatusSchema(**statuses[task_id]) for task_id in task_ids if task_id in statuses}
+
+
+async def get_live_progress(redis_client, task_id_str: str) -> Tuple[int, float]:
+    """(пройдено рангов, комбинаций в секунду) по всем шардам задачи - для ETA на стороне FastAPI."""
+    if not redis_client:
+        return 0, 0.0
+    progress = await redis_client.hvals(_progress_key(task_id_str))
+    cps = await redis_client.hvals(_cps_key(task_id_str))
+    return sum(int(value) for value in progress), sum(float(value) for value in cps)
+
+
+async def resume_paused_task(task_ids: Sequence[int], redis_client=None):
+    """
+    Возобновленная задача (и ее последователи) снова running. Пишется здесь, а не прогрессом шардов:
+    пакет прогресса и кэш статусов не перезаписывают paused.
+    """
+    if not fastapi_db_instance.is_connected:
+        await fastapi_db_instance.connect()
+    await fastapi_db_instance.execute(task_table.update()
+                                      .where(task_table.c.id.in_(task_ids), task_table.c.status == "paused")
+                                      .values(status="running"))
+    await cache_task_status_async(redis_client, task_ids, "running")
+    logger.info(f"Задача {task_ids[0]} возобновлена")
+
+
+async def cancel_paused_task(task_id: int, redis_client=None) -> bool:
+    """
+    Отмена приостановленной (или отложенной) задачи: ни один воркер ее сейчас не выполняет,
+    поэтому итог записывается на стороне FastAPI. False - отмену записать не удалось (ошибка в логе).
+    """
+    try:
+        if not fastapi_db_instance.is_connected:
             await fastapi_db_instance.connect()
-        except Exception as e_connect_fastapi:
-            logger.error(f"Ошибка подключения fastapi_db_instance в get_task_status: {e_connect_fastapi}")
-            return None # Не можем получить статус
-
-    # Используй select() из SQLAlchemy core или select(Task) если у тебя есть ORM модель Task
-    # query = task_table.select().where(task_table.c.id == task_id) # Для SQLAlchemy core
-    # Для SQLAlchemy ORM (если task_table это __table__ модели Task):
-    # query = select(Task).where(Task.id == task_id)
-    
-    # Пример для SQLAlchemy core:
-    query = task_table.select().where(task_table.c.id == task_id)
-    task_row = await fastapi_db_instance.fetch_one(query)
-    
-    if task_row:
-        # Преобразуем результат из БД (RowProxy) в Pydantic схему
-        return TaskStatusSchema(
-            task_id=task_row["id"],
-            status=task_row["status"],
-            progress=task_row["progress"],
-            result=task_row["result"]
-        )
-    return None
\ No newline at end of file
+        await fastapi_db_instance.execute(task_table.update().where(task_table.c.id == task_id).values(status="cancelled"))
+        await cache_task_status_async(redis_client, [task_id], "cancelled")
+        await fastapi_db_instance.execute(task_checkpoint_table.delete().where(task_checkpoint_table.c.task_id == task_id))
+    except Exception as e:
+        logger.error(f"[Task {task_id}] Ошибка отмены приостановленной задачи: {e}", exc_info=True)
+        return False
+    logger.info(f"Приостановленная задача {task_id} отменена")
+    return True
@@ -0,0 +1,117 @@
+# app/services/control.py
+from typing import Any, Dict, List, Optional
+import json
+import logging
+import redis # Синхронный клиент Redis для Celery
+import redis.asyncio as aioredis # Асинхронный клиент для FastAPI
+
+logger = logging.getLogger(__name__)
+
+# Управление задачей перебора (pause/resume/cancel) от клиента WebSocket до воркеров:
+# - bruteforce:{id}:control - текущая команда ("pause" или "cancel"); ее видят и шарды,
+#   которые запустятся позже (еще стоят в очереди);
+# - control:{id} - канал Redis, по которому команда мгновенно доходит до уже работающих шардов;
+# - bruteforce:{id}:paused - hash: номер шарда -> параметры для повторной отправки шарда после resume. TTL PAUSED_KEY_TTL.
+CONTROL_COMMANDS = ("pause", "resume", "cancel")
+CONTROL_KEY_TTL = 24 * 3600
+PAUSED_KEY_TTL = 7 * 24 * 3600 # Пауза дольше - брошенная задача: resume ее уже не продолжит, только cancel
+
+def control_key(task_id_str: str) -> str:
+    return f"bruteforce:{task_id_str}:control"
+
+def control_channel(task_id_str: str) -> str:
+    return f"control:{task_id_str}"
+
+def paused_key(task_id_str: str) -> str:
+    return f"bruteforce:{task_id_str}:paused"
+
+def _paused_field(shard_index: Optional[int]) -> str:
+    return "all" if shard_index is None else str(shard_index)
+
+
+class ControlListener:
+    """
+    Сторона воркера: подписка на канал управления задачей.
+    poll() не ходит в Redis по сети, а только разбирает уже пришедшие сообщения,
+    поэтому его можно вызывать после каждого пакета кандидатов.
+    """
+
+    def __init__(self, redis_client: Optional[redis.Redis], task_id_str: str):
+        self.task_id_str = task_id_str
+        self.command: Optional[str] = None
+        self.pubsub = None
+        if not redis_client:
+            return
+        try:
+            # Сначала подписка, потом чтение ключа - так команда не потеряется между ними
+            self.pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            self.pubsub.subscribe(control_channel(task_id_str))
+            value = redis_client.get(control_key(task_id_str))
+            if value is not None:
+                self.command = value.decode("utf-8")
+        except redis.exceptions.RedisError as e:
+            logger.error(f"[Task {task_id_str}] Ошибка Redis при подписке на канал управления: {e}")
+            self.pubsub = None
+
+    def poll(self) -> Optional[str]:
+        """Возвращает действующую команду ("pause", "cancel") или None."""
+        if self.pubsub is None:
+            return self.command
+        try:
+            while True:
+                message = self.pubsub.get_message(timeout=0)
+                if message is None:
+                    break
+                if message.get("type") != "message":
+                    continue
+                command = message["data"].decode("utf-8")
+                self.command = None if command == "resume" else command
+        except redis.exceptions.RedisError as e:
+            logger.error(f"[Task {self.task_id_str}] Ошибка Redis при чтении канала управления: {e}")
+        return self.command
+
+    def should_stop(self) -> bool:
+        return self.poll() is not None
+
+    def close(self):
+        if self.pubsub is not None:
+            try:
+                self.pubsub.close()
+            except Exception as e_close:
+                logger.error(f"[Task {self.task_id_str}] Ошибка при закрытии подписки на канал управления: {e_close}")
+
+
+def mark_paused(redis_client: Optional[redis.Redis], task_id_str: str, shard_index: Optional[int],
+                dispatch_args: Dict[str, Any]):
+    """Запоминает приостановленный шард, чтобы resume отправил его в очередь заново."""
+    if not redis_client:
+        return
+    try:
+        # Ключ удаляется при resume/cancel; TTL продлевается каждым приостановленным шардом
+        pipe = redis_client.pipeline()
+        pipe.hset(paused_key(task_id_str), _paused_field(shard_index), json.dumps(dispatch_args))
+        pipe.expire(paused_key(task_id_str), PAUSED_KEY_TTL)
+        pipe.execute()
+    except redis.exceptions.RedisError as e:
+        logger.error(f"[Task {task_id_str}] Ошибка Redis при сохранении приостановленного шарда: {e}")
+
+
+async def send_control_command(redis_client: aioredis.Redis, task_id_str: str, command: str) -> List[Dict[str, Any]]:
+    """
+    Сторона FastAPI: передает команду воркерам задачи.
+    Для resume и cancel возвращает (и забирает из Redis) параметры приостановленных шардов.
+    """
+    pipe = redis_client.pipeline(transaction=True)
+    if command == "resume":
+        pipe.delete(control_key(task_id_str))
+    else:
+        pipe.set(control_key(task_id_str), command, ex=CONTROL_KEY_TTL)
+    pipe.publish(control_channel(task_id_str), command)
+    if command in ("resume", "cancel"):
+        pipe.hvals(paused_key(task_id_str))
+        pipe.delete(paused_key(task_id_str))
+    results = await pipe.execute()
+    logger.info(f"[Task {task_id_str}] Команда '{command}' отправлена в канал управления, получили воркеров: {results[1]}")
+    if command == "pause":
+        return []
+    return [json.loads(value) for value in results[2]]
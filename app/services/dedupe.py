@@ -0,0 +1,197 @@
+# app/services/dedupe.py
+from typing import Any, Dict, List, Optional, Sequence
+import hashlib
+import json
+import logging
+import redis # Синхронный клиент Redis для Celery
+import redis.asyncio as aioredis # Асинхронный клиент для FastAPI
+from sqlalchemy import select
+from app.db.database import database, task_table
+from app.services.rar_tools import file_sha256
+
+logger = logging.getLogger(__name__)
+
+# Дедупликация задач по содержимому архива:
+# - tasks.hash хранит sha256 архива, поэтому уже найденный пароль того же архива берется прямо из БД;
+# - job:{отпечаток} -> id основной задачи, которая сейчас перебирает этот архив в этом пространстве;
+#   новая такая же задача становится "последователем" основной и не занимает воркер;
+# - bruteforce:{id}:followers - set id последователей: воркер дублирует им уведомления и записи в БД;
+# - bruteforce:{id}:job - отпечаток основной задачи (для снятия job: ключа), bruteforce:{id}:primary - у последователя.
+# JOB_KEY_TTL - только страховка от брошенных ключей: пока задача перебирает, воркер продлевает ее ключи
+# (refresh_jobs на каждой контрольной точке), пока она отложена или на паузе - admit_deferred_tasks;
+# по завершении ключи снимают release_job и clear_followers.
+JOB_KEY_TTL = 24 * 3600
+
+def job_key(fingerprint: str) -> str:
+    return f"job:{fingerprint}"
+
+def followers_key(task_id_str: str) -> str:
+    return f"bruteforce:{task_id_str}:followers"
+
+def task_job_key(task_id_str: str) -> str:
+    return f"bruteforce:{task_id_str}:job"
+
+def primary_key(task_id_str: str) -> str:
+    return f"bruteforce:{task_id_str}:primary"
+
+
+def job_fingerprint(archive_sha256: str, charset: str, max_length: int, attack_options: Dict[str, Any]) -> str:
+    """Отпечаток задачи: архив + пространство перебора (словарь учитывается по содержимому, а не по пути)."""
+    options = dict(attack_options)
+    if options.get("wordlist_path"):
+        options["wordlist_path"] = file_sha256(options["wordlist_path"])
+    if not options:
+        options = {"charset": charset, "max_length": max_length}
+    payload = json.dumps({"archive": archive_sha256, "space": options}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def find_cached_password(archive_sha256: str) -> Optional[str]:
+    """Пароль, уже найденный для архива с тем же содержимым, или None."""
+    query = (select(task_table.c.result)
+             .where((task_table.c.hash == archive_sha256) & (task_table.c.status == "completed"))
+             .limit(1))
+    row = await database.fetch_one(query)
+    return row["result"] if row else None
+
+
+async def find_cached_passwords(archive_hashes: Sequence[str]) -> Dict[str, str]:
+    """Уже найденные пароли для пачки архивов одним запросом: {sha256: пароль}."""
+    if not archive_hashes:
+        return {}
+    query = (select(task_table.c.hash, task_table.c.result)
+             .where(task_table.c.hash.in_(set(archive_hashes)) & (task_table.c.status == "completed")))
+    return {row["hash"]: row["result"] for row in await database.fetch_all(query)}
+
+
+# Присоединение и снятие задачи атомарны (Lua): последователь либо попадает в set до того, как
+# основная задача сняла job: ключ (и тогда получит итог), либо не присоединяется вовсе
+_ATTACH_SCRIPT = """
+local primary = redis.call('GET', KEYS[1])
+if not primary then return false end
+redis.call('SADD', 'bruteforce:' .. primary .. ':followers', ARGV[1])
+redis.call('EXPIRE', 'bruteforce:' .. primary .. ':followers', ARGV[2])
+redis.call('SET', 'bruteforce:' .. ARGV[1] .. ':primary', primary, 'EX', ARGV[2])
+return primary
+"""
+
+async def attach_to_running_job(redis_client: aioredis.Redis, fingerprint: str, task_id: int) -> Optional[int]:
+    """Делает task_id последователем выполняющейся такой же задачи. Возвращает id основной задачи или None."""
+    primary = await redis_client.eval(_ATTACH_SCRIPT, 1, job_key(fingerprint), str(task_id), JOB_KEY_TTL)
+    return int(primary) if primary else None
+
+
+async def register_job(redis_client: aioredis.Redis, fingerprint: str, task_id: int) -> bool:
+    """
+    Регистрирует task_id как основную задачу для отпечатка.
+    False - такую же задачу только что зарегистрировал другой запрос (к ней нужно присоединиться).
+    """
+    if not await redis_client.set(job_key(fingerprint), str(task_id), ex=JOB_KEY_TTL, nx=True):
+        return False
+    await redis_client.set(task_job_key(str(task_id)), fingerprint, ex=JOB_KEY_TTL)
+    return True
+
+
+async def get_followers(redis_client: aioredis.Redis, task_id_str: str) -> List[int]:
+    return [int(member) for member in await redis_client.smembers(followers_key(task_id_str))]
+
+
+async def release_job_async(redis_client: aioredis.Redis, task_id_str: str):
+    """То же, что release_job, для FastAPI (отмена приостановленной задачи)."""
+    await redis_client.eval(_RELEASE_SCRIPT, 1, task_job_key(task_id_str), task_id_str)
+
+
+async def clear_followers_async(redis_client: aioredis.Redis, task_id_str: str):
+    """То же, что clear_followers, для FastAPI (отмена приостановленной задачи)."""
+    await redis_client.eval(_CLEAR_FOLLOWERS_SCRIPT, 1, followers_key(task_id_str))
+
+
+async def get_primary_task(redis_client: aioredis.Redis, task_id_str: str) -> Optional[str]:
+    """Для последователя - id основной задачи, иначе None."""
+    primary = await redis_client.get(primary_key(task_id_str))
+    return primary.decode("utf-8") if primary is not None else None
+
+
+async def detach_follower(redis_client: aioredis.Redis, task_id_str: str, primary_id_str: str):
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.srem(followers_key(primary_id_str), task_id_str)
+    pipe.delete(primary_key(task_id_str))
+    await pipe.execute()
+
+
+# --- Сторона воркера ---
+
+def task_followers(redis_client: Optional[redis.Redis], task_id_str: str) -> List[int]:
+    if not redis_client:
+        return []
+    try:
+        return [int(member) for member in redis_client.smembers(followers_key(task_id_str))]
+    except redis.exceptions.RedisError as e:
+        logger.error(f"[Task {task_id_str}] Ошибка Redis при чтении последователей задачи: {e}")
+        return []
+
+
+_RELEASE_SCRIPT = """
+local fingerprint = redis.call('GET', KEYS[1])
+if fingerprint and redis.call('GET', 'job:' .. fingerprint) == ARGV[1] then
+    redis.call('DEL', 'job:' .. fingerprint)
+end
+redis.call('DEL', KEYS[1])
+return 1
+"""
+
+def release_job(redis_client: Optional[redis.Redis], task_id_str: str):
+    """Снимает job: ключ завершившейся задачи - новые такие же задачи больше к ней не присоединяются."""
+    if not redis_client:
+        return
+    try:
+        redis_client.eval(_RELEASE_SCRIPT, 1, task_job_key(task_id_str), task_id_str)
+    except redis.exceptions.RedisError as e:
+        logger.error(f"[Task {task_id_str}] Ошибка Redis при снятии ключа задачи: {e}")
+
+
+# Продление ключей задачи и ее последователей; job: ключ продлевается, только если он еще указывает на эту задачу
+_REFRESH_SCRIPT = """
+local fingerprint = redis.call('GET', KEYS[1])
+if fingerprint then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    if redis.call('GET', 'job:' .. fingerprint) == ARGV[1] then
+        redis.call('EXPIRE', 'job:' .. fingerprint, ARGV[2])
+    end
+end
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+for _, follower in ipairs(redis.call('SMEMBERS', KEYS[2])) do
+    redis.call('EXPIRE', 'bruteforce:' .. follower .. ':primary', ARGV[2])
+end
+return 1
+"""
+
+def refresh_jobs(redis_client: Optional[redis.Redis], task_id_strs: Sequence[str]):
+    """Продлевает JOB_KEY_TTL ключей дедупликации задач, которые еще не завершены."""
+    if not redis_client or not task_id_strs:
+        return
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for task_id_str in task_id_strs:
+            pipe.eval(_REFRESH_SCRIPT, 2, task_job_key(task_id_str), followers_key(task_id_str), task_id_str, JOB_KEY_TTL)
+        pipe.execute()
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Ошибка Redis при продлении ключей задач {', '.join(task_id_strs)}: {e}")
+
+
+_CLEAR_FOLLOWERS_SCRIPT = """
+for _, follower in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    redis.call('DEL', 'bruteforce:' .. follower .. ':primary')
+end
+redis.call('DEL', KEYS[1])
+return 1
+"""
+
+def clear_followers(redis_client: Optional[redis.Redis], task_id_str: str):
+    """Снимает set последователей завершившейся задачи и их ссылки на нее (bruteforce:{id}:primary)."""
+    if not redis_client:
+        return
+    try:
+        redis_client.eval(_CLEAR_FOLLOWERS_SCRIPT, 1, followers_key(task_id_str))
+    except redis.exceptions.RedisError as e:
+        logger.error(f"[Task {task_id_str}] Ошибка Redis при снятии последователей задачи: {e}")
@@ -0,0 +1,158 @@
+# app/services/dispatch.py
+from typing import Any, Dict, List, Optional, Tuple
+from celery import chord, group
+import logging
+import time
+from app.celery.celery import app as celery_app_instance # Экземпляр Celery из celery.py
+from app.core.config import settings
+from app.services.keyspace import build_candidate_space, split_keyspace
+from app.services.scheduling import SHORT_QUEUE, default_route # Очереди по размеру задачи и приоритеты
+
+logger = logging.getLogger(__name__)
+
+BRUTEFORCE_TASK_NAME = 'app.services.bruteforce.bruteforce_rar_task'
+FINALIZE_TASK_NAME = 'app.services.bruteforce.finalize_bruteforce_task'
+
+
+def effective_shard_count(total: int, requested_shards: int, min_shards: int = 1) -> int:
+    """
+    Сколько шардов реально имеет смысл запускать для пространства перебора из total рангов.
+    min_shards - сколько нужно, чтобы шард успел до передоставки брокером (estimator.required_shards):
+    важнее запрошенного числа и BRUTEFORCE_MIN_SHARD_SIZE.
+    """
+    # Слишком мелкие шарды тратят больше на накладные расходы Celery, чем на перебор
+    by_size = max(1, -(-total // settings.BRUTEFORCE_MIN_SHARD_SIZE))
+    shards = max(min(requested_shards, by_size), min_shards)
+    return max(1, min(shards, total, settings.BRUTEFORCE_MAX_SHARDS))
+
+
+def dispatch_bruteforce(task_id: int, rar_path: str, charset: str, max_length: int, shards: int,
+                        local_pool: bool = False, attack_options: Optional[Dict[str, Any]] = None,
+                        route: Optional[Dict[str, Any]] = None, submitted_at: Optional[float] = None,
+                        min_shards: int = 1) -> int:
+    """
+    Отправляет задачу перебора в Celery.
+    Если шардов больше одного, пространство делится на диапазоны индексов,
+    которые выполняются группой задач (chord), а итог собирает finalize_bruteforce_task.
+    local_pool=True включает перебор пулом процессов внутри каждой задачи (шарда).
+    attack_options - параметры build_candidate_space для словаря/маски/гибрида
+    (без них перебираются charset/max_length).
+    route - очередь и приоритет сообщений (scheduling.route_for).
+    submitted_at - время постановки задачи (у отложенной - время запроса, а не отправки); по умолчанию - сейчас.
+    min_shards - не меньше стольких шардов, чтобы каждый укладывался в SHARD_MAX_SECONDS.
+    Возвращает фактическое число шардов.
+    """
+    attack_options = attack_options or {}
+    route = route or default_route()
+    submitted_at = submitted_at or time.time()
+    ranges = _shard_ranges(charset, max_length, shards, attack_options, min_shards)
+    if len(ranges) == 1:
+        _single_signature(task_id, rar_path, charset, max_length, local_pool, attack_options, route,
+                          submitted_at).apply_async()
+        logger.info(f"Задача {task_id} отправлена в Celery одним куском (очередь {route['queue']}, приоритет {route['priority']})")
+        return 1
+
+    _send_shards(task_id, _shard_specs(rar_path, charset, max_length, local_pool, attack_options, ranges), route,
+                 submitted_at)
+    logger.info(f"Задача {task_id} отправлена в Celery группой из {len(ranges)} шардов "
+                f"(очередь {route['queue']}, приоритет {route['priority']})")
+    return len(ranges)
+
+
+def dispatch_bruteforce_batch(jobs: List[Dict[str, Any]]) -> List[int]:
+    """
+    Отправляет пачку задач: jobs - [{"task_id": ..., аргументы dispatch_bruteforce}].
+    Задачи из одного куска уходят одной группой (все сообщения - через одно соединение с брокером),
+    шардированные - каждая своим chord. Возвращает фактическое число шардов каждой задачи.
+    """
+    singles = []
+    shard_counts = []
+    for job in jobs:
+        attack_options = job.get("attack_options") or {}
+        route = job.get("route") or default_route()
+        submitted_at = job.get("submitted_at") or time.time()
+        ranges = _shard_ranges(job["charset"], job["max_length"], job["shards"], attack_options, job.get("min_shards", 1))
+        if len(ranges) == 1:
+            singles.append(_single_signature(job["task_id"], job["rar_path"], job["charset"], job["max_length"],
+                                             job.get("local_pool", False), attack_options, route, submitted_at))
+        else:
+            _send_shards(job["task_id"], _shard_specs(job["rar_path"], job["charset"], job["max_length"],
+                                                      job.get("local_pool", False), attack_options, ranges), route,
+                         submitted_at)
+        shard_counts.append(len(ranges))
+    if singles:
+        group(singles).apply_async()
+    logger.info(f"Пачка из {len(jobs)} задач отправлена в Celery: одним куском - {len(singles)}, "
+                f"шардированных - {len(jobs) - len(singles)}")
+    return shard_counts
+
+
+def _shard_ranges(charset: str, max_length: int, shards: int, attack_options: Dict[str, Any],
+                  min_shards: int = 1) -> List[Tuple[int, int]]:
+    space = build_candidate_space(charset, max_length, **attack_options)
+    total = space.size # Точный размер пространства: по маске, байтам словаря или charset/max_length
+    space.close()
+    return split_keyspace(total, effective_shard_count(total, shards, min_shards))
+
+
+def _shard_specs(rar_path: str, charset: str, max_length: int, local_pool: bool, attack_options: Dict[str, Any],
+                 ranges: List[Tuple[int, int]]) -> List[Dict[str, Any]]:
+    return [
+        {"rar_path": rar_path, "charset": charset, "max_length": max_length, "shard_index": shard_index,
+         "start_index": start, "end_index": end, "local_pool": local_pool, "attack_options": attack_options}
+        for shard_index, (start, end) in enumerate(ranges)
+    ]
+
+
+def _single_signature(task_id: int, rar_path: str, charset: str, max_length: int, local_pool: bool,
+                      attack_options: Optional[Dict[str, Any]], route: Dict[str, Any], submitted_at: Optional[float] = None):
+    """Сообщение задачи, которая перебирается одним куском (без шардов)."""
+    return celery_app_instance.signature(
+        BRUTEFORCE_TASK_NAME, # Имя задачи
+        args=[rar_path, charset, max_length, task_id], # Аргументы для задачи
+        kwargs={"local_pool": local_pool, "attack_options": attack_options, "submitted_at": submitted_at},
+        queue=route["queue"], priority=route["priority"]
+    )
+
+
+def _send_shards(task_id: int, shards: List[Dict[str, Any]], route: Dict[str, Any], submitted_at: Optional[float] = None):
+    """
+    Отправляет шарды группой (chord) с finalize_bruteforce_task в качестве итога.
+    Итог короткий - он всегда идет в очередь коротких задач с высшим приоритетом.
+    submitted_at передается только при первой отправке (не при resume).
+    """
+    header = group(
+        celery_app_instance.signature(
+            BRUTEFORCE_TASK_NAME,
+            args=[shard["rar_path"], shard["charset"], shard["max_length"], task_id],
+            kwargs={"shard_index": shard["shard_index"], "start_index": shard["start_index"],
+                    "end_index": shard["end_index"], "local_pool": shard["local_pool"],
+                    "attack_options": shard.get("attack_options"), "submitted_at": submitted_at},
+            queue=route["queue"], priority=route["priority"]
+        )
+        for shard in shards
+    )
+    callback = celery_app_instance.signature(FINALIZE_TASK_NAME, kwargs={"task_id": task_id},
+                                             queue=SHORT_QUEUE, priority=0)
+    chord(header)(callback)
+
+
+def resume_paused_shards(task_id: int, paused_shards: List[Dict[str, Any]],
+                         route: Optional[Dict[str, Any]] = None) -> int:
+    """
+    Снова отправляет в очередь приостановленные шарды задачи (их параметры сохранил воркер при паузе).
+    Шарды продолжат перебор со своих контрольных точек. Возвращает число отправленных шардов.
+    """
+    if not paused_shards:
+        return 0
+    route = route or default_route()
+    unsharded = [shard for shard in paused_shards if shard["shard_index"] is None]
+    if unsharded:
+        shard = unsharded[0]
+        _single_signature(task_id, shard["rar_path"], shard["charset"], shard["max_length"], shard["local_pool"],
+                          shard.get("attack_options"), route).apply_async()
+        logger.info(f"Задача {task_id} возобновлена одним куском")
+        return 1
+    _send_shards(task_id, sorted(paused_shards, key=lambda shard: shard["shard_index"]), route)
+    logger.info(f"Задача {task_id} возобновлена: снова отправлено шардов - {len(paused_shards)}")
+    return len(paused_shards)
@@ -0,0 +1,146 @@
+# app/services/estimator.py
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, Optional
+import json
+import logging
+import math
+import redis # Синхронный клиент Redis для Celery
+import redis.asyncio as aioredis # Асинхронный клиент для FastAPI
+from app.core.config import settings
+from app.services.keyspace import build_candidate_space
+from app.services.local_pool import pool_size
+from app.services.rar_tools import VerificationPlan
+
+logger = logging.getLogger(__name__)
+
+# Оценка стоимости перебора:
+# - стоимость одного кандидата определяется режимом проверки архива (и числом итераций KDF),
+#   поэтому воркеры записывают измеренную скорость одного слота (процесса) в cluster:throughput
+#   по ключу "режим:kdf" (скользящее среднее); пока замеров нет - ESTIMATE_DEFAULT_CPS;
+# - время = кандидатов / (скорость слота * слотов), слотов - не больше шардов и CLUSTER_WORKER_SLOTS;
+# - bruteforce:{id}:estimate - оценка задачи при создании, из нее считается ETA задач в очереди.
+THROUGHPUT_KEY = "cluster:throughput"
+THROUGHPUT_EWMA_ALPHA = 0.3
+ESTIMATE_KEY_TTL = 7 * 24 * 3600
+
+def estimate_key(task_id_str: str) -> str:
+    return f"bruteforce:{task_id_str}:estimate"
+
+def throughput_field(plan: VerificationPlan) -> str:
+    return f"{plan.mode}:{plan.kdf_count}"
+
+
+@dataclass
+class JobEstimate:
+    keyspace: int # Рангов в пространстве перебора
+    candidates: int # Кандидатов (у словаря с правилами не совпадает с рангами)
+    cps_per_slot: float
+    slots: int
+    measured: bool # Скорость измерена воркерами, а не взята по умолчанию
+
+    @property
+    def seconds(self) -> float:
+        return self.candidates / (self.cps_per_slot * self.slots)
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, raw) -> "JobEstimate":
+        return cls(**json.loads(raw))
+
+
+def required_shards(estimate: JobEstimate) -> int:
+    """
+    Сколько шардов нужно, чтобы каждый успел за SHARD_MAX_SECONDS (по скорости одного слота,
+    без ускорения local_pool - с запасом).
+    """
+    return max(1, math.ceil(estimate.candidates / (estimate.cps_per_slot * settings.SHARD_MAX_SECONDS)))
+
+
+def check_shard_time_budget():
+    """
+    Проверка настроек при запуске API и воркеров: шард должен успевать до передоставки брокером,
+    а любую задачу в пределах ADMISSION_MAX_ESTIMATED_SECONDS должно быть можно разбить на такие шарды.
+    """
+    if settings.SHARD_MAX_SECONDS >= settings.BROKER_VISIBILITY_TIMEOUT:
+        raise RuntimeError(f"SHARD_MAX_SECONDS ({settings.SHARD_MAX_SECONDS:.0f} с) должен быть меньше "
+                           f"BROKER_VISIBILITY_TIMEOUT ({settings.BROKER_VISIBILITY_TIMEOUT} с)")
+    # Оценка задачи - время на всех слотах кластера; работа одного слота - в CLUSTER_WORKER_SLOTS раз больше
+    worst_shard_seconds = (settings.ADMISSION_MAX_ESTIMATED_SECONDS * settings.CLUSTER_WORKER_SLOTS
+                           / settings.BRUTEFORCE_MAX_SHARDS)
+    if worst_shard_seconds > settings.SHARD_MAX_SECONDS:
+        raise RuntimeError(f"Задача в пределах ADMISSION_MAX_ESTIMATED_SECONDS на BRUTEFORCE_MAX_SHARDS шардах "
+                           f"дает шард до {worst_shard_seconds:.0f} с - больше SHARD_MAX_SECONDS "
+                           f"({settings.SHARD_MAX_SECONDS:.0f} с): уменьшите бюджет или увеличьте BROKER_VISIBILITY_TIMEOUT")
+
+
+def estimate_space(charset: str, max_length: int, attack_options: Dict[str, Any]):
+    """(рангов, кандидатов) пространства перебора. Для словаря читает начало файла - вызывать в пуле потоков."""
+    space = build_candidate_space(charset, max_length, **attack_options)
+    try:
+        return space.size, space.estimate_candidates()
+    finally:
+        space.close()
+
+
+async def estimate_job(redis_client: Optional[aioredis.Redis], plan: VerificationPlan, keyspace: int, candidates: int,
+                       shards: int, local_pool: bool) -> JobEstimate:
+    cps_per_slot = None
+    if redis_client:
+        raw = await redis_client.hget(THROUGHPUT_KEY, throughput_field(plan))
+        cps_per_slot = float(raw) if raw else None
+    measured = cps_per_slot is not None
+    slots = max(1, min(shards, settings.CLUSTER_WORKER_SLOTS))
+    if local_pool:
+        slots *= pool_size() # Оценка по ядрам хоста API - для однотипных хостов этого достаточно
+    return JobEstimate(keyspace, candidates, cps_per_slot if measured else settings.ESTIMATE_DEFAULT_CPS, slots, measured)
+
+
+async def save_estimate(redis_client: Optional[aioredis.Redis], task_id: int, estimate: JobEstimate):
+    if redis_client:
+        await redis_client.set(estimate_key(str(task_id)), estimate.to_json(), ex=ESTIMATE_KEY_TTL)
+
+
+async def load_estimate(redis_client: Optional[aioredis.Redis], task_id_str: str) -> Optional[JobEstimate]:
+    if not redis_client:
+        return None
+    raw = await redis_client.get(estimate_key(task_id_str))
+    return JobEstimate.from_json(raw) if raw else None
+
+
+def eta_seconds(estimate: JobEstimate, processed: int, cps: float) -> float:
+    """
+    Оставшееся время: по текущей суммарной скорости шардов, если задача уже выполняется,
+    иначе по оценке при создании.
+    """
+    remaining_ranks = max(estimate.keyspace - processed, 0)
+    remaining_candidates = remaining_ranks * estimate.candidates / estimate.keyspace if estimate.keyspace else 0
+    if cps > 0:
+        return remaining_candidates / cps
+    return remaining_candidates / (estimate.cps_per_slot * estimate.slots)
+
+
+# --- Сторона воркера ---
+
+# Скользящее среднее обновляется атомарно (Lua): шарды разных процессов пишут скорость одновременно,
+# и при отдельных HGET и HSET обновления друг друга терялись бы. ARGV: поле (режим:kdf), скорость слота, alpha
+_RECORD_THROUGHPUT_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+local value = tonumber(ARGV[2])
+if current then
+    value = (1 - tonumber(ARGV[3])) * tonumber(current) + tonumber(ARGV[3]) * value
+end
+redis.call('HSET', KEYS[1], ARGV[1], tostring(value))
+return tostring(value)
+"""
+
+def record_throughput(redis_client: Optional[redis.Redis], plan: VerificationPlan, cps_per_slot: float, task_id_str: str):
+    """Обновляет измеренную скорость одного слота для режима проверки архива (скользящее среднее)."""
+    if not redis_client or cps_per_slot <= 0:
+        return
+    try:
+        redis_client.eval(_RECORD_THROUGHPUT_SCRIPT, 1, THROUGHPUT_KEY, throughput_field(plan), repr(float(cps_per_slot)),
+                          THROUGHPUT_EWMA_ALPHA)
+    except redis.exceptions.RedisError as e:
+        logger.error(f"[Task {task_id_str}] Ошибка Redis при записи измеренной скорости: {e}")
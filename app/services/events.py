@@ -0,0 +1,113 @@
+# app/services/events.py
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import logging
+import msgpack # Компактный формат уведомлений в Redis
+import redis.asyncio as aioredis # Асинхронный клиент для FastAPI
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Журнал уведомлений задачи для клиентов, подключившихся поздно или переподключившихся:
+# - events:{task_id} - Redis Stream (не длиннее WS_EVENT_STREAM_MAXLEN), каждое уведомление пишется
+#   туда и публикуется в ws:{task_id} одним Lua-скриптом, с id записи потока в качестве event_id;
+# - при подключении клиент получает последнее состояние (snapshot) или, если передал last_event_id,
+#   все уведомления после него; дальше - обычные уведомления из канала.
+# Поток живет EVENT_STREAM_TTL после последнего уведомления - итог задачи виден и после ее завершения.
+EVENT_STREAM_TTL = 24 * 3600
+
+def events_key(task_id_str: str) -> str:
+    return f"events:{task_id_str}"
+
+def ws_channel(task_id_str: str) -> str:
+    return f"ws:{task_id_str}"
+
+
+# Формат уведомлений в Redis (WIRE_VERSION):
+# - сообщение кодируется msgpack один раз на стороне отправителя и в том же виде пишется в поток (поле "m")
+#   и в канал - API не разбирает и не собирает JSON на каждое уведомление;
+# - в канал уходит кадр: байт версии, длина и task_id, длина и event_id, затем сообщение msgpack.
+#   Кадр собирается в Lua конкатенацией - event_id известен только после XADD;
+# - API понимает и прежний формат (JSON-конверт в канале, поле "data" с JSON в потоке) - на время,
+#   пока обновляются воркеры, и для журналов, записанных до обновления.
+WIRE_VERSION = 2
+STREAM_FIELD = b"m"
+LEGACY_STREAM_FIELD = b"data"
+
+# KEYS: поток, канал. ARGV: сообщение (msgpack), task_id, MAXLEN, TTL.
+PUBLISH_EVENT_SCRIPT = f"""
+local event_id = redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[3], '*', '{STREAM_FIELD.decode()}', ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('PUBLISH', KEYS[2], string.char({WIRE_VERSION}, #ARGV[2]) .. ARGV[2] .. string.char(#event_id) .. event_id .. ARGV[1])
+return event_id
+"""
+
+def encode_message(message_content: Dict[str, Any]) -> bytes:
+    return msgpack.packb(message_content)
+
+
+def publish_event_args(task_id_str: str, message_content: Dict[str, Any]) -> Tuple[List[str], List[Any]]:
+    """(KEYS, ARGV) для PUBLISH_EVENT_SCRIPT."""
+    return ([events_key(task_id_str), ws_channel(task_id_str)],
+            [encode_message(message_content), task_id_str, settings.WS_EVENT_STREAM_MAXLEN, EVENT_STREAM_TTL])
+
+
+def decode_published(data: bytes) -> Tuple[str, Optional[str], Dict[str, Any]]:
+    """Сообщение из канала ws:{id} -> (task_id, event_id, сообщение). ValueError - неизвестный формат или поврежденный кадр."""
+    if data[:1] == b"{":
+        payload = json.loads(data) # Прежний формат: {"task_id": ..., "event_id": ..., "message": {...}}
+        return payload.get("task_id"), payload.get("event_id"), payload.get("message")
+    try:
+        if data[0] != WIRE_VERSION:
+            raise ValueError(f"неизвестная версия формата уведомлений: {data[0]}")
+        task_id_end = 2 + data[1]
+        event_id_end = task_id_end + 1 + data[task_id_end]
+        return (data[2:task_id_end].decode("utf-8"), data[task_id_end + 1:event_id_end].decode("utf-8"),
+                msgpack.unpackb(data[event_id_end:]))
+    except (IndexError, UnicodeDecodeError, msgpack.UnpackException) as e:
+        raise ValueError(f"поврежденный кадр уведомления: {e}") from e
+
+
+def _decode_stream_entry(fields: Dict[bytes, bytes]) -> Dict[str, Any]:
+    if STREAM_FIELD in fields:
+        return msgpack.unpackb(fields[STREAM_FIELD])
+    return json.loads(fields[LEGACY_STREAM_FIELD])
+
+
+def parse_event_id(event_id) -> Optional[Tuple[int, int]]:
+    """'1700000000000-3' -> (1700000000000, 3) для сравнения; None для некорректного id."""
+    if isinstance(event_id, bytes):
+        event_id = event_id.decode("utf-8")
+    try:
+        milliseconds, sequence = str(event_id).split("-")
+        return int(milliseconds), int(sequence)
+    except ValueError:
+        return None
+
+
+async def publish_event(redis_client: aioredis.Redis, task_id_str: str, message_content: Dict[str, Any]) -> str:
+    keys, args = publish_event_args(task_id_str, message_content)
+    event_id = await redis_client.eval(PUBLISH_EVENT_SCRIPT, len(keys), *keys, *args)
+    return event_id.decode("utf-8") if isinstance(event_id, bytes) else event_id
+
+
+async def read_events(redis_client: aioredis.Redis, task_id_str: str,
+                      last_event_id: Optional[str] = None) -> List[Tuple[str, Dict[str, Any], bool]]:
+    """
+    Уведомления для подключившегося клиента: [(event_id, сообщение, это snapshot)].
+    С last_event_id - все записи после него; без него (или если записи после него уже вытеснены
+    из потока) - только последняя запись как снимок текущего состояния.
+    """
+    key = events_key(task_id_str)
+    after = parse_event_id(last_event_id) if last_event_id else None
+    if after is not None:
+        entries = await redis_client.xrange(key, min=f"{after[0]}-{after[1]}", max="+")
+        # Первая запись - сам last_event_id; если ее нет, часть уведомлений уже вытеснена
+        if entries and parse_event_id(entries[0][0]) == after:
+            return [(_decode_id(event_id), _decode_stream_entry(fields), False) for event_id, fields in entries[1:]]
+    latest = await redis_client.xrevrange(key, max="+", min="-", count=1)
+    return [(_decode_id(event_id), _decode_stream_entry(fields), True) for event_id, fields in latest]
+
+
+def _decode_id(event_id) -> str:
+    return event_id.decode("utf-8") if isinstance(event_id, bytes) else event_id
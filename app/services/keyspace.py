@@ -0,0 +1,482 @@
+# app/services/keyspace.py
+from bisect import bisect_right
+import string
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+from app.services.wordlist import WordlistSpace
+from app.services.markov import ORDERING_MODES, MarkovModel, load_model
+
+
+# Пространство паролей нумеруется так же, как его обходил itertools.product:
+# сначала все пароли длины 1, затем длины 2 и т.д., внутри одной длины -
+# лексикографически по порядку символов в charset (первый символ - старший разряд).
+# Это позволяет резать перебор на непересекающиеся диапазоны индексов [start, end),
+# продолжать его с точного смещения и считать прогресс без обхода пространства.
+
+
+class KeyspaceSegment:
+    """
+    Часть пространства перебора: пароли фиксированной длины, где у каждой позиции
+    свой набор символов (символы хранятся как bytes в UTF-8).
+    Ранг внутри сегмента - число в смешанной системе счисления (позиция 0 - старший разряд).
+    transitions (режим markov) - для позиций начиная с 1: предыдущий символ -> порядок символов позиции;
+    цифра ранга тогда выбирает символ из порядка, зависящего от уже выбранного предыдущего символа.
+    """
+    __slots__ = ("positions", "radices", "size", "width", "transitions")
+
+    def __init__(self, positions: Sequence[Sequence[bytes]], transitions: Optional[list] = None):
+        self.positions: List[Tuple[bytes, ...]] = [tuple(symbols) for symbols in positions]
+        self.transitions = transitions
+        self.radices = [len(symbols) for symbols in self.positions]
+        self.size = 1
+        for radix in self.radices:
+            self.size *= radix
+        # Если у каждой позиции все символы одной ширины, все пароли сегмента одной длины в байтах,
+        # и пакет можно хранить в буфере с фиксированным шагом
+        widths = [{len(symbol) for symbol in symbols} for symbols in self.positions]
+        self.width: Optional[int] = sum(w.pop() for w in widths) if all(len(w) == 1 for w in widths) else None
+
+    @property
+    def max_width(self) -> int:
+        return sum(max(len(symbol) for symbol in symbols) for symbols in self.positions)
+
+    def digits(self, local_rank: int) -> List[int]:
+        result = [0] * len(self.radices)
+        for i in range(len(self.radices) - 1, -1, -1):
+            local_rank, result[i] = divmod(local_rank, self.radices[i])
+        return result
+
+    def _symbols(self, digits: Sequence[int]) -> List[bytes]:
+        """Символы для цифр ранга (с учетом переходов markov)."""
+        if self.transitions is None:
+            return [symbols[d] for symbols, d in zip(self.positions, digits)]
+        result = []
+        previous = None
+        for i, d in enumerate(digits):
+            symbols = self.positions[i] if i == 0 else self.transitions[i][previous]
+            previous = symbols[d]
+            result.append(previous)
+        return result
+
+    def password_at(self, local_rank: int) -> bytes:
+        return b"".join(self._symbols(self.digits(local_rank)))
+
+    def rank_of(self, password: bytes) -> int:
+        local_rank = 0
+        pos = 0
+        previous = None
+        for i, (symbols, radix) in enumerate(zip(self.positions, self.radices)):
+            if self.transitions is not None and i > 0:
+                symbols = self.transitions[i][previous]
+            for digit, symbol in enumerate(symbols):
+                if password.startswith(symbol, pos):
+                    break
+            else:
+                raise ValueError("Пароль не принадлежит сегменту")
+            local_rank = local_rank * radix + digit
+            pos += len(symbol)
+            previous = symbol
+        if pos != len(password):
+            raise ValueError("Пароль не принадлежит сегменту")
+        return local_rank
+
+    def fill(self, buffer: bytearray, offset: int, local_start: int, count: int, offsets: Optional[list] = None) -> int:
+        """
+        Записывает count паролей начиная с local_start в buffer[offset:].
+        Последняя позиция пробегает свой набор внутри одного bytes.join, префикс
+        пересчитывается раз в len(набора) паролей. Возвращает смещение конца записанных данных.
+        """
+        digits = self.digits(local_start)
+        last_symbols = self.positions[-1]
+        last_radix = self.radices[-1]
+        head_positions = self.positions[:-1]
+        head_radices = self.radices[:-1]
+        head_digits = digits[:-1]
+        first = digits[-1]
+        remaining = count
+        markov = self.transitions is not None and len(self.positions) > 1
+        while remaining > 0:
+            if markov:
+                head_symbols = self._symbols(head_digits)
+                prefix = b"".join(head_symbols)
+                last_symbols = self.transitions[-1][head_symbols[-1]]
+            else:
+                prefix = b"".join(symbols[d] for symbols, d in zip(head_positions, head_digits))
+            run = min(last_radix - first, remaining)
+            chunk_symbols = last_symbols[first:first + run]
+            if offsets is not None:
+                for symbol in chunk_symbols:
+                    candidate = prefix + symbol
+                    offsets.append(offset)
+                    buffer[offset:offset + len(candidate)] = candidate
+                    offset += len(candidate)
+            else:
+                chunk = prefix + prefix.join(chunk_symbols)
+                buffer[offset:offset + len(chunk)] = chunk
+                offset += len(chunk)
+            remaining -= run
+            first = 0
+            # Инкремент префикса (одометр)
+            for i in range(len(head_digits) - 1, -1, -1):
+                head_digits[i] += 1
+                if head_digits[i] < head_radices[i]:
+                    break
+                head_digits[i] = 0
+        return offset
+
+
+class CandidateBatch:
+    """
+    Пакет подряд идущих кандидатов в заранее выделенном буфере.
+    Буфер не меняет размер, поэтому перезаполняется без новых выделений памяти;
+    итерация отдает memoryview-срезы буфера, которые действительны до следующего заполнения.
+    """
+    __slots__ = ("buffer", "start", "end", "count", "width", "offsets", "end_offset")
+
+    def __init__(self, capacity_bytes: int):
+        self.buffer = bytearray(capacity_bytes)
+        self.start = 0 # Ранг первого кандидата пакета
+        self.end = 0 # Ранг после последнего кандидата пакета
+        self.count = 0
+        self.width: Optional[int] = None
+        self.offsets: list = [] # Используется, только если ширина кандидатов различается
+        self.end_offset = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator[memoryview]:
+        view = memoryview(self.buffer)
+        if self.width is not None:
+            width = self.width
+            for offset in range(0, self.count * width, width):
+                yield view[offset:offset + width]
+        else:
+            bounds = self.offsets + [self.end_offset]
+            for i in range(self.count):
+                yield view[bounds[i]:bounds[i + 1]]
+
+    def password(self, index: int) -> bytes:
+        if self.width is not None:
+            return bytes(self.buffer[index * self.width:(index + 1) * self.width])
+        end = self.offsets[index + 1] if index + 1 < self.count else self.end_offset
+        return bytes(self.buffer[self.offsets[index]:end])
+
+
+class CandidateSpace:
+    """Упорядоченный набор сегментов с общей нумерацией рангов 0..size-1."""
+
+    def __init__(self, segments: Sequence[KeyspaceSegment]):
+        self.segments = [segment for segment in segments if segment.size > 0]
+        self.offsets = []
+        total = 0
+        for segment in self.segments:
+            self.offsets.append(total)
+            total += segment.size
+        self.size = total
+        self.max_width = max((segment.max_width for segment in self.segments), default=0)
+
+    @classmethod
+    def from_charset(cls, charset: str, max_length: int) -> "CandidateSpace":
+        symbols = [ch.encode("utf-8") for ch in charset]
+        return cls([KeyspaceSegment([symbols] * length) for length in range(1, max_length + 1)])
+
+    @classmethod
+    def from_mask(cls, mask: str, custom_charsets: Optional[Dict[str, str]] = None) -> "CandidateSpace":
+        return cls([KeyspaceSegment(parse_mask(mask, custom_charsets))])
+
+    def ordered(self, model: MarkovModel, mode: str) -> "CandidateSpace":
+        """
+        То же пространство (те же сегменты и размеры), но символы позиций переставлены
+        по вероятности из модели - вероятные пароли получают меньшие ранги внутри своей длины.
+        """
+        segments = []
+        for segment in self.segments:
+            positions, transitions = model.order_positions(segment.positions, mode)
+            segments.append(KeyspaceSegment(positions, transitions))
+        return CandidateSpace(segments)
+
+    def _locate(self, rank: int) -> Tuple[int, int]:
+        """(номер сегмента, ранг внутри сегмента)"""
+        if not 0 <= rank < self.size:
+            raise IndexError("Индекс за пределами пространства перебора")
+        segment_index = bisect_right(self.offsets, rank) - 1 # Двоичный поиск по началам сегментов
+        return segment_index, rank - self.offsets[segment_index]
+
+    def password_at(self, rank: int) -> bytes:
+        segment_index, local_rank = self._locate(rank)
+        return self.segments[segment_index].password_at(local_rank)
+
+    def rank_of(self, password: bytes) -> int:
+        for segment, offset in zip(self.segments, self.offsets):
+            try:
+                return offset + segment.rank_of(password)
+            except ValueError:
+                continue
+        raise ValueError("Пароль не принадлежит пространству перебора")
+
+    def new_batch(self, batch_size: int) -> CandidateBatch:
+        return CandidateBatch(batch_size * max(self.max_width, 1))
+
+    def fill_batch(self, batch: CandidateBatch, start: int, count: int) -> int:
+        """
+        Заполняет пакет кандидатами с рангами [start, start + count).
+        Пакет не пересекает границу сегмента и не превышает емкость буфера,
+        поэтому фактическое число кандидатов может быть меньше count - оно и возвращается.
+        """
+        segment_index, local_start = self._locate(start)
+        segment = self.segments[segment_index]
+        count = min(count, segment.size - local_start, len(batch.buffer) // max(segment.max_width, 1))
+        batch.start = start
+        batch.end = start + count
+        batch.count = count
+        batch.width = segment.width
+        batch.offsets.clear()
+        batch.end_offset = segment.fill(batch.buffer, 0, local_start, count,
+                                        offsets=None if segment.width is not None else batch.offsets)
+        return count
+
+    def next_batch(self, batch: CandidateBatch, start: int, end: int, max_count: int) -> int:
+        """Общий для всех пространств кандидатов интерфейс: заполняет пакет из [start, end), возвращает ранг следующего пакета."""
+        return start + self.fill_batch(batch, start, min(max_count, end - start))
+
+    def iter_batches(self, start: int, end: int, batch_size: int) -> Iterator[CandidateBatch]:
+        """Пакеты для диапазона [start, end); один и тот же объект пакета перезаполняется."""
+        batch = self.new_batch(batch_size)
+        rank = start
+        while rank < end:
+            rank = self.next_batch(batch, rank, end, batch_size)
+            yield batch
+
+    def estimate_candidates(self) -> int:
+        """Сколько кандидатов проверит полный перебор (здесь ранг = кандидат)."""
+        return self.size
+
+    def close(self):
+        pass
+
+
+class SearchResult(NamedTuple):
+    """Итог перебора диапазона рангов."""
+    password: Optional[str] # Найденный пароль
+    processed: int # Сколько кандидатов проверено
+    stopped: bool # Перебор прерван снаружи (пароль найден другим шардом, отмена, пауза)
+    checked_until: int # Все ранги [start, checked_until) проверены - отсюда продолжать после рестарта
+
+
+# --- Маски в стиле hashcat ---
+# ?l - строчные, ?u - прописные, ?d - цифры, ?s - спецсимволы, ?a - все перечисленные,
+# ?h/?H - hex-цифры, ?1..?4 - пользовательские наборы, ?? - сам знак "?", остальное - литералы.
+MASK_CHARSETS = {
+    "l": string.ascii_lowercase,
+    "u": string.ascii_uppercase,
+    "d": string.digits,
+    "s": " " + string.punctuation,
+    "h": "0123456789abcdef",
+    "H": "0123456789ABCDEF",
+}
+MASK_CHARSETS["a"] = MASK_CHARSETS["l"] + MASK_CHARSETS["u"] + MASK_CHARSETS["d"] + MASK_CHARSETS["s"]
+CUSTOM_CHARSET_KEYS = ("1", "2", "3", "4")
+
+
+def _expand_charset(spec: str, custom: Dict[str, str]) -> str:
+    """Раскрывает ?l, ?1 и т.д. внутри набора символов (для пользовательских наборов)."""
+    result = []
+    i = 0
+    while i < len(spec):
+        if spec[i] == "?" and i + 1 < len(spec):
+            key = spec[i + 1]
+            if key == "?":
+                result.append("?")
+            elif key in MASK_CHARSETS:
+                result.append(MASK_CHARSETS[key])
+            elif key in custom:
+                result.append(custom[key])
+            else:
+                raise ValueError(f"Неизвестный набор символов '?{key}'")
+            i += 2
+        else:
+            result.append(spec[i])
+            i += 1
+    return "".join(dict.fromkeys("".join(result))) # Без повторов, порядок сохраняется
+
+
+def parse_mask(mask: str, custom_charsets: Optional[Dict[str, str]] = None) -> List[List[bytes]]:
+    """Маска -> список наборов символов (bytes в UTF-8) для каждой позиции."""
+    raw_custom = custom_charsets or {}
+    custom: Dict[str, str] = {}
+    for key in CUSTOM_CHARSET_KEYS:
+        if raw_custom.get(key):
+            custom[key] = _expand_charset(raw_custom[key], custom)
+    positions = []
+    i = 0
+    while i < len(mask):
+        if mask[i] == "?":
+            if i + 1 >= len(mask):
+                raise ValueError("Маска не может заканчиваться одиночным '?'")
+            key = mask[i + 1]
+            if key == "?":
+                symbols = "?"
+            elif key in MASK_CHARSETS:
+                symbols = MASK_CHARSETS[key]
+            elif key in CUSTOM_CHARSET_KEYS:
+                if key not in custom:
+                    raise ValueError(f"Пользовательский набор ?{key} не задан")
+                symbols = custom[key]
+            else:
+                raise ValueError(f"Неизвестный набор символов '?{key}' в маске")
+            i += 2
+        else:
+            symbols = mask[i] # Литерал
+            i += 1
+        positions.append([ch.encode("utf-8") for ch in symbols])
+    if not positions:
+        raise ValueError("Пустая маска")
+    return positions
+
+
+class HybridSpace:
+    """
+    Гибридная атака: каждое слово словаря с маской после него (append, как hashcat -a 6)
+    или перед ним (prepend, -a 7). Ранг = смещение строки в словаре * размер маски + ранг внутри маски,
+    поэтому слово с большой маской может делиться между пакетами и шардами.
+    """
+
+    def __init__(self, wordlist_path: str, mask_positions: Sequence[Sequence[bytes]], mode: str = "append"):
+        if mode not in ("append", "prepend"):
+            raise ValueError("Гибридный режим: append или prepend")
+        self.words = WordlistSpace(wordlist_path)
+        self.mask_positions = [tuple(symbols) for symbols in mask_positions]
+        self.mode = mode
+        self.mask_size = KeyspaceSegment(self.mask_positions).size
+        self.size = self.words.size * self.mask_size
+
+    def _segment(self, word: bytes) -> KeyspaceSegment:
+        # Слово - позиция с единственным "символом", поэтому слово+маска заполняется как обычный сегмент
+        if self.mode == "append":
+            return KeyspaceSegment([(word,)] + self.mask_positions)
+        return KeyspaceSegment(self.mask_positions + [(word,)])
+
+    def close(self):
+        self.words.close()
+
+    def estimate_candidates(self) -> int:
+        return self.words.estimate_candidates() * self.mask_size
+
+    def password_at(self, rank: int) -> bytes:
+        line, mask_rank = divmod(rank, self.mask_size)
+        return self._segment(self.words.password_at(line)).password_at(mask_rank)
+
+    def new_batch(self, batch_size: int) -> CandidateBatch:
+        max_mask_width = sum(max(len(symbol) for symbol in symbols) for symbols in self.mask_positions)
+        return CandidateBatch(batch_size * (max_mask_width + 16))
+
+    def next_batch(self, batch: CandidateBatch, start: int, end: int, max_count: int) -> int:
+        """Заполняет пакет кандидатами из [start, end), возвращает ранг следующего пакета."""
+        mask_size = self.mask_size
+        line, first_mask_rank = divmod(start, mask_size)
+        batch.start = start
+        batch.width = None
+        batch.offsets.clear()
+        offset = 0
+        count = 0
+        rank = start
+        exhausted = True # Словарь закончился раньше, чем пакет или диапазон
+        for line_start, word, next_line in self.words.iter_words(line):
+            # Ранг внутри маски сохраняется, только если пакет начинается посреди этого же слова
+            mask_rank = first_mask_rank if line_start == line else 0
+            rank = line_start * mask_size + mask_rank
+            if count >= max_count or rank >= end:
+                exhausted = False
+                break
+            segment = self._segment(bytes(word))
+            n = min(mask_size - mask_rank, max_count - count, end - rank)
+            room = (len(batch.buffer) - offset) // segment.max_width
+            if room == 0 and count == 0:
+                # Слово длиннее, чем рассчитан буфер - заменяем буфер большим
+                # (старый нельзя расширить, пока живут memoryview-срезы прошлого пакета)
+                batch.buffer = bytearray(max(2 * len(batch.buffer), segment.max_width * n))
+                room = n
+            n = min(n, room)
+            if n == 0:
+                exhausted = False
+                break
+            offset = segment.fill(batch.buffer, offset, mask_rank, n, offsets=batch.offsets)
+            count += n
+            rank += n
+            if mask_rank + n < mask_size:
+                exhausted = False
+                break # Пакет заполнен посреди слова
+            rank = next_line * mask_size
+        batch.count = count
+        batch.end_offset = offset
+        batch.end = end if exhausted else min(rank, end)
+        return batch.end
+
+    def iter_batches(self, start: int, end: int, batch_size: int) -> Iterator[CandidateBatch]:
+        """Пакеты для диапазона [start, end); один и тот же объект пакета перезаполняется."""
+        batch = self.new_batch(batch_size)
+        rank = start
+        while rank < end:
+            rank = self.next_batch(batch, rank, end, batch_size)
+            yield batch
+
+
+def build_candidate_space(charset: str, max_length: int, wordlist_path: Optional[str] = None,
+                          rules: Sequence[str] = (), mask: Optional[str] = None,
+                          custom_charsets: Optional[Dict[str, str]] = None, hybrid_mode: str = "append",
+                          ordering: Optional[str] = None, ordering_model: Optional[str] = None):
+    """
+    Пространство кандидатов задачи: словарь + маска (гибрид), словарь, маска
+    или перебор по charset/max_length - в зависимости от заданных параметров.
+    ordering ("frequency"/"markov") с моделью ordering_model меняет порядок перебора маски или charset.
+    Порядок без модели, неизвестный порядок или порядок для словаря - ValueError, а не молча обычный перебор.
+    """
+    if ordering:
+        if ordering not in ORDERING_MODES:
+            raise ValueError(f"Неизвестный порядок перебора '{ordering}'. Доступны: {', '.join(ORDERING_MODES)}")
+        if not ordering_model:
+            raise ValueError(f"Порядок перебора '{ordering}' задан без модели (ordering_model)")
+        if wordlist_path:
+            raise ValueError("Порядок по вероятности применяется только к перебору charset или маски")
+    if wordlist_path and mask:
+        return HybridSpace(wordlist_path, parse_mask(mask, custom_charsets), hybrid_mode)
+    if wordlist_path:
+        return WordlistSpace(wordlist_path, rules)
+    if mask:
+        space = CandidateSpace.from_mask(mask, custom_charsets)
+    else:
+        space = CandidateSpace.from_charset(charset, max_length)
+    if ordering:
+        space = space.ordered(load_model(ordering_model), ordering)
+    return space
+
+
+def attack_mode_name(attack_options: Dict) -> str:
+    """Название атаки для логов и уведомлений."""
+    if attack_options.get("wordlist_path") and attack_options.get("mask"):
+        return "hybrid"
+    if attack_options.get("wordlist_path"):
+        return "wordlist"
+    if attack_options.get("mask"):
+        return "mask"
+    return "bruteforce"
+
+
+# --- Функции для пространства charset/max_length ---
+
+def keyspace_size(charset: str, max_length: int) -> int:
+    """Общее количество комбинаций для длин 1..max_length."""
+    return sum(len(charset) ** length for length in range(1, max_length + 1))
+
+
+def split_keyspace(total: int, shards: int) -> List[Tuple[int, int]]:
+    """Делит [0, total) на shards почти равных непересекающихся диапазонов."""
+    shards = max(1, min(shards, total)) if total > 0 else 1
+    step, extra = divmod(total, shards)
+    ranges = []
+    start = 0
+    for shard_index in range(shards):
+        end = start + step + (1 if shard_index < extra else 0)
+        ranges.append((start, end))
+        start = end
+    return ranges
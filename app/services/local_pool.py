@@ -0,0 +1,122 @@
+# app/services/local_pool.py
+import multiprocessing
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Optional, Tuple
+from app.core.config import settings
+from app.services.keyspace import CandidateSpace, SearchResult, build_candidate_space
+from app.services.progress import ProgressReporter
+from app.services.rar_tools import RarPasswordVerifier, VerificationPlan
+
+logger = logging.getLogger(__name__)
+
+# Локальный режим: одна задача Celery раздает блоки кандидатов пулу процессов на все ядра хоста.
+# Процессы пула создают свой RarPasswordVerifier один раз (initializer), а общий Event
+# останавливает их всех, как только один нашел пароль или задачу надо прервать.
+# ВАЖНО: процессы prefork-пула Celery являются daemon и не могут порождать дочерние процессы,
+# поэтому для этого режима воркер запускается с --pool=solo (или threads):
+#     celery -A app.celery.celery worker --pool=solo
+
+STOP_CHECK_EVERY = 64 # Как часто процесс пула смотрит на stop_event внутри блока
+
+_pool_verifier: Optional[RarPasswordVerifier] = None
+_pool_space: Optional[CandidateSpace] = None
+_pool_stop_event = None
+
+
+def _init_pool_process(rar_path: str, plan_json: str, space_args: Dict[str, Any], stop_event):
+    global _pool_verifier, _pool_space, _pool_stop_event
+    _pool_verifier = RarPasswordVerifier(rar_path, plan=VerificationPlan.from_json(plan_json))
+    _pool_space = build_candidate_space(**space_args)
+    _pool_stop_event = stop_event
+
+
+def _check_block(start: int, end: int) -> Tuple[int, int, Optional[str]]:
+    """
+    Проверяет блок рангов [start, end) в процессе пула.
+    Возвращает (пройдено рангов, проверено кандидатов, найденный пароль).
+    """
+    checked_until = start
+    candidates = 0
+    for batch in _pool_space.iter_batches(start, end, STOP_CHECK_EVERY):
+        if _pool_stop_event.is_set():
+            break
+        for i, candidate in enumerate(batch):
+            if _pool_verifier.check(candidate):
+                _pool_stop_event.set()
+                return batch.end - start, candidates + i + 1, batch.password(i).decode("utf-8", errors="replace")
+        checked_until = batch.end
+        candidates += len(batch)
+    return checked_until - start, candidates, None
+
+
+def pool_size() -> int:
+    """Размер пула: LOCAL_POOL_WORKERS из настроек или число ядер хоста."""
+    return settings.LOCAL_POOL_WORKERS or os.cpu_count() or 1
+
+
+def local_pool_available() -> bool:
+    # daemon-процесс (ребенок prefork-пула Celery) не может создавать свои процессы
+    return not multiprocessing.current_process().daemon
+
+
+def search_range_in_pool(rar_path: str, plan: VerificationPlan, space_args: Dict[str, Any],
+                         start: int, end: int, reporter: ProgressReporter,
+                         should_stop: Optional[Callable[[], bool]] = None) -> SearchResult:
+    """
+    Перебор диапазона [start, end) пулом процессов.
+    space_args - аргументы build_candidate_space, по которым каждый процесс пула строит свое пространство кандидатов.
+    Прогресс отдается через счетчики reporter (отчеты шлет поток ProgressReporter);
+    перебор прерывается по reporter.stop_requested или should_stop() (пауза/отмена),
+    которые проверяются при каждом завершении блока.
+    Блоки завершаются не по порядку, поэтому "проверено до ранга" - начало самого раннего
+    незавершенного блока: все ранги до него гарантированно проверены.
+    """
+    workers = pool_size()
+    block_size = settings.LOCAL_POOL_BLOCK_SIZE
+    max_in_flight = workers * 2 # Очередь блоков небольшая, чтобы остановка не ждала лишней работы
+    mp_context = multiprocessing.get_context()
+    stop_event = mp_context.Event() # Передается процессам пула при их создании (initargs)
+    password_found = None
+    stopped = False
+    processed_combinations = 0
+    candidates_checked = 0
+    next_start = start
+    logger.info(f"Локальный пул: {workers} процессов, блоки по {block_size}, диапазон [{start}, {end})")
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, initializer=_init_pool_process,
+                             initargs=(rar_path, plan.to_json(), space_args, stop_event)) as executor:
+        in_flight = {} # future -> (начало блока, конец блока)
+        interrupted_at = [] # Ранги, на которых остановились прерванные блоки
+        checked_until = start
+        while True:
+            if not stopped and password_found is None and (
+                    reporter.stop_requested or (should_stop is not None and should_stop())):
+                stopped = True
+                stop_event.set()
+            while not stop_event.is_set() and next_start < end and len(in_flight) < max_in_flight:
+                block_end = min(next_start + block_size, end)
+                future = executor.submit(_check_block, next_start, block_end)
+                in_flight[future] = (next_start, block_end)
+                next_start = block_end
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, timeout=1.0, return_when=FIRST_COMPLETED)
+            for future in done:
+                block_start, block_end = in_flight.pop(future)
+                checked, candidates, found = future.result()
+                if found is None and block_start + checked < block_end:
+                    interrupted_at.append(block_start + checked)
+                processed_combinations += checked
+                candidates_checked += candidates
+                if found is not None and password_found is None:
+                    password_found = found
+
+            checked_until = min([block_start for block_start, _ in in_flight.values()] + interrupted_at + [next_start])
+            reporter.processed = processed_combinations
+            reporter.candidates = candidates_checked
+            reporter.checked_until = checked_until
+
+    return SearchResult(password_found, processed_combinations, stopped, checked_until)
@@ -0,0 +1,122 @@
+# app/services/markov.py
+import functools
+import json
+import mmap
+import os
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+from app.core.config import settings
+from app.services.rar_tools import file_sha256 # Тот же sha256, что у архивов и словарей
+
+# Порядок перебора "сначала вероятные" (как markov-режим hashcat): символы каждой позиции
+# переставляются по частоте в обучающем корпусе, а в режиме markov - еще и в зависимости
+# от предыдущего символа. Набор символов каждой позиции не меняется, меняется только порядок,
+# поэтому пространство покрывается целиком, а ранг по-прежнему однозначно задает пароль.
+
+ORDERING_MODES = ("frequency", "markov")
+MAX_MODEL_POSITIONS = 16 # Позиции дальше этой используют общую статистику
+
+Transitions = Dict[bytes, Tuple[bytes, ...]] # предыдущий символ -> символы позиции в порядке убывания вероятности
+
+
+class MarkovModel:
+    """Частоты символов по позициям и переходы "предыдущий символ -> следующий" из корпуса паролей."""
+
+    def __init__(self, position_counts: List[Dict[str, int]], transition_counts: List[Dict[str, Dict[str, int]]],
+                 total_counts: Dict[str, int]):
+        self.position_counts = position_counts
+        self.transition_counts = transition_counts # transition_counts[0] не используется
+        self.total_counts = total_counts
+
+    @classmethod
+    def train(cls, corpus_path: str, max_lines: Optional[int] = None) -> "MarkovModel":
+        """Один проход по корпусу (по строке на пароль) через mmap, без загрузки файла в память."""
+        max_lines = max_lines or settings.MARKOV_MAX_TRAIN_LINES
+        position_counts = [Counter() for _ in range(MAX_MODEL_POSITIONS)]
+        transition_counts = [defaultdict(Counter) for _ in range(MAX_MODEL_POSITIONS)]
+        total_counts = Counter()
+        with open(corpus_path, "rb") as corpus:
+            if os.fstat(corpus.fileno()).st_size == 0:
+                return cls([{} for _ in range(MAX_MODEL_POSITIONS)], [{} for _ in range(MAX_MODEL_POSITIONS)], {})
+            with mmap.mmap(corpus.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for line_number, raw_line in enumerate(iter(mm.readline, b"")):
+                    if line_number >= max_lines:
+                        break
+                    word = raw_line.rstrip(b"\r\n").decode("utf-8", errors="ignore")
+                    total_counts.update(word)
+                    previous = None
+                    for i, ch in enumerate(word[:MAX_MODEL_POSITIONS]):
+                        position_counts[i][ch] += 1
+                        if previous is not None:
+                            transition_counts[i][previous][ch] += 1
+                        previous = ch
+        return cls([dict(c) for c in position_counts],
+                   [{prev: dict(c) for prev, c in t.items()} for t in transition_counts],
+                   dict(total_counts))
+
+    def to_json(self) -> str:
+        return json.dumps({"position_counts": self.position_counts, "transition_counts": self.transition_counts,
+                           "total_counts": self.total_counts}, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, data: str) -> "MarkovModel":
+        raw = json.loads(data)
+        return cls(raw["position_counts"], raw["transition_counts"], raw["total_counts"])
+
+    def _sort_key(self, position: int, previous: Optional[str]):
+        position_counts = self.position_counts[position] if position < MAX_MODEL_POSITIONS else {}
+        transitions = {}
+        if previous is not None and 0 < position < MAX_MODEL_POSITIONS:
+            transitions = self.transition_counts[position].get(previous, {})
+        # Сначала частота перехода, потом частота на позиции, потом общая; при равенстве - исходный порядок
+        return lambda item: (-transitions.get(item[1], 0), -position_counts.get(item[1], 0),
+                             -self.total_counts.get(item[1], 0), item[0])
+
+    def order_positions(self, positions: Sequence[Sequence[bytes]], mode: str,
+                        ) -> Tuple[List[Tuple[bytes, ...]], Optional[List[Optional[Transitions]]]]:
+        """
+        Переставляет символы позиций по вероятности.
+        Возвращает (наборы символов позиций, таблицы переходов для режима markov или None).
+        """
+        if mode not in ORDERING_MODES:
+            raise ValueError(f"Неизвестный порядок перебора '{mode}'. Доступны: {', '.join(ORDERING_MODES)}")
+        ordered = []
+        for i, symbols in enumerate(positions):
+            decoded = list(enumerate(symbol.decode("utf-8") for symbol in symbols))
+            decoded.sort(key=self._sort_key(i, None))
+            ordered.append(tuple(symbols[index] for index, _ in decoded))
+        if mode == "frequency":
+            return ordered, None
+
+        transitions: List[Optional[Transitions]] = [None]
+        for i in range(1, len(positions)):
+            table: Transitions = {}
+            decoded = list(enumerate(symbol.decode("utf-8") for symbol in ordered[i]))
+            for previous_symbol in ordered[i - 1]:
+                by_previous = sorted(decoded, key=self._sort_key(i, previous_symbol.decode("utf-8")))
+                table[previous_symbol] = tuple(ordered[i][index] for index, _ in by_previous)
+            transitions.append(table)
+        return ordered, transitions
+
+
+def train_model_file(corpus_path: str) -> str:
+    """
+    Обучает модель на корпусе и сохраняет ее в MARKOV_MODEL_DIR под sha256 корпуса
+    (повторное обучение на том же корпусе не нужно). Возвращает путь к модели.
+    """
+    os.makedirs(settings.MARKOV_MODEL_DIR, exist_ok=True)
+    model_path = os.path.abspath(os.path.join(settings.MARKOV_MODEL_DIR, f"{file_sha256(corpus_path)}.json"))
+    if not os.path.exists(model_path):
+        model = MarkovModel.train(corpus_path)
+        tmp_path = model_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as target:
+            target.write(model.to_json())
+        os.replace(tmp_path, model_path) # Атомарно: воркер не прочитает недописанную модель
+    return model_path
+
+
+@functools.lru_cache(maxsize=8)
+def load_model(model_path: str) -> MarkovModel:
+    """Модель читается процессом один раз (шарды одной задачи в одном воркере ее переиспользуют)."""
+    with open(model_path, "r", encoding="utf-8") as source:
+        return MarkovModel.from_json(source.read())
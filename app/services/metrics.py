@@ -0,0 +1,219 @@
+# app/services/metrics.py
+import os
+import re
+import socket
+import threading
+import time
+import logging
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+import redis # Синхронный клиент Redis (фоновый поток записи метрик)
+import redis.asyncio as aioredis # Асинхронный клиент для FastAPI
+from app.core.config import settings
+from app.services.redis_pool import shared_redis # Общий пул соединений процесса
+from app.services.scheduling import BRUTEFORCE_QUEUES
+
+logger = logging.getLogger(__name__)
+
+# Метрики для /metrics (текстовый формат Prometheus):
+# - каждый процесс (FastAPI и процессы воркеров Celery) копит метрики в памяти, а фоновый поток раз в
+#   METRICS_FLUSH_INTERVAL_SECONDS сливает накопленное в Redis одним пайплайном - как ProgressWriter прогресс в БД;
+# - счетчики и гистограммы в Redis (metrics:series) суммируются по всем процессам всех хостов;
+# - gauge пишутся с меткой процесса и временем записи (metrics:gauges:updated) - процесс переписывает свои
+#   gauge при каждом сливе; gauge процесса, который не писал их дольше METRICS_GAUGE_TTL_SECONDS
+#   (остановлен или упал), на /metrics не попадает;
+# - глубина очередей Celery, число отложенных задач и задач по статусам считаются при запросе /metrics.
+SERIES_KEY = "metrics:series"
+GAUGES_KEY = "metrics:gauges"
+GAUGES_UPDATED_KEY = "metrics:gauges:updated"
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+START_DELAY_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0)
+
+# Имя -> (тип, описание, границы корзин гистограммы)
+METRICS: Dict[str, Tuple[str, str, Tuple[float, ...]]] = {
+    "rar_candidates_per_second": ("gauge", "Скорость перебора шарда задачи на процессе воркера", ()),
+    "rar_task_start_delay_seconds": ("histogram", "Время от постановки задачи до запуска первого шарда", START_DELAY_BUCKETS),
+    "rar_db_write_seconds": ("histogram", "Длительность записи в БД со стороны воркера", LATENCY_BUCKETS),
+    "rar_ws_delivery_seconds": ("histogram", "Время от публикации уведомления в Redis до отправки клиенту WebSocket", LATENCY_BUCKETS),
+    "rar_notify_flush_seconds": ("histogram", "Длительность пайплайна уведомлений процесса воркера в Redis", LATENCY_BUCKETS),
+    "rar_notify_coalesced_total": ("counter", "PROGRESS, замененные более новым того же задания до отправки в Redis", ()),
+    "rar_ws_connections": ("gauge", "Подключенные клиенты WebSocket процесса API", ()),
+    "rar_queue_depth": ("gauge", "Сообщений в очереди Celery (по всем приоритетам)", ()),
+    "rar_deferred_tasks": ("gauge", "Задач, отложенных допуском в очередь", ()),
+    "rar_tasks": ("gauge", "Задач в БД по статусам", ()),
+}
+
+
+def process_label() -> str:
+    """Метка процесса: хост и pid (вычисляется при вызове - процессы prefork создаются после импорта)."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _labels(labels: Dict[str, object]) -> str:
+    return ",".join(f'{key}="{str(value)}"' for key, value in sorted(labels.items()))
+
+
+def _series(name: str, labels: Dict[str, object]) -> str:
+    return f"{name}{{{_labels(labels)}}}"
+
+
+class MetricsBuffer:
+    """
+    Метрики одного процесса. Обновления (inc/observe/set_gauge) только меняют словари в памяти,
+    в Redis их пишет фоновый поток пакетом - горячие пути (тики прогресса, отправка WebSocket) Redis не ждут.
+    """
+
+    def __init__(self, interval: float):
+        self._interval = interval
+        self._counters: Dict[str, float] = defaultdict(float)
+        self._gauges: Dict[str, float] = {} # Текущие gauge процесса - переписываются в Redis при каждом сливе
+        self._removed_gauges = set() # Снятые с прошлого слива (например, шард завершился)
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+        self._thread = None
+        self._redis: Optional[redis.Redis] = None
+
+    def inc(self, name: str, amount: float = 1.0, **labels):
+        with self._lock:
+            self._counters[_series(name, labels)] += amount
+            self._ensure_thread()
+
+    def observe(self, name: str, value: float, **labels):
+        buckets = METRICS[name][2]
+        label_text = _labels(labels)
+        prefix = f"{label_text}," if label_text else ""
+        with self._lock:
+            for bound in buckets:
+                if value <= bound:
+                    self._counters[f'{name}_bucket{{{prefix}le="{bound}"}}'] += 1
+            self._counters[f'{name}_bucket{{{prefix}le="+Inf"}}'] += 1
+            self._counters[f"{name}_sum{{{label_text}}}"] += value
+            self._counters[f"{name}_count{{{label_text}}}"] += 1
+            self._ensure_thread()
+
+    def set_gauge(self, name: str, value: Optional[float], **labels):
+        """value=None снимает gauge."""
+        series = _series(name, labels)
+        with self._lock:
+            if value is None:
+                self._gauges.pop(series, None)
+                self._removed_gauges.add(series)
+            else:
+                self._gauges[series] = value
+                self._removed_gauges.discard(series)
+            self._ensure_thread()
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            # Поток запускается лениво - в процессе воркера, а не при импорте модуля
+            self._thread = threading.Thread(target=self._run, name="metrics-writer", daemon=True)
+            self._thread.start()
+
+    def flush(self):
+        with self._lock:
+            counters, self._counters = self._counters, defaultdict(float)
+            gauges = dict(self._gauges)
+            removed, self._removed_gauges = self._removed_gauges, set()
+        if not counters and not gauges and not removed:
+            return
+        try:
+            if self._redis is None:
+                self._redis = shared_redis()
+            now = time.time()
+            pipe = self._redis.pipeline(transaction=False)
+            for series, amount in counters.items():
+                pipe.hincrbyfloat(SERIES_KEY, series, amount)
+            if removed:
+                pipe.hdel(GAUGES_KEY, *removed)
+                pipe.zrem(GAUGES_UPDATED_KEY, *removed)
+            if gauges:
+                pipe.hset(GAUGES_KEY, mapping=gauges)
+                pipe.zadd(GAUGES_UPDATED_KEY, {series: now for series in gauges})
+            pipe.execute()
+        except redis.exceptions.RedisError as e:
+            logger.error(f"[Metrics] Ошибка записи метрик в Redis: {e}")
+            # Не теряем приращения: вернем их к накопленным за это время (gauge и так перепишутся при следующем сливе)
+            with self._lock:
+                for series, amount in counters.items():
+                    self._counters[series] += amount
+                self._removed_gauges |= removed - set(self._gauges)
+
+    def close(self):
+        """Останавливает поток и дописывает накопленное (при завершении процесса)."""
+        self._finished.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while not self._finished.wait(self._interval):
+            self.flush()
+
+
+metrics = MetricsBuffer(settings.METRICS_FLUSH_INTERVAL_SECONDS)
+
+
+# --- Сторона FastAPI (/metrics) ---
+
+async def queue_depths(redis_client: aioredis.Redis) -> Dict[str, int]:
+    """Сообщений в очередях перебора: у брокера Redis каждый уровень приоритета - отдельный список."""
+    from app.celery.celery import app as celery_app_instance # Импорт здесь: celery.py импортирует этот модуль
+    options = celery_app_instance.conf.broker_transport_options
+    separator = options.get("sep", "\x06\x16")
+    pipe = redis_client.pipeline(transaction=False)
+    for queue in BRUTEFORCE_QUEUES:
+        for step in options.get("priority_steps", [0]):
+            pipe.llen(f"{queue}{separator}{step}" if step else queue)
+    lengths = iter(await pipe.execute())
+    return {queue: sum(next(lengths) for _ in options.get("priority_steps", [0])) for queue in BRUTEFORCE_QUEUES}
+
+
+async def render_metrics(redis_client: aioredis.Redis, computed: Dict[str, List[Tuple[Dict[str, object], float]]]) -> str:
+    """
+    Текст /metrics: агрегаты процессов из Redis и значения, посчитанные при запросе
+    (computed: имя gauge -> [(метки, значение)]). Устаревшие gauge удаляются.
+    """
+    stale_before = time.time() - settings.METRICS_GAUGE_TTL_SECONDS
+    stale = await redis_client.zrangebyscore(GAUGES_UPDATED_KEY, "-inf", stale_before)
+    if stale:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hdel(GAUGES_KEY, *stale)
+        pipe.zrem(GAUGES_UPDATED_KEY, *stale)
+        await pipe.execute()
+    series = {**await redis_client.hgetall(SERIES_KEY), **await redis_client.hgetall(GAUGES_KEY)}
+
+    by_metric: Dict[str, List[Tuple[str, float]]] = defaultdict(list)
+    for raw_series, raw_value in series.items():
+        text = raw_series.decode("utf-8")
+        by_metric[_metric_name(text.split("{", 1)[0])].append((text, float(raw_value)))
+    for name, samples in computed.items():
+        by_metric[name].extend((_series(name, labels), value) for labels, value in samples)
+
+    lines = []
+    for name, (metric_type, description, _) in METRICS.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for text, value in sorted(by_metric.get(name, []), key=_sample_order):
+            lines.append(f"{text} {_format_value(float(value))}")
+    return "\n".join(lines) + "\n"
+
+
+def _metric_name(series_name: str) -> str:
+    for suffix in ("_bucket", "_sum", "_count"):
+        if series_name.endswith(suffix) and series_name[:-len(suffix)] in METRICS:
+            return series_name[:-len(suffix)]
+    return series_name
+
+
+_LE_LABEL = re.compile(r'le="([^"]+)"')
+
+def _sample_order(sample: Tuple[str, float]):
+    # Корзины гистограммы - по возрастанию границы, а не по строке ("10" < "2.5")
+    text = sample[0]
+    match = _LE_LABEL.search(text)
+    return (_LE_LABEL.sub("", text), float(match.group(1)) if match else 0.0)
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if value.is_integer() else repr(value)
@@ -0,0 +1,120 @@
+# app/services/notifier.py
+import threading
+import time
+import logging
+from typing import Any, Dict, List, Optional, Sequence
+import redis # Синхронный клиент Redis для Celery
+from app.core.config import settings
+from app.services.events import PUBLISH_EVENT_SCRIPT, publish_event_args # Журнал уведомлений для переподключения
+from app.services.metrics import metrics # Метрики для /metrics
+from app.services.redis_pool import shared_redis # Общий пул соединений процесса
+
+logger = logging.getLogger(__name__)
+
+
+class _Notification:
+    __slots__ = ("task_id_str", "message", "followers")
+
+    def __init__(self, task_id_str: str, message: Dict[str, Any], followers: Sequence[int]):
+        self.task_id_str = task_id_str
+        self.message = message
+        self.followers = followers
+
+    @property
+    def is_progress(self) -> bool:
+        return self.message.get("status") == "PROGRESS"
+
+    def targets(self):
+        """(задача, уведомление) для самой задачи и ее последователей."""
+        yield self.task_id_str, self.message
+        for follower in self.followers:
+            yield str(follower), {**self.message, "task_id": str(follower)}
+
+
+class Notifier:
+    """
+    Уведомления всех задач одного процесса воркера, через общий пул соединений (shared_redis).
+    PROGRESS копятся, и раз в NOTIFY_FLUSH_INTERVAL_SECONDS фоновый поток отправляет их одним пайплайном;
+    если задача успела прислать несколько PROGRESS, уходит только последний. Остальные статусы
+    (STARTED, COMPLETED, PAUSED...) отправляются сразу - тем же пайплайном вместе со всем накопленным,
+    так что порядок уведомлений задачи сохраняется.
+    """
+
+    def __init__(self, interval: float):
+        self._interval = interval
+        self._pending: List[_Notification] = []
+        self._latest_progress: Dict[str, _Notification] = {} # Еще не отправленный PROGRESS задачи
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock() # Пакеты уходят по одному - порядок уведомлений сохраняется
+        self._finished = threading.Event()
+        self._thread = None
+        self._redis: Optional[redis.Redis] = None
+
+    def publish(self, task_id_str: str, message: Dict[str, Any], followers: Sequence[int] = ()):
+        notification = _Notification(task_id_str, message, followers)
+        with self._lock:
+            if notification.is_progress:
+                previous = self._latest_progress.get(task_id_str)
+                if previous is not None:
+                    # Старый PROGRESS еще не ушел - заменяем его на месте в очереди
+                    previous.message, previous.followers = message, followers
+                    metrics.inc("rar_notify_coalesced_total")
+                    return
+                self._latest_progress[task_id_str] = notification
+                self._pending.append(notification)
+                self._ensure_thread()
+                return
+            # PROGRESS после этого события должен прийти клиенту после него, а не на место более раннего
+            self._latest_progress.pop(task_id_str, None)
+            self._pending.append(notification)
+        self.flush()
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            # Поток запускается лениво - в процессе воркера, а не при импорте модуля
+            self._thread = threading.Thread(target=self._run, name="notifier", daemon=True)
+            self._thread.start()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+                self._latest_progress = {}
+            if not pending:
+                return
+            try:
+                if self._redis is None:
+                    self._redis = shared_redis()
+                started = time.perf_counter()
+                pipe = self._redis.pipeline(transaction=False)
+                for notification in pending:
+                    for target_id_str, content in notification.targets():
+                        # Запись в журнал задачи (events:{id}) и публикация в ws:{id} одним скриптом - с общим event_id
+                        keys, args = publish_event_args(target_id_str, content)
+                        pipe.eval(PUBLISH_EVENT_SCRIPT, len(keys), *keys, *args)
+                pipe.execute()
+                metrics.observe("rar_notify_flush_seconds", time.perf_counter() - started)
+                logger.debug(f"[Notifier] Отправлено уведомлений одним пайплайном: {len(pending)}")
+            except redis.exceptions.RedisError as e:
+                logger.error(f"[Notifier] Ошибка публикации уведомлений в Redis: {e}")
+                # События не теряем: вернем их в начало очереди, отправит фоновый поток.
+                # PROGRESS отбрасываем - следующий тик задачи пришлет свежий
+                events = [notification for notification in pending if not notification.is_progress]
+                if events:
+                    with self._lock:
+                        self._pending[:0] = events
+                        self._ensure_thread()
+
+    def close(self):
+        """Останавливает поток и отправляет накопленное (при завершении процесса воркера)."""
+        self._finished.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while not self._finished.wait(self._interval):
+            self.flush()
+
+
+notifier = Notifier(settings.NOTIFY_FLUSH_INTERVAL_SECONDS)
@@ -0,0 +1,166 @@
+# app/services/profiling.py
+from typing import Any, Dict, Iterable, List, Optional
+from collections import Counter
+from contextlib import contextmanager
+import os
+import socket
+import sys
+import threading
+import time
+import logging
+import redis # Синхронный клиент Redis для Celery
+import redis.asyncio as aioredis # Асинхронный клиент для FastAPI
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Куда уходит время задачи:
+# - PhaseTimings - накопительные таймеры фаз (генерация кандидатов, проверка паролей, запись в БД,
+#   запросы к Redis). Цикл перебора добавляет время раз в пакет, поток прогресса - раз в тик, поэтому
+#   таймеры включены всегда. Разбивка уходит в COMPLETED/FAILED и в таблицу task_timings;
+# - SamplingProfiler - включается флагом задачи (profile=true в /brut_hash): отдельный поток раз в
+#   PROFILE_SAMPLE_INTERVAL_SECONDS снимает стеки потоков задачи. Профиль пишется в PROFILE_DIR
+#   в формате folded stacks (flamegraph.pl, speedscope, inferno), путь - в task_timings и в итоговом уведомлении.
+PHASES = ("generation", "verification", "db", "redis")
+PROFILE_FLAG_TTL = 24 * 3600
+
+def profile_flag_key(task_id_str: str) -> str:
+    return f"bruteforce:{task_id_str}:profile"
+
+
+class PhaseTimings:
+    """Накопительные таймеры фаз одного запуска задачи (шарда); add() вызывают поток перебора и поток прогресса."""
+
+    def __init__(self):
+        self._seconds: Dict[str, float] = dict.fromkeys(PHASES, 0.0)
+        self._lock = threading.Lock()
+
+    def add(self, phase: str, seconds: float):
+        with self._lock:
+            self._seconds[phase] += seconds
+
+    @contextmanager
+    def measure(self, phase: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - started)
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {phase: round(seconds, 3) for phase, seconds in self._seconds.items()}
+
+
+def merge_timings(breakdowns: Iterable[Optional[Dict[str, float]]]) -> Dict[str, float]:
+    """Сумма разбивок шардов задачи."""
+    total = dict.fromkeys(PHASES, 0.0)
+    for breakdown in breakdowns:
+        for phase, seconds in (breakdown or {}).items():
+            total[phase] = total.get(phase, 0.0) + seconds
+    return {phase: round(seconds, 3) for phase, seconds in total.items()}
+
+
+# --- Профилирование по запросу ---
+
+class SamplingProfiler:
+    """
+    Сэмплирующий профилировщик потоков задачи: раз в interval секунд берет их текущие стеки
+    (sys._current_frames) и считает одинаковые. Код перебора не инструментируется - накладные
+    расходы только на сам снимок стеков. В режиме local_pool перебор идет в процессах пула,
+    и профиль показывает только ожидание их результатов.
+    """
+
+    def __init__(self, interval: float):
+        self.samples = 0
+        self._interval = interval
+        self._threads: Dict[int, str] = {} # ident потока -> имя (корень стеков в профиле)
+        self._stacks: Counter = Counter()
+        self._labels: Dict[Any, str] = {} # Кэш подписей кадров: code -> "функция (файл:строка)"
+        self._finished = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def watch(self, thread: threading.Thread):
+        self._threads[thread.ident] = thread.name
+
+    def start(self) -> "SamplingProfiler":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._finished.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            # Без ';' - это разделитель кадров в формате folded stacks
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+            self._labels[code] = label
+        return label
+
+    def _run(self):
+        while not self._finished.wait(self._interval):
+            frames = sys._current_frames()
+            for ident, name in list(self._threads.items()):
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                if stack:
+                    self._stacks[(name, *reversed(stack))] += 1
+            self.samples += 1
+
+    def save(self, path: str) -> str:
+        """
+        Дописывает профиль в файл folded stacks ("поток;кадр;...;кадр число" на строку).
+        Профиль того же шарда после паузы и resume суммируется с уже сохраненным.
+        """
+        stacks = Counter(self._stacks)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    stack, _, count = line.rstrip("\n").rpartition(" ")
+                    if stack and count.isdigit():
+                        stacks[tuple(stack.split(";"))] += int(count)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
+        os.replace(tmp_path, path)
+        return path
+
+
+def profile_path(task_id: int, shard_index: Optional[int]) -> str:
+    return os.path.join(settings.PROFILE_DIR, f"task_{task_id}_shard_{shard_index or 0}.folded")
+
+
+def profile_location(path: str) -> Dict[str, str]:
+    """Где лежит профиль: PROFILE_DIR у каждого хоста воркеров свой."""
+    return {"host": socket.gethostname(), "path": os.path.abspath(path)}
+
+
+# --- Флаг профилирования задачи ---
+
+def profiling_requested(redis_client: Optional[redis.Redis], task_id_str: str) -> bool:
+    """Сторона воркера: включено ли профилирование задачи (флаг видят все шарды, в том числе после resume)."""
+    if not redis_client:
+        return False
+    try:
+        return redis_client.exists(profile_flag_key(task_id_str)) > 0
+    except redis.exceptions.RedisError as e:
+        logger.error(f"[Task {task_id_str}] Ошибка Redis при чтении флага профилирования: {e}")
+        return False
+
+
+async def request_profiling(redis_client: Optional[aioredis.Redis], task_ids: List[int]):
+    """Сторона FastAPI: включает профилирование задач (до их отправки в Celery)."""
+    if not redis_client or not task_ids:
+        return
+    pipe = redis_client.pipeline(transaction=False)
+    for task_id in task_ids:
+        pipe.set(profile_flag_key(str(task_id)), 1, ex=PROFILE_FLAG_TTL)
+    await pipe.execute()
@@ -0,0 +1,70 @@
+# app/services/progress.py
+import threading
+import time
+import logging
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressReporter:
+    """
+    Фоновый поток, снимающий прогресс перебора.
+    Цикл проверки паролей только записывает в processed/candidates/checked_until (обычное присваивание,
+    без блокировок и вызовов time.time()), а поток раз в interval секунд считает CPS и вызывает
+    on_tick(проверено, проверено до ранга, CPS) - все записи в БД и Redis идут из этого потока.
+    Если on_tick вернул True, выставляется stop_requested, который цикл проверяет между пакетами.
+    """
+
+    def __init__(self, on_tick: Callable[[int, int, float], bool], interval: float = 1.0, name: str = "progress-reporter"):
+        self.processed = 0 # Пройдено рангов диапазона (пишет цикл перебора)
+        self.candidates = 0 # Проверено кандидатов, для CPS (у словаря с правилами не совпадает с рангами)
+        self.checked_until = 0 # Все ранги до этого проверены (пишет цикл перебора)
+        self.cps = 0.0 # Последний посчитанный CPS (читает цикл перебора для размера пакета)
+        self.stop_requested = False
+        self._on_tick = on_tick
+        self._interval = interval
+        self._finished = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self, start_rank: int) -> "ProgressReporter":
+        self.checked_until = start_rank
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Останавливает поток; после возврата on_tick больше не вызывается."""
+        self._finished.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    @property
+    def thread(self) -> threading.Thread:
+        """Поток отчета (например, для профилировщика задачи)."""
+        return self._thread
+
+    def __enter__(self) -> "ProgressReporter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def _run(self):
+        last_candidates = self.candidates
+        last_time = time.monotonic()
+        while not self._finished.wait(self._interval):
+            processed = self.processed
+            candidates = self.candidates
+            checked_until = self.checked_until
+            current_time = time.monotonic()
+            elapsed = current_time - last_time
+            self.cps = (candidates - last_candidates) / elapsed if elapsed > 0 else 0.0
+            last_candidates, last_time = candidates, current_time
+            if self.stop_requested:
+                continue
+            try:
+                if self._on_tick(processed, checked_until, self.cps):
+                    self.stop_requested = True
+            except Exception as e:
+                # Ошибка отчета не должна останавливать перебор
+                logger.error(f"Ошибка при отправке прогресса: {e}", exc_info=True)
@@ -3,7 +3,24 @@ import rarfile
 import tempfile
 import os
 import subprocess
+import hashlib
+import logging
+import struct
+import zlib
+import json
+import mmap
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
 from pathlib import Path
+from typing import List, Optional, Union
+
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    _have_crypto = True
+except ImportError: # Без AES проверяем в памяти только RAR5, для RAR3 остается unrar
+    _have_crypto = False
+
+logger = logging.getLogger(__name__)
 
 # Установка пути к unrar.exe (необходим для работы с RAR)
 rarfile.UNRAR_TOOL = "unrar"  # Или полный путь к unrar.exe
@@ -17,7 +34,373 @@ def check_rar_password(rar_path: str, password: str) -> bool:
         with rarfile.RarFile(rar_path) as rf:
             rf.testrar(pwd=password)  # Пытаемся открыть архив с паролем
         return True
-    except (rarfile.BadRarFile, rarfile.PasswordRequired):
+    except (rarfile.BadRarFile, rarfile.PasswordRequired, rarfile.RarWrongPassword, rarfile.RarCRCError):
         return False  # Пароль не подошел
     except Exception as e:
         raise ValueError(f"RAR check error: {str(e)}")
+
+
+# --- Проверка паролей в памяти ---
+# Параметры шифрования (соль, число итераций KDF, проверочное значение) читаются из
+# заголовков архива один раз, после чего кандидат проверяется только хешированием/AES,
+# без запуска внешнего unrar. unrar вызывается лишь для подтверждения найденного пароля.
+
+S_BLK_HDR = struct.Struct("<HBHH") # crc16, тип, флаги, размер заголовка блока RAR3
+RAR3_HEADER_TYPES = range(rarfile.RAR_BLOCK_MARK, rarfile.RAR_BLOCK_ENDARC + 1)
+RAR5_PW_CHECK_SIZE = 8
+RAR5_PW_SUM_SIZE = 4
+MAX_STORED_MEMBER_SIZE = 16 * 1024 * 1024 # Больше расшифровывать на каждый кандидат невыгодно
+
+# Режимы проверки
+MODE_RAR5_CHECK_VALUE = "rar5_check_value" # RAR5: сравнение с PswCheck из заголовка
+MODE_RAR3_HEADERS = "rar3_headers" # RAR3 с шифрованием заголовков: CRC расшифрованного заголовка
+MODE_RAR3_STORED = "rar3_stored" # RAR3: CRC32 расшифрованного несжатого файла
+MODE_UNRAR = "unrar" # Проверка в памяти невозможна - каждый кандидат через unrar
+
+# Кандидат может прийти строкой или срезом пакета кандидатов (UTF-8 байты, см. keyspace.CandidateBatch)
+Password = Union[str, bytes, memoryview]
+
+
+def _password_text(password: Password) -> str:
+    return password if isinstance(password, str) else bytes(password).decode("utf-8")
+
+
+def _read_vint(buf: bytes, pos: int):
+    """Читает RAR5 vint (7 бит на байт, старший бит - продолжение)."""
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return result, pos
+
+
+_rar3_counters: Optional[List[List[bytes]]] = None
+
+def _get_rar3_counters() -> List[List[bytes]]:
+    """3-байтовые счетчики KDF RAR3, разбитые на 16 раундов по 0x4000 (считаются один раз на процесс)."""
+    global _rar3_counters
+    if _rar3_counters is None:
+        counters = [struct.pack("<L", n)[:3] for n in range(16 * 0x4000)]
+        _rar3_counters = [counters[i * 0x4000:(i + 1) * 0x4000] for i in range(16)]
+    return _rar3_counters
+
+
+def rar3_s2k(password: str, salt: bytes):
+    """
+    KDF RAR3 (ключ AES-128 и IV), эквивалент rarfile.rar3_s2k.
+    Вместо 2^18 вызовов update() данные раунда склеиваются через bytes.join
+    и хешируются одним вызовом. Для очень длинных паролей (где проявляется
+    ошибка SHA1 из RAR3) используется реализация rarfile.
+    """
+    seed = password.encode("utf-16le")[:rarfile.RAR_MAX_PASSWORD * 2] + salt
+    if len(seed) > 64:
+        return rarfile.rar3_s2k(password, salt)
+    sha = hashlib.sha1()
+    iv = bytearray()
+    for counters in _get_rar3_counters():
+        sha.update(seed + counters[0])
+        iv.append(sha.digest()[19])
+        sha.update(seed + seed.join(counters[1:]))
+    key_be = sha.digest()[:16]
+    key_le = struct.pack("<LLLL", *struct.unpack(">LLLL", key_be))
+    return key_le, bytes(iv)
+
+
+def _aes_cbc_decrypt(key: bytes, iv: bytes, data: bytes) -> bytes:
+    decryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor()
+    return decryptor.update(data) + decryptor.finalize()
+
+
+class ArchiveRejected(ValueError):
+    """Архив не подходит для перебора (не RAR, не зашифрован или поврежден)."""
+
+
+# --- Предварительный анализ архива ---
+# Архив разбирается один раз (при загрузке в /brut_hash), результат - план проверки:
+# какой режим проверки в памяти возможен, его параметры и самый маленький зашифрованный
+# файл, на котором проверять пароль через unrar вместо testrar() по всему архиву.
+# План кэшируется по sha256 содержимого архива, поэтому задачи и их повторы не анализируют архив заново.
+
+PLAN_CACHE_TTL = 7 * 24 * 3600
+PLAN_CACHE_MAX_LOCAL = 128 # Планов в памяти одного процесса
+RAR3_ENCRYPTED_HEADER_PREFETCH = 64 * 1024
+
+@dataclass
+class VerificationPlan:
+    sha256: str
+    rar_version: int
+    headers_encrypted: bool
+    mode: str = MODE_UNRAR
+    member: Optional[str] = None # Самый маленький зашифрованный файл (None, если заголовки зашифрованы)
+    member_size: int = 0
+    kdf_count: int = 0
+    salt: str = "" # hex
+    check_value: str = "" # hex
+    data_offset: int = 0 # RAR3: где лежит шифртекст заголовка / несжатого файла
+    data_size: int = 0
+    file_size: int = 0
+    file_crc: int = 0
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, raw) -> "VerificationPlan":
+        return cls(**json.loads(raw))
+
+
+def file_sha256(path: str) -> str:
+    """sha256 файла через mmap: хешируется отображение целиком, без чтения кусками в буфер."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.sha256().hexdigest() # mmap пустого файла невозможен
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return hashlib.sha256(mm).hexdigest()
+
+
+def plan_cache_key(sha256: str) -> str:
+    return f"rarplan:{sha256}"
+
+
+def _rar5_check_value_usable(kdf_count: int, check_value: Optional[bytes]) -> bool:
+    if not check_value or len(check_value) != RAR5_PW_CHECK_SIZE + RAR5_PW_SUM_SIZE:
+        return False
+    if kdf_count > rarfile.RAR_MAX_KDF_SHIFT:
+        return False
+    # Контрольная сумма самого проверочного значения - защита от поврежденного заголовка
+    return hashlib.sha256(check_value[:RAR5_PW_CHECK_SIZE]).digest()[:RAR5_PW_SUM_SIZE] == check_value[RAR5_PW_CHECK_SIZE:]
+
+
+def _parse_rar5_header_encryption(buf: bytes):
+    """Блок шифрования заголовков RAR5 идет сразу после сигнатуры. Возвращает (kdf_count, salt, check_value) или None."""
+    try:
+        pos = 4 # CRC32 заголовка
+        _, pos = _read_vint(buf, pos) # Размер заголовка
+        block_type, pos = _read_vint(buf, pos)
+        if block_type != rarfile.RAR5_BLOCK_ENCRYPTION:
+            return None
+        _, pos = _read_vint(buf, pos) # Флаги блока
+        _, pos = _read_vint(buf, pos) # Алгоритм (AES-256)
+        enc_flags, pos = _read_vint(buf, pos)
+        kdf_count = buf[pos]
+        salt = buf[pos + 1:pos + 17]
+        check_value = buf[pos + 17:pos + 29] if enc_flags & rarfile.RAR5_ENC_FLAG_HAS_CHECKVAL else b""
+    except IndexError:
+        raise ArchiveRejected("Архив поврежден: обрезан блок шифрования заголовков")
+    return kdf_count, salt, check_value
+
+
+def _parse_rar3_header_encryption(f):
+    """RAR3 с флагом MHD_PASSWORD: за главным заголовком идут соль и зашифрованные заголовки. Возвращает (salt, offset) или None."""
+    f.seek(len(rarfile.RAR_ID))
+    main_header = f.read(S_BLK_HDR.size)
+    if len(main_header) < S_BLK_HDR.size:
+        raise ArchiveRejected("Архив поврежден: обрезан главный заголовок")
+    _, block_type, flags, header_size = S_BLK_HDR.unpack(main_header)
+    if block_type != rarfile.RAR_BLOCK_MAIN:
+        raise ArchiveRejected("Архив поврежден: нет главного заголовка")
+    if not flags & rarfile.RAR_MAIN_PASSWORD:
+        return None
+    f.seek(len(rarfile.RAR_ID) + header_size)
+    salt = f.read(8)
+    if len(salt) < 8:
+        raise ArchiveRejected("Архив поврежден: обрезана соль зашифрованных заголовков")
+    return salt, f.tell()
+
+
+def analyze_archive(rar_path: str, sha256: Optional[str] = None) -> VerificationPlan:
+    """
+    Анализирует архив и строит план проверки паролей.
+    Бросает ArchiveRejected, если архив не RAR, не зашифрован или поврежден.
+    """
+    sha256 = sha256 or file_sha256(rar_path)
+    file_size = os.path.getsize(rar_path)
+    with open(rar_path, "rb") as f:
+        signature = f.read(len(rarfile.RAR5_ID))
+        if signature == rarfile.RAR5_ID:
+            header_encryption = _parse_rar5_header_encryption(f.read(RAR3_ENCRYPTED_HEADER_PREFETCH))
+            if header_encryption:
+                kdf_count, salt, check_value = header_encryption
+                plan = VerificationPlan(sha256=sha256, rar_version=5, headers_encrypted=True)
+                if _rar5_check_value_usable(kdf_count, check_value):
+                    plan.mode = MODE_RAR5_CHECK_VALUE
+                    plan.kdf_count, plan.salt, plan.check_value = kdf_count, salt.hex(), check_value[:RAR5_PW_CHECK_SIZE].hex()
+                return plan
+            rar_version = 5
+        elif signature.startswith(rarfile.RAR_ID):
+            header_encryption = _parse_rar3_header_encryption(f)
+            if header_encryption:
+                salt, offset = header_encryption
+                plan = VerificationPlan(sha256=sha256, rar_version=3, headers_encrypted=True)
+                data_size = min(RAR3_ENCRYPTED_HEADER_PREFETCH, file_size - offset)
+                data_size -= data_size % 16
+                if data_size <= 0:
+                    raise ArchiveRejected("Архив поврежден: нет зашифрованных заголовков")
+                if _have_crypto:
+                    plan.mode = MODE_RAR3_HEADERS
+                    plan.salt, plan.data_offset, plan.data_size = salt.hex(), offset, data_size
+                return plan
+            rar_version = 3
+        else:
+            raise ArchiveRejected("Файл не является RAR-архивом")
+
+    try:
+        with rarfile.RarFile(rar_path, errors="strict") as rf:
+            members = [info for info in rf.infolist() if info.is_file()]
+    except (rarfile.Error, OSError) as e:
+        raise ArchiveRejected(f"Архив поврежден: {e}")
+
+    encrypted = [info for info in members if info.needs_password()]
+    if not encrypted:
+        raise ArchiveRejected("Архив не зашифрован")
+
+    smallest = min(encrypted, key=lambda info: info.compress_size)
+    plan = VerificationPlan(sha256=sha256, rar_version=rar_version, headers_encrypted=False,
+                            member=smallest.filename, member_size=smallest.file_size)
+    if rar_version == 5:
+        for info in encrypted:
+            _, flags, kdf_count, salt, _, check_value = info.file_encryption
+            if flags & rarfile.RAR5_XENC_CHECKVAL and _rar5_check_value_usable(kdf_count, check_value):
+                plan.mode = MODE_RAR5_CHECK_VALUE
+                plan.kdf_count, plan.salt, plan.check_value = kdf_count, salt.hex(), check_value[:RAR5_PW_CHECK_SIZE].hex()
+                break
+    elif _have_crypto:
+        # Самый маленький зашифрованный файл без сжатия - его CRC32 проверяется без unrar
+        stored = [
+            info for info in encrypted
+            if info.compress_type == rarfile.RAR_M0
+            and not info.flags & (rarfile.RAR_FILE_SPLIT_BEFORE | rarfile.RAR_FILE_SPLIT_AFTER)
+            and 0 < info.compress_size <= MAX_STORED_MEMBER_SIZE and info.compress_size % 16 == 0
+        ]
+        if stored:
+            info = min(stored, key=lambda item: item.compress_size)
+            plan.mode = MODE_RAR3_STORED
+            plan.salt, plan.data_offset, plan.data_size = info.salt.hex(), info.data_offset, info.compress_size
+            plan.file_size, plan.file_crc = info.file_size, info.CRC
+    return plan
+
+
+_local_plans: "OrderedDict[str, VerificationPlan]" = OrderedDict()
+
+def get_verification_plan(rar_path: str, redis_client=None, sha256: Optional[str] = None) -> VerificationPlan:
+    """
+    План проверки для архива: кэш процесса -> Redis -> анализ архива (с сохранением в кэш).
+    sha256 можно передать, если он уже известен (архив из хранилища) - тогда архив не хешируется заново.
+    """
+    sha256 = sha256 or file_sha256(rar_path)
+    plan = _local_plans.get(sha256)
+    if plan is None and redis_client is not None:
+        try:
+            raw = redis_client.get(plan_cache_key(sha256))
+            if raw:
+                plan = VerificationPlan.from_json(raw)
+        except Exception as e:
+            logger.error(f"Ошибка чтения плана проверки {sha256} из Redis: {e}")
+    if plan is None:
+        plan = analyze_archive(rar_path, sha256)
+        if redis_client is not None:
+            try:
+                redis_client.set(plan_cache_key(sha256), plan.to_json(), ex=PLAN_CACHE_TTL)
+            except Exception as e:
+                logger.error(f"Ошибка сохранения плана проверки {sha256} в Redis: {e}")
+    _local_plans[sha256] = plan
+    _local_plans.move_to_end(sha256)
+    while len(_local_plans) > PLAN_CACHE_MAX_LOCAL:
+        _local_plans.popitem(last=False)
+    return plan
+
+
+class RarPasswordVerifier:
+    """
+    Проверка паролей к одному архиву без повторного разбора архива и без unrar на каждый кандидат.
+    Создается один раз на задачу по плану проверки, затем check() вызывается для каждого кандидата.
+    """
+
+    def __init__(self, rar_path: str, plan: Optional[VerificationPlan] = None, confirm_with_unrar: bool = True):
+        self.rar_path = rar_path
+        self.plan = plan or analyze_archive(rar_path)
+        self.mode = self.plan.mode
+        self.confirm_with_unrar = confirm_with_unrar
+        self.salt = bytes.fromhex(self.plan.salt)
+        self.check_value = bytes.fromhex(self.plan.check_value)
+        self._check_value_int = int.from_bytes(self.check_value, "little") if self.check_value else 0
+        self.encrypted_data = b"" # RAR3: шифртекст первого заголовка или несжатого файла
+        if self.plan.data_size:
+            # Из архива нужен только небольшой участок - берем его срезом отображения, не читая файл
+            with open(rar_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                self.encrypted_data = mm[self.plan.data_offset:self.plan.data_offset + self.plan.data_size]
+            if len(self.encrypted_data) != self.plan.data_size:
+                raise ArchiveRejected("Архив поврежден: данные короче, чем указано в заголовке")
+        self._rar: Optional[rarfile.RarFile] = None # Открывается один раз для проверки через unrar
+        logger.info(f"RarPasswordVerifier: {rar_path} -> режим проверки '{self.mode}', файл для unrar: {self.plan.member}")
+
+    def close(self):
+        if self._rar is not None:
+            self._rar.close()
+            self._rar = None
+
+    def _check_member_with_unrar(self, password: Password) -> bool:
+        """Проверка через unrar только самого маленького зашифрованного файла вместо testrar() всего архива."""
+        password = _password_text(password)
+        if self.plan.member is None:
+            return check_rar_password(self.rar_path, password)
+        try:
+            if self._rar is None:
+                self._rar = rarfile.RarFile(self.rar_path)
+            with self._rar.open(self.plan.member, pwd=password) as member_file:
+                while member_file.read(1024 * 1024): # CRC проверяется rarfile по концу чтения
+                    pass
+            return True
+        except (rarfile.BadRarFile, rarfile.PasswordRequired, rarfile.RarWrongPassword, rarfile.RarCRCError):
+            return False # Пароль не подошел
+        except Exception as e:
+            raise ValueError(f"RAR check error: {str(e)}")
+
+    # --- Проверка кандидатов ---
+    def check_in_memory(self, password: Password) -> bool:
+        """Быстрая проверка без unrar. В режиме MODE_UNRAR - проверка одного файла через unrar."""
+        if self.mode == MODE_RAR5_CHECK_VALUE:
+            # PswCheck = XOR-свертка PBKDF2-HMAC-SHA256 с (2^kdf_count + 32) итерациями до 8 байт
+            if isinstance(password, str):
+                password = password.encode("utf-8")
+            derived = int.from_bytes(
+                hashlib.pbkdf2_hmac("sha256", password, self.salt, (1 << self.plan.kdf_count) + 32), "little"
+            )
+            folded = (derived ^ (derived >> 64) ^ (derived >> 128) ^ (derived >> 192)) & 0xFFFFFFFFFFFFFFFF
+            return folded == self._check_value_int
+        if self.mode == MODE_RAR3_HEADERS:
+            key, iv = rar3_s2k(_password_text(password), self.salt)
+            first_block = _aes_cbc_decrypt(key, iv, self.encrypted_data[:16])
+            header_crc, block_type, _, header_size = S_BLK_HDR.unpack_from(first_block)
+            if block_type not in RAR3_HEADER_TYPES or header_size < S_BLK_HDR.size:
+                return False
+            need = -(-header_size // 16) * 16
+            if need > len(self.encrypted_data): # Заголовок больше 64 КБ - мусор после неверного ключа
+                return False
+            header = _aes_cbc_decrypt(key, iv, self.encrypted_data[:need])
+            return (zlib.crc32(header[2:header_size]) & 0xFFFF) == header_crc
+        if self.mode == MODE_RAR3_STORED:
+            key, iv = rar3_s2k(_password_text(password), self.salt)
+            data = _aes_cbc_decrypt(key, iv, self.encrypted_data)[:self.plan.file_size]
+            return (zlib.crc32(data) & 0xFFFFFFFF) == self.plan.file_crc
+        return self._check_member_with_unrar(password)
+
+    def check(self, password: Password) -> bool:
+        """Проверка кандидата; совпадение в памяти подтверждается через unrar."""
+        if not self.check_in_memory(password):
+            return False
+        if self.mode == MODE_UNRAR or not self.confirm_with_unrar:
+            return True
+        try:
+            confirmed = self._check_member_with_unrar(password)
+        except ValueError as e:
+            # unrar недоступен - проверка в памяти достаточно надежна сама по себе
+            logger.warning(f"RarPasswordVerifier: не удалось подтвердить пароль через unrar: {e}")
+            return True
+        if not confirmed:
+            logger.warning(f"RarPasswordVerifier: ложное срабатывание проверки в памяти для {self.rar_path}")
+        return confirmed
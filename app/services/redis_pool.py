@@ -0,0 +1,48 @@
+# app/services/redis_pool.py
+import threading
+import logging
+from typing import Optional
+import redis # Синхронный клиент Redis для Celery
+from redis.backoff import ExponentialBackoff
+from redis.retry import Retry
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Один синхронный клиент Redis на процесс (задачи воркера, уведомления, поток метрик, beat) вместо
+# нового соединения на каждую задачу:
+# - пул до REDIS_MAX_CONNECTIONS соединений; когда все заняты, команда ждет свободное до REDIS_POOL_TIMEOUT;
+# - при обрыве или таймауте команда повторяется до REDIS_RETRIES раз с экспоненциальной паузой и новым
+#   соединением, простаивающее соединение проверяется PING раз в REDIS_HEALTH_CHECK_INTERVAL;
+# - клиент создается лениво: в процессе prefork, а не в родителе (после fork redis-py сам сбрасывает пул).
+_client: Optional[redis.Redis] = None
+_client_lock = threading.Lock()
+
+
+def shared_redis() -> redis.Redis:
+    global _client
+    with _client_lock:
+        if _client is None:
+            pool = redis.BlockingConnectionPool.from_url(
+                settings.REDIS_URL,
+                max_connections=settings.REDIS_MAX_CONNECTIONS,
+                timeout=settings.REDIS_POOL_TIMEOUT,
+                socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+                retry=Retry(ExponentialBackoff(cap=1.0, base=0.05), settings.REDIS_RETRIES),
+                retry_on_error=[redis.exceptions.ConnectionError, redis.exceptions.TimeoutError],
+            )
+            _client = redis.Redis(connection_pool=pool)
+            logger.info(f"Пул соединений Redis процесса создан (до {settings.REDIS_MAX_CONNECTIONS} соединений)")
+        return _client
+
+
+def close_shared_redis():
+    """Закрывает соединения пула (при завершении процесса воркера)."""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client.connection_pool.disconnect()
+            _client = None
@@ -0,0 +1,110 @@
+# app/services/scheduling.py
+from typing import Any, Dict, List, Optional, Sequence
+import logging
+import redis # Синхронный клиент Redis для Celery
+import redis.asyncio as aioredis # Асинхронный клиент для FastAPI
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Планирование задач по очередям Celery:
+# - очередь выбирается по оценке длительности (estimator): короткие, средние и длинные задачи идут
+#   в разные очереди, поэтому их могут разбирать разные воркеры (см. WORKER_PROFILES в app/celery/celery.py);
+# - приоритет сообщения (0 - самый высокий у брокера Redis) = база класса размера + штраф за уже
+#   выполняющиеся задачи того же пользователя: внутри очереди задачи пользователя, занявшего кластер,
+#   уступают задачам остальных (fair share);
+# - fairshare:active - hash: пользователь -> число его незавершенных задач;
+#   bruteforce:{id}:owner - пользователь задачи (по нему счетчик уменьшается при завершении).
+SHORT_QUEUE = "bruteforce.short"
+MEDIUM_QUEUE = "bruteforce.medium"
+LONG_QUEUE = "bruteforce.long"
+BRUTEFORCE_QUEUES = (SHORT_QUEUE, MEDIUM_QUEUE, LONG_QUEUE)
+BASE_PRIORITY = {SHORT_QUEUE: 0, MEDIUM_QUEUE: 3, LONG_QUEUE: 6}
+MAX_PRIORITY = 9
+MAX_FAIR_SHARE_PENALTY = 3
+
+FAIR_SHARE_KEY = "fairshare:active"
+OWNER_KEY_TTL = 7 * 24 * 3600
+
+def owner_key(task_id_str: str) -> str:
+    return f"bruteforce:{task_id_str}:owner"
+
+
+def queue_for(estimated_seconds: float) -> str:
+    if estimated_seconds <= settings.QUEUE_SHORT_MAX_SECONDS:
+        return SHORT_QUEUE
+    if estimated_seconds <= settings.QUEUE_MEDIUM_MAX_SECONDS:
+        return MEDIUM_QUEUE
+    return LONG_QUEUE
+
+
+def default_route() -> Dict[str, Any]:
+    """Маршрут задачи без оценки (например, поставленной до планирования по очередям)."""
+    return {"queue": MEDIUM_QUEUE, "priority": BASE_PRIORITY[MEDIUM_QUEUE]}
+
+
+async def route_for(redis_client: Optional[aioredis.Redis], estimated_seconds: float, owner: str) -> Dict[str, Any]:
+    """Очередь и приоритет для задачи пользователя owner с оценкой длительности estimated_seconds."""
+    return (await routes_for(redis_client, [estimated_seconds], owner))[0]
+
+
+async def routes_for(redis_client: Optional[aioredis.Redis], estimated_seconds: Sequence[float],
+                     owner: str) -> List[Dict[str, Any]]:
+    """
+    Маршруты для пачки задач одного пользователя (одно чтение счетчика).
+    Каждая следующая задача пачки считается уже занявшей долю пользователя - как при отправке по одной.
+    """
+    active = 0
+    if redis_client:
+        raw = await redis_client.hget(FAIR_SHARE_KEY, owner)
+        active = int(raw) if raw else 0
+    routes = []
+    for index, seconds in enumerate(estimated_seconds):
+        queue = queue_for(seconds)
+        priority = min(BASE_PRIORITY[queue] + min(active + index, MAX_FAIR_SHARE_PENALTY), MAX_PRIORITY)
+        routes.append({"queue": queue, "priority": priority})
+    return routes
+
+
+async def acquire_share(redis_client: Optional[aioredis.Redis], task_id: int, owner: str):
+    """Учитывает задачу в доле пользователя (вызывается при отправке задачи воркерам)."""
+    await acquire_shares(redis_client, [task_id], owner)
+
+
+async def acquire_shares(redis_client: Optional[aioredis.Redis], task_ids: Sequence[int], owner: str):
+    if not redis_client or not task_ids:
+        return
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.hincrby(FAIR_SHARE_KEY, owner, len(task_ids))
+    for task_id in task_ids:
+        pipe.set(owner_key(str(task_id)), owner, ex=OWNER_KEY_TTL)
+    await pipe.execute()
+
+
+# Уменьшение счетчика идемпотентно: ключ владельца удаляется тем же скриптом,
+# поэтому повторный вызов (итог задачи и отмена одновременно) ничего не делает
+_RELEASE_SCRIPT = """
+local owner = redis.call('GET', KEYS[1])
+if not owner then return 0 end
+redis.call('DEL', KEYS[1])
+if redis.call('HINCRBY', KEYS[2], owner, -1) <= 0 then
+    redis.call('HDEL', KEYS[2], owner)
+end
+return 1
+"""
+
+async def release_share_async(redis_client: Optional[aioredis.Redis], task_id_str: str):
+    if redis_client:
+        await redis_client.eval(_RELEASE_SCRIPT, 2, owner_key(task_id_str), FAIR_SHARE_KEY)
+
+
+# --- Сторона воркера ---
+
+def release_share(redis_client: Optional[redis.Redis], task_id_str: str):
+    """Снимает задачу с доли пользователя (итог задачи)."""
+    if not redis_client:
+        return
+    try:
+        redis_client.eval(_RELEASE_SCRIPT, 2, owner_key(task_id_str), FAIR_SHARE_KEY)
+    except redis.exceptions.RedisError as e:
+        logger.error(f"[Task {task_id_str}] Ошибка Redis при снятии задачи с доли пользователя: {e}")
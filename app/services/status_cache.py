@@ -0,0 +1,116 @@
+# app/services/status_cache.py
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+import logging
+import redis # Синхронный клиент Redis для Celery
+import redis.asyncio as aioredis # Асинхронный клиент для FastAPI
+
+logger = logging.getLogger(__name__)
+
+# Кэш статусов задач для /get_status и /get_status_bulk:
+# - task:status:{id} - hash (status, progress, result); воркер пишет его вместе с записью в БД,
+#   поэтому кэш не старее БД (прогресс в БД вообще пишется пакетами, с задержкой);
+# - при промахе FastAPI читает БД и кладет строку в кэш, только если ключа еще нет - запись воркера важнее;
+# - статусы, которые меняет сам FastAPI или beat (отмена приостановленной задачи, отложенные задачи),
+#   пишутся в кэш так же, после записи в БД.
+STATUS_CACHE_TTL = 24 * 3600
+
+def status_key(task_id) -> str:
+    return f"task:status:{task_id}"
+
+
+# Итоговый статус не перезаписывается промежуточным (например, запоздалым прогрессом), а paused и deferred -
+# прогрессом шарда (running с progress): из paused в running задачу переводит resume, без прогресса.
+# Без прогресса строка не создается: прогресс неизвестен, следующее чтение возьмет строку из БД.
+# ARGV: TTL, status, progress ('' - не менять), result, есть ли result ('1'/'0' - пароль может быть пустым)
+_SET_STATUS_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], 'status')
+if not current and ARGV[3] == '' then return 0 end
+if current == 'completed' or current == 'failed' or current == 'cancelled' then
+    if ARGV[2] ~= 'completed' and ARGV[2] ~= 'failed' and ARGV[2] ~= 'cancelled' then return 0 end
+end
+if (current == 'paused' or current == 'deferred') and ARGV[2] == 'running' and ARGV[3] ~= '' then return 0 end
+redis.call('HSET', KEYS[1], 'status', ARGV[2])
+if ARGV[3] ~= '' then redis.call('HSET', KEYS[1], 'progress', ARGV[3]) end
+if ARGV[5] == '1' then redis.call('HSET', KEYS[1], 'result', ARGV[4]) end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+_POPULATE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then return 0 end
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+
+def decode_status(task_id: int, raw: Dict[bytes, bytes]) -> Dict[str, Any]:
+    """Строка кэша -> поля TaskStatus."""
+    result = raw.get(b"result")
+    return {
+        "task_id": task_id,
+        "status": raw[b"status"].decode("utf-8"),
+        "progress": int(raw.get(b"progress", b"0")),
+        "result": result.decode("utf-8") if result is not None else None,
+    }
+
+
+def _set_status_args(task_id: int, status: str, progress: Optional[int], result: Optional[str]) -> List[Any]:
+    return [_SET_STATUS_SCRIPT, 1, status_key(task_id), STATUS_CACHE_TTL, status,
+            "" if progress is None else progress, "" if result is None else result,
+            "1" if result is not None else "0"]
+
+
+# --- Сторона воркера ---
+
+def cache_task_status(redis_client: Optional[redis.Redis], task_ids: Sequence[int], status: str,
+                      progress: Optional[int], result: Optional[str] = None):
+    """Записывает статус задачи (и ее последователей) в кэш одним пайплайном (progress=None - не меняется)."""
+    if not redis_client:
+        return
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for task_id in task_ids:
+            pipe.eval(*_set_status_args(task_id, status, progress, result))
+        pipe.execute()
+    except redis.exceptions.RedisError as e:
+        logger.error(f"[Task {task_ids[0]}] Ошибка Redis при записи статуса в кэш: {e}")
+
+
+# --- Сторона FastAPI ---
+
+async def get_cached_statuses(redis_client: aioredis.Redis, task_ids: Sequence[int]) -> Dict[int, Dict[str, Any]]:
+    """Статусы из кэша одним пайплайном: {task_id: поля TaskStatus} (промахи не попадают в результат)."""
+    pipe = redis_client.pipeline(transaction=False)
+    for task_id in task_ids:
+        pipe.hgetall(status_key(task_id))
+    cached = {}
+    for task_id, raw in zip(task_ids, await pipe.execute()):
+        if raw and b"status" in raw:
+            cached[task_id] = decode_status(task_id, raw)
+    return cached
+
+
+async def populate_statuses(redis_client: aioredis.Redis, rows: Iterable[Dict[str, Any]]):
+    """Кладет прочитанные из БД статусы в кэш (если воркер не успел записать более свежие)."""
+    pipe = redis_client.pipeline(transaction=False)
+    count = 0
+    for row in rows:
+        fields = ["status", row["status"], "progress", row["progress"] or 0]
+        if row["result"] is not None:
+            fields += ["result", row["result"]]
+        pipe.eval(_POPULATE_SCRIPT, 1, status_key(row["task_id"]), STATUS_CACHE_TTL, *fields)
+        count += 1
+    if count:
+        await pipe.execute()
+
+
+async def cache_task_status_async(redis_client: Optional[aioredis.Redis], task_ids: Sequence[int], status: str,
+                                  progress: Optional[int] = None, result: Optional[str] = None):
+    """То же, что cache_task_status, для статусов, которые меняет FastAPI."""
+    if not redis_client:
+        return
+    pipe = redis_client.pipeline(transaction=False)
+    for task_id in task_ids:
+        pipe.eval(*_set_status_args(task_id, status, progress, result))
+    await pipe.execute()
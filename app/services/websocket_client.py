@@ -1,12 +1,27 @@
 import websockets
 import asyncio
 import json
+import sys
+import msgpack # Бинарные кадры подпротокола WS_SUBPROTOCOL_MSGPACK
+from app.websocket.manager import WS_SUBPROTOCOL_MSGPACK, WS_SUBPROTOCOL_JSON
 
-async def main():
-    async with websockets.connect("ws://localhost:8000/ws/123") as websocket:
-        print("Connected! Waiting for messages...")
+# Клиент предлагает бинарный формат, а если сервер его не знает - JSON (сервер выбирает первый знакомый)
+SUBPROTOCOLS = [WS_SUBPROTOCOL_MSGPACK, WS_SUBPROTOCOL_JSON]
+
+
+def decode_frame(message):
+    """Кадр WebSocket -> уведомление: бинарный кадр - msgpack, текстовый - JSON (rar.json.v1 и сервер без подпротоколов)."""
+    if isinstance(message, bytes):
+        return msgpack.unpackb(message)
+    return json.loads(message)
+
+
+async def main(task_id: str = "123"):
+    async with websockets.connect(f"ws://localhost:8000/ws/{task_id}", subprotocols=SUBPROTOCOLS) as websocket:
+        print(f"Connected ({websocket.subprotocol or 'json'})! Waiting for messages...")
         async for message in websocket:
-            data = json.loads(message)
-            print("\nReceived:", json.dumps(data, indent=2))
+            data = decode_frame(message)
+            print("\nReceived:", json.dumps(data, indent=2, ensure_ascii=False))
 
-asyncio.run(main())
\ No newline at end of file
+if __name__ == "__main__":
+    asyncio.run(main(*sys.argv[1:2]))
@@ -0,0 +1,211 @@
+# app/services/wordlist.py
+import datetime
+import mmap
+import os
+import shutil
+import tempfile
+from typing import BinaryIO, Callable, Iterator, List, Optional, Sequence, Tuple
+from app.core.config import settings
+
+# Атака по словарю. Ранг кандидата здесь - смещение в байтах начала строки словаря:
+# шард [start, end) проверяет строки, которые начинаются внутри диапазона, контрольная точка -
+# начало следующей непроверенной строки, прогресс - доля прочитанных байт.
+# Файл отображается в память (mmap), без правил кандидаты - memoryview-срезы отображения,
+# так что словарь любого размера не читается в RAM целиком и не копируется.
+
+WORDLIST_RULES = ("case", "leet", "digits", "years")
+ESTIMATE_SAMPLE_BYTES = 64 * 1024 # Сколько начала словаря читать для оценки числа кандидатов
+
+_LEET_TABLE = str.maketrans("aeiostAEIOST", "431057431057")
+
+
+def parse_rules(rules: Optional[str]) -> List[str]:
+    """'case,leet' -> ['case', 'leet'] с проверкой имен правил."""
+    names = [name.strip().lower() for name in (rules or "").split(",") if name.strip()]
+    unknown = [name for name in names if name not in WORDLIST_RULES]
+    if unknown:
+        raise ValueError(f"Неизвестные правила: {', '.join(unknown)}. Доступны: {', '.join(WORDLIST_RULES)}")
+    return [name for name in WORDLIST_RULES if name in names] # Порядок применения фиксирован
+
+
+def build_mangler(rules: Sequence[str]) -> Optional[Callable[[memoryview], List[bytes]]]:
+    """
+    Функция, превращающая слово в список кандидатов по правилам:
+    case - как есть, строчными, ПРОПИСНЫМИ, С заглавной; leet - плюс замена a->4, e->3, i->1, o->0, s->5, t->7;
+    digits - плюс приписанные числа 0..99; years - плюс приписанные годы 1950..текущий+1.
+    Без правил возвращает None (кандидат - само слово).
+    """
+    if not rules:
+        return None
+    suffixes = [""]
+    if "digits" in rules:
+        suffixes += [str(number) for number in range(100)]
+    if "years" in rules:
+        suffixes += [str(year) for year in range(1950, datetime.date.today().year + 2)]
+    use_case = "case" in rules
+    use_leet = "leet" in rules
+
+    def mangle(word: memoryview) -> List[bytes]:
+        raw = bytes(word)
+        try:
+            text = raw.decode("utf-8")
+        except UnicodeDecodeError:
+            return [raw] # Не UTF-8 - проверяем строку как есть
+        variants = [text]
+        if use_case:
+            variants += [text.lower(), text.upper(), text.capitalize()]
+        if use_leet:
+            variants += [variant.translate(_LEET_TABLE) for variant in variants]
+        variants = list(dict.fromkeys(variants)) # Убираем повторы, сохраняя порядок
+        return [(variant + suffix).encode("utf-8") for variant in variants for suffix in suffixes]
+
+    return mangle
+
+
+def resolve_wordlist(name: str) -> str:
+    """Путь к серверному словарю по имени файла в WORDLIST_DIR (без выхода за пределы каталога)."""
+    if not name or os.path.basename(name) != name or name.startswith("."):
+        raise ValueError(f"Некорректное имя словаря: '{name}'")
+    path = os.path.join(settings.WORDLIST_DIR, name)
+    if not os.path.isfile(path):
+        raise ValueError(f"Словарь '{name}' не найден на сервере")
+    return os.path.abspath(path)
+
+
+def save_uploaded_wordlist(source: BinaryIO) -> str:
+    """Сохраняет загруженный словарь на диск потоком (кусками, без чтения в память целиком)."""
+    upload_dir = os.path.join(settings.WORDLIST_DIR, "uploads")
+    os.makedirs(upload_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=upload_dir, suffix=".txt", delete=False) as target:
+        shutil.copyfileobj(source, target, 1024 * 1024)
+        return os.path.abspath(target.name)
+
+
+class WordlistBatch:
+    """Пакет кандидатов из словаря: memoryview-срезы отображения файла или строки после правил."""
+    __slots__ = ("candidates", "start", "end", "count")
+
+    def __init__(self):
+        self.candidates: list = []
+        self.start = 0 # Ранг (смещение) первой строки пакета
+        self.end = 0 # Ранг, с которого начнется следующий пакет
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator:
+        return iter(self.candidates)
+
+    def password(self, index: int) -> bytes:
+        return bytes(self.candidates[index])
+
+
+class WordlistSpace:
+    """Пространство кандидатов из файла словаря (по строке на слово) с правилами изменения слов."""
+
+    def __init__(self, path: str, rules: Sequence[str] = ()):
+        self.path = path
+        self.rules = list(rules)
+        self._mangle = build_mangler(self.rules)
+        self._file = open(path, "rb")
+        self.size = os.fstat(self._file.fileno()).st_size
+        # mmap пустого файла невозможен
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size > 0 else b""
+        self._view = memoryview(self._mm)
+        if self.size > 0 and hasattr(mmap, "MADV_SEQUENTIAL"):
+            self._mm.madvise(mmap.MADV_SEQUENTIAL) # Подсказка ядру: читаем подряд, страницы можно не держать
+
+    def close(self):
+        self._view.release()
+        if self.size > 0:
+            try:
+                self._mm.close()
+            except BufferError:
+                pass # Срезы последнего пакета еще живы - отображение закроется сборщиком мусора
+        self._file.close()
+
+    def _line_start(self, pos: int) -> int:
+        """Начало первой строки, которая начинается не раньше pos."""
+        if pos <= 0:
+            return 0
+        if pos >= self.size or self._mm[pos - 1] == 0x0A:
+            return min(pos, self.size)
+        newline = self._mm.find(b"\n", pos)
+        return self.size if newline < 0 else newline + 1
+
+    def _word_bounds(self, pos: int):
+        """(начало слова, конец слова без \\r\\n, начало следующей строки) для строки, начинающейся в pos."""
+        newline = self._mm.find(b"\n", pos)
+        line_end = self.size if newline < 0 else newline
+        word_end = line_end - 1 if line_end > pos and self._mm[line_end - 1] == 0x0D else line_end
+        return pos, word_end, min(line_end + 1, self.size)
+
+    def iter_words(self, start: int) -> Iterator[Tuple[int, memoryview, int]]:
+        """
+        Непустые слова строк, которые начинаются не раньше ранга start:
+        (ранг начала строки, слово - срез отображения без \\r\\n, ранг следующей строки). Правила не применяются.
+        """
+        pos = self._line_start(start)
+        while pos < self.size:
+            word_start, word_end, next_pos = self._word_bounds(pos)
+            if word_end > word_start:
+                yield pos, self._view[word_start:word_end], next_pos
+            pos = next_pos
+
+    def password_at(self, rank: int) -> bytes:
+        """Слово строки, в которой лежит смещение rank (для отображения текущей позиции)."""
+        line_start = self._mm.rfind(b"\n", 0, min(rank, self.size)) + 1
+        word_start, word_end, _ = self._word_bounds(line_start)
+        return bytes(self._view[word_start:word_end])
+
+    def estimate_candidates(self, sample_size: int = ESTIMATE_SAMPLE_BYTES) -> int:
+        """
+        Оценка числа кандидатов (ранги словаря - байты, а не слова): по первым sample_size байтам
+        считается, сколько кандидатов (с учетом правил) приходится на байт, и результат масштабируется.
+        """
+        sample_end = min(self.size, sample_size)
+        sampled = 0
+        pos = 0
+        while pos < sample_end:
+            word_start, word_end, pos = self._word_bounds(pos)
+            if word_end > word_start:
+                sampled += 1 if self._mangle is None else len(self._mangle(self._view[word_start:word_end]))
+        if pos == 0 or pos >= self.size:
+            return sampled
+        return int(sampled * self.size / pos)
+
+    def new_batch(self, batch_size: int) -> WordlistBatch:
+        return WordlistBatch()
+
+    def next_batch(self, batch: WordlistBatch, start: int, end: int, max_count: int) -> int:
+        """
+        Заполняет пакет кандидатами из строк, начинающихся в [start, end); строка (со всеми
+        вариантами по правилам) не делится между пакетами. Возвращает ранг следующего пакета.
+        """
+        candidates = batch.candidates
+        candidates.clear()
+        view = self._view
+        mangle = self._mangle
+        pos = self._line_start(start)
+        while pos < end and len(candidates) < max_count:
+            word_start, word_end, pos = self._word_bounds(pos)
+            if word_end > word_start: # Пустые строки пропускаем
+                word = view[word_start:word_end]
+                if mangle is None:
+                    candidates.append(word)
+                else:
+                    candidates.extend(mangle(word))
+        batch.start = start
+        # Последняя строка могла закончиться за end, но все строки, начинающиеся в [start, end), уже здесь
+        batch.end = min(pos, end)
+        batch.count = len(candidates)
+        return batch.end
+
+    def iter_batches(self, start: int, end: int, batch_size: int) -> Iterator[WordlistBatch]:
+        """Пакеты для диапазона [start, end); один и тот же объект пакета перезаполняется."""
+        batch = self.new_batch(batch_size)
+        rank = start
+        while rank < end:
+            rank = self.next_batch(batch, rank, end, batch_size)
+            yield batch
@@ -1,21 +1,182 @@
 # app/websocket/manager.py
-from typing import Dict, Set, Any
-from fastapi import WebSocket, WebSocketDisconnect
+from typing import Callable, Deque, Dict, Any, List, Optional, Tuple
+from collections import deque
+from fastapi import WebSocket
+import redis # Исключения (в redis.asyncio модуля exceptions нет)
 import redis.asyncio as aioredis # Используем alias для ясности
 import json
+import msgpack # Бинарные кадры для клиентов с подпротоколом WS_SUBPROTOCOL_MSGPACK
 import asyncio
 import logging
+import time
+from app.core.config import settings
+from app.services.control import send_control_command # Канал управления задачами
+from app.services.events import decode_published, publish_event, read_events, parse_event_id # Журнал уведомлений задачи
+from app.services.metrics import metrics, process_label # Метрики для /metrics
 
 logger = logging.getLogger(__name__)
 
+# Уведомления воркеров приходят в каналы ws:{task_id}. Процесс API подписан на все такие каналы
+# одной шаблонной подпиской (ws:*), а не подписывается на канал каждой задачи отдельно.
+WS_CHANNEL_PATTERN = "ws:*"
+SLOW_CLIENT_CLOSE_CODE = 1013 # Try Again Later: клиент не успевает принимать сообщения
+
+# Формат кадров клиенту выбирается подпротоколом WebSocket (Sec-WebSocket-Protocol) при подключении:
+# - WS_SUBPROTOCOL_MSGPACK - бинарные кадры, каждое уведомление - словарь msgpack;
+# - WS_SUBPROTOCOL_JSON или без подпротокола (прежние клиенты) - текстовые кадры JSON.
+# Поля уведомлений одинаковы в обоих форматах; команды (pause/resume/cancel) клиент шлет текстом JSON.
+WS_SUBPROTOCOL_MSGPACK = "rar.msgpack.v2"
+WS_SUBPROTOCOL_JSON = "rar.json.v1"
+WS_SUBPROTOCOLS = (WS_SUBPROTOCOL_MSGPACK, WS_SUBPROTOCOL_JSON)
+
+
+def negotiate_subprotocol(offered: List[str]) -> Optional[str]:
+    """Первый из предложенных клиентом подпротоколов, который знает сервер (None - прежний клиент, JSON)."""
+    return next((protocol for protocol in offered if protocol in WS_SUBPROTOCOLS), None)
+
+
+class OutgoingMessage:
+    """
+    Уведомление для клиентов задачи. Кодируется при первой отправке в нужном формате и не больше
+    одного раза на формат - все клиенты получают одни и те же готовые байты (или текст).
+    """
+    __slots__ = ("message", "_text", "_packed")
+
+    def __init__(self, message: Dict[str, Any]):
+        self.message = message
+        self._text: Optional[str] = None
+        self._packed: Optional[bytes] = None
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = json.dumps(self.message)
+        return self._text
+
+    @property
+    def packed(self) -> bytes:
+        if self._packed is None:
+            self._packed = msgpack.packb(self.message)
+        return self._packed
+
+
+class ClientConnection:
+    """
+    Отправка сообщений одному клиенту WebSocket из собственной задачи asyncio, поэтому медленный
+    клиент не задерживает остальных. PROGRESS не копится: хранится только последний, и клиенту он
+    уходит не чаще WS_PROGRESS_MAX_RATE раз в секунду. Остальные события (STARTED, PAUSED, COMPLETED...)
+    идут по порядку через ограниченную очередь; если она переполнилась, клиент отключается.
+    Пока клиенту повторяются уведомления из журнала задачи (replay), новые уведомления из канала
+    придерживаются, а потом отправляются без тех, что уже были в повторе (по event_id).
+    Для уведомлений из канала замеряется задержка доставки: event_id - время записи в журнал Redis (мс).
+    binary - клиент выбрал WS_SUBPROTOCOL_MSGPACK и получает бинарные кадры вместо текста JSON.
+    """
+
+    def __init__(self, websocket: WebSocket, task_id: str, on_failure: Callable[["ClientConnection"], None],
+                 binary: bool = False):
+        self.websocket = websocket
+        self.task_id = task_id
+        self.binary = binary
+        self._on_failure = on_failure
+        self._events: Deque[Tuple[OutgoingMessage, Optional[float]]] = deque() # (сообщение, время публикации в Redis)
+        self._latest_progress: Optional[Tuple[OutgoingMessage, Optional[float]]] = None
+        self._last_progress_at = 0.0
+        self._last_event_id: Tuple[int, int] = (-1, -1)
+        self._held: Optional[list] = [] # Уведомления, пришедшие во время повтора журнала
+        self._wakeup = asyncio.Event()
+        self._sender = asyncio.create_task(self._run())
+
+    def push(self, message: OutgoingMessage, is_progress: bool, event_id: Optional[Tuple[int, int]] = None) -> bool:
+        """Ставит сообщение в очередь клиента. False - очередь переполнена (клиент слишком медленный)."""
+        if self._held is not None:
+            self._held.append((message, is_progress, event_id, True))
+            return True
+        return self._enqueue(message, is_progress, event_id, live=True)
+
+    def replay(self, events: List[Tuple[OutgoingMessage, bool, Tuple[int, int]]]) -> bool:
+        """Ставит в очередь уведомления из журнала, затем придержанные на время повтора. False - переполнение."""
+        held, self._held = self._held or [], None
+        for message, is_progress, event_id, live in [(*event, False) for event in events] + held:
+            if not self._enqueue(message, is_progress, event_id, live):
+                return False
+        return True
+
+    def _enqueue(self, message: OutgoingMessage, is_progress: bool, event_id: Optional[Tuple[int, int]], live: bool = False) -> bool:
+        if event_id is not None:
+            if event_id <= self._last_event_id:
+                return True # Уже есть в повторе журнала
+            self._last_event_id = event_id
+        # Задержку доставки считаем только для уведомлений из канала - повтор журнала отдает старые события
+        item = (message, event_id[0] / 1000 if live and event_id is not None else None)
+        if is_progress:
+            self._latest_progress = item # Предыдущий неотправленный прогресс больше не нужен
+        else:
+            if len(self._events) >= settings.WS_SEND_QUEUE_SIZE:
+                return False
+            self._latest_progress = None # Прогресс, пришедший до события, устарел
+            self._events.append(item)
+        self._wakeup.set()
+        return True
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        interval = 1.0 / settings.WS_PROGRESS_MAX_RATE if settings.WS_PROGRESS_MAX_RATE > 0 else 0.0
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while self._events:
+                    await self._send(*self._events.popleft(), kind="event")
+                if self._latest_progress is None:
+                    continue
+                delay = self._last_progress_at + interval - loop.time()
+                if delay > 0:
+                    # Ждем окончания интервала, но событие (или более свежий прогресс) будит раньше
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), delay)
+                    except asyncio.TimeoutError:
+                        self._wakeup.set()
+                    continue
+                item, self._latest_progress = self._latest_progress, None
+                self._last_progress_at = loop.time()
+                await self._send(*item, kind="progress")
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning(f"WebSocketManager: отправка клиенту задачи {self.task_id} прервана: {e!r}")
+            self._on_failure(self)
+
+    async def _send(self, message: OutgoingMessage, published_at: Optional[float] = None, kind: str = "event"):
+        # Клиент, который не принимает сообщение дольше таймаута, считается отключенным
+        await asyncio.wait_for(self.send_now(message), settings.WS_SEND_TIMEOUT_SECONDS)
+        if published_at is not None:
+            # PROGRESS включает и ожидание ограничения частоты (WS_PROGRESS_MAX_RATE)
+            metrics.observe("rar_ws_delivery_seconds", max(time.time() - published_at, 0.0), kind=kind)
+
+    async def send_now(self, message: OutgoingMessage):
+        """Отправка мимо очереди в формате клиента (ответы на команды клиента)."""
+        if self.binary:
+            await self.websocket.send_bytes(message.packed)
+        else:
+            await self.websocket.send_text(message.text)
+
+    async def close(self, code: Optional[int] = None):
+        if self._sender is not asyncio.current_task():
+            self._sender.cancel()
+        if code is not None:
+            try:
+                await self.websocket.close(code=code)
+            except Exception:
+                pass # Соединение уже закрыто
+
+
 class WebSocketManager:
     def __init__(self):
-        self.active_connections: Dict[str, Set[WebSocket]] = {}
+        self.active_connections: Dict[str, Dict[WebSocket, ClientConnection]] = {}
         self.redis_client: aioredis.Redis | None = None
         self.pubsub: aioredis.client.PubSub | None = None
         self.listener_task: asyncio.Task | None = None
-        # Адрес Redis, лучше вынести в конфигурацию
-        self.redis_url = "redis://localhost:6379/0"
+        self.redis_url = settings.REDIS_URL
 
 
     async def initialize(self):
@@ -26,7 +187,7 @@ class WebSocketManager:
                 self.redis_client = aioredis.from_url(self.redis_url, decode_responses=False)
                 await self.redis_client.ping()
                 logger.info("WebSocketManager: Redis клиент успешно подключен.")
-                self.pubsub = self.redis_client.pubsub()
+                await self._subscribe()
                 # Запускаем задачу прослушивания Redis в фоне
                 self.listener_task = asyncio.create_task(self._listen_redis())
                 logger.info("WebSocketManager: Задача прослушивания Redis создана и запущена.")
@@ -36,133 +197,151 @@ class WebSocketManager:
                 self.pubsub = None
                 raise
 
+    async def _subscribe(self):
+        self.pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+        await self.pubsub.psubscribe(WS_CHANNEL_PATTERN)
+        logger.info(f"WebSocketManager: Подписались на Redis каналы по шаблону '{WS_CHANNEL_PATTERN}'")
+
     async def _get_channel_name(self, task_id: str) -> str:
         return f"ws:{task_id}"
 
-    async def connect(self, task_id: str, websocket: WebSocket):
+    async def connect(self, task_id: str, websocket: WebSocket, last_event_id: Optional[str] = None):
+        """
+        Подключает клиента и сразу отправляет ему текущее состояние задачи из журнала,
+        а если передан last_event_id - все уведомления после него (для переподключения).
+        """
         if not self.redis_client or not self.pubsub:
             logger.error("WebSocketManager не инициализирован. Невозможно подключить WebSocket.")
             await websocket.close(code=1011) # Внутренняя ошибка сервера
             return
 
-        await websocket.accept()
-        channel_name = await self._get_channel_name(task_id)
-
-        if task_id not in self.active_connections or not self.active_connections[task_id]:
-            self.active_connections[task_id] = set()
-            try:
-                await self.pubsub.subscribe(channel_name)
-                logger.info(f"WebSocketManager: Подписались на Redis канал '{channel_name}'")
-            except Exception as e:
-                logger.error(f"WebSocketManager: Ошибка подписки на Redis канал '{channel_name}': {e}")
-                await websocket.close(code=1011)
-                return
-        
-        self.active_connections[task_id].add(websocket)
-        logger.info(f"WebSocket подключен для task_id: {task_id}. Всего соединений для этой задачи: {len(self.active_connections[task_id])}")
+        subprotocol = negotiate_subprotocol(websocket.scope.get("subprotocols", []))
+        await websocket.accept(subprotocol=subprotocol)
+        connections = self.active_connections.setdefault(task_id, {})
+        # Соединение регистрируется до чтения журнала - уведомление между чтением и регистрацией не потеряется
+        connection = ClientConnection(websocket, task_id, self._drop_slow_client,
+                                      binary=subprotocol == WS_SUBPROTOCOL_MSGPACK)
+        connections[websocket] = connection
+        self._report_connections()
+        logger.info(f"WebSocket подключен для task_id: {task_id} (формат {subprotocol or 'json'}). "
+                    f"Всего соединений для этой задачи: {len(connections)}")
+        events = []
+        try:
+            events = await read_events(self.redis_client, task_id, last_event_id)
+        except redis.exceptions.RedisError as e:
+            logger.error(f"WebSocketManager: Ошибка чтения журнала уведомлений задачи {task_id}: {e}")
+        finally:
+            # Повтор выполняется при любой ошибке чтения журнала - иначе соединение навсегда придерживает
+            # уведомления из канала (и копит их в памяти)
+            replayed = [
+                (OutgoingMessage({**message, "event_id": event_id, **({"snapshot": True} if snapshot else {})}),
+                 message.get("status") == "PROGRESS", parse_event_id(event_id))
+                for event_id, message, snapshot in events
+            ]
+            if not connection.replay(replayed):
+                self._drop_slow_client(connection)
 
     async def disconnect(self, task_id: str, websocket: WebSocket):
-        if task_id in self.active_connections:
-            self.active_connections[task_id].remove(websocket)
-            logger.info(f"WebSocket отключен для task_id: {task_id}. Осталось соединений: {len(self.active_connections[task_id])}")
-            if not self.active_connections[task_id]: # Если для task_id больше нет активных соединений
-                del self.active_connections[task_id]
-                if self.pubsub:
-                    channel_name = await self._get_channel_name(task_id)
-                    try:
-                        await self.pubsub.unsubscribe(channel_name)
-                        logger.info(f"WebSocketManager: Отписались от Redis канала '{channel_name}'")
-                    except Exception as e:
-                        logger.error(f"WebSocketManager: Ошибка отписки от Redis канала '{channel_name}': {e}")
-        else:
-            logger.warning(f"Попытка отключить WebSocket для неизвестного task_id: {task_id}")
+        connections = self.active_connections.get(task_id)
+        connection = connections.pop(websocket, None) if connections is not None else None
+        if connection is None:
+            return # Уже отключен (например, закрыт как медленный клиент)
+        await connection.close()
+        logger.info(f"WebSocket отключен для task_id: {task_id}. Осталось соединений: {len(connections)}")
+        if not connections: # Если для task_id больше нет активных соединений
+            del self.active_connections[task_id]
+        self._report_connections()
 
-    async def _listen_redis(self):
-        if not self.pubsub:
-            logger.error("WebSocketManager: PubSub не инициализирован. Прослушивание Redis невозможно.")
+    def _drop_slow_client(self, connection: ClientConnection):
+        """Закрывает соединение клиента, который не успевает принимать сообщения (или уже отвалился)."""
+        connections = self.active_connections.get(connection.task_id)
+        if connections is None or connections.pop(connection.websocket, None) is None:
             return
+        if not connections:
+            del self.active_connections[connection.task_id]
+        self._report_connections()
+        asyncio.create_task(connection.close(code=SLOW_CLIENT_CLOSE_CODE))
+
+    def _report_connections(self):
+        metrics.set_gauge("rar_ws_connections", sum(len(connections) for connections in self.active_connections.values()),
+                          process=process_label())
 
+    def _dispatch(self, channel_bytes: bytes, data_bytes: bytes):
+        """Раскладывает сообщение из Redis по очередям клиентов задачи (без ожидания отправки)."""
+        task_id_from_channel = channel_bytes.decode('utf-8').split(':')[-1]
+        connections = self.active_connections.get(task_id_from_channel)
+        if not connections:
+            return # Клиенты этой задачи подключены к другому процессу API (или ни к какому)
+        try:
+            task_id_from_payload, event_id, actual_message_for_client = decode_published(data_bytes)
+        except ValueError as e:
+            logger.error(f"WebSocketManager: Не удалось декодировать сообщение Redis из канала {channel_bytes!r}: {e}")
+            return
+        if not actual_message_for_client or task_id_from_payload != task_id_from_channel:
+            logger.error(f"WebSocketManager: Некорректное сообщение из Redis или несоответствие task_id: "
+                         f"{task_id_from_payload}, {actual_message_for_client}")
+            return
+
+        # Кодируется один раз на всех клиентов задачи (в каждом запрошенном формате); event_id клиент передаст при переподключении
+        message = OutgoingMessage({**actual_message_for_client, "event_id": event_id} if event_id else actual_message_for_client)
+        is_progress = actual_message_for_client.get("status") == "PROGRESS"
+        parsed_event_id = parse_event_id(event_id) if event_id else None
+        for connection in list(connections.values()):
+            if not connection.push(message, is_progress, parsed_event_id):
+                logger.warning(f"WebSocketManager: клиент задачи {task_id_from_channel} не успевает принимать сообщения, отключаем.")
+                self._drop_slow_client(connection)
+        logger.debug(f"WebSocketManager: сообщение {actual_message_for_client.get('status')} для задачи "
+                     f"{task_id_from_channel} поставлено в очередь клиентам: {len(connections)}")
+
+    async def _listen_redis(self):
         logger.info("WebSocketManager: Запуск цикла прослушивания Redis...")
         while True:
             try:
-                # timeout важен, чтобы цикл мог прерваться, если задача отменена
-                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
-                if message and message.get("type") == "message":
-                    # message['channel'] и message['data'] - это bytes
-                    channel_bytes: bytes = message['channel']
-                    data_bytes: bytes = message['data']
-                    
-                    channel_str = channel_bytes.decode('utf-8')
-                    task_id_from_channel = channel_str.split(':')[-1]
-                    
-                    try:
-                        payload_str = data_bytes.decode('utf-8')
-                        # Сообщение из Redis имеет структуру: {'task_id': ..., 'message': <сообщение для клиента>}
-                        payload_from_redis = json.loads(payload_str) 
-                        
-                        actual_message_for_client = payload_from_redis.get('message')
-                        task_id_from_payload = payload_from_redis.get('task_id')
-
-                        if not actual_message_for_client or task_id_from_payload != task_id_from_channel:
-                            logger.error(f"WebSocketManager: Некорректное сообщение из Redis или несоответствие task_id: {payload_str}")
-                            continue
-
-                        logger.info(f"WebSocketManager: Получено сообщение из Redis для task_id {task_id_from_channel}: {actual_message_for_client}")
-
-                        if task_id_from_channel in self.active_connections:
-                            # Отправляем сообщение всем подключенным клиентам для этого task_id
-                            # Используем list() для создания копии, чтобы избежать проблем при изменении set во время итерации
-                            disconnected_clients = []
-                            for ws_client in list(self.active_connections[task_id_from_channel]):
-                                try:
-                                    await ws_client.send_json(actual_message_for_client)
-                                except WebSocketDisconnect:
-                                    logger.warning(f"WebSocketManager: Клиент для task {task_id_from_channel} отключился во время отправки.")
-                                    disconnected_clients.append(ws_client)
-                                except Exception as e_ws_send:
-                                    logger.error(f"WebSocketManager: Ошибка отправки сообщения клиенту для task {task_id_from_channel}: {e_ws_send}")
-                                    disconnected_clients.append(ws_client) # Также считаем его отключенным
-                            
-                            # Удаляем отключившихся клиентов
-                            for ws_client in disconnected_clients:
-                                if ws_client in self.active_connections.get(task_id_from_channel, set()):
-                                    await self.disconnect(task_id_from_channel, ws_client) # Используем метод disconnect для корректной отписки от Redis если нужно
-
-                            logger.debug(f"Сообщение отправлено клиентам для задачи {task_id_from_channel}")
-                        else:
-                            logger.warning(f"Нет активных WebSocket соединений для task_id {task_id_from_channel}, чтобы отправить сообщение.")
-                    
-                    except json.JSONDecodeError:
-                        logger.error(f"WebSocketManager: Не удалось декодировать JSON из сообщения Redis: {data_bytes.decode('utf-8', errors='ignore')}")
-                    except Exception as e_proc:
-                        logger.error(f"WebSocketManager: Ошибка обработки сообщения из Redis: {e_proc}", exc_info=True)
-                
-                await asyncio.sleep(0.01) # Небольшая пауза, чтобы дать другим задачам выполниться
-            
+                # listen() ждет сообщения без опроса по таймауту
+                async for message in self.pubsub.listen():
+                    if message.get("type") == "pmessage":
+                        try:
+                            self._dispatch(message['channel'], message['data'])
+                        except Exception as e_proc:
+                            logger.error(f"WebSocketManager: Ошибка обработки сообщения из Redis: {e_proc}", exc_info=True)
             except asyncio.CancelledError:
                 logger.info("WebSocketManager: Задача прослушивания Redis была отменена.")
                 break
-            except aioredis.exceptions.ConnectionError as e_conn:
+            except redis.exceptions.ConnectionError as e_conn:
                 logger.error(f"WebSocketManager: Ошибка соединения с Redis в слушателе: {e_conn}. Попытка переподключения через 5с...")
                 await asyncio.sleep(5)
-                # Попытка переинициализировать pubsub и переподписаться на активные каналы
-                # Это упрощенный вариант. В продакшене может потребоваться более сложная логика.
-                if self.redis_client:
-                    logger.info("WebSocketManager: Попытка переинициализации PubSub и переподписки...")
-                    self.pubsub = self.redis_client.pubsub()
-                    active_task_ids = list(self.active_connections.keys())
-                    for tid in active_task_ids:
-                        channel = await self._get_channel_name(tid)
-                        await self.pubsub.subscribe(channel)
-                        logger.info(f"WebSocketManager: Переподписались на канал {channel} после ошибки соединения.")
-                else:
-                    logger.error("WebSocketManager: Невозможно переинициализировать PubSub, redis_client отсутствует.")
-                    break # Выход из цикла, если redis_client отсутствует
+                try:
+                    # Старая подписка держит свое соединение - закрываем ее перед новой
+                    await self.pubsub.aclose()
+                except redis.exceptions.RedisError as e_close:
+                    logger.warning(f"WebSocketManager: Ошибка закрытия старой подписки: {e_close}")
+                try:
+                    await self._subscribe() # Одна шаблонная подписка - переподписываться на каналы задач не нужно
+                except redis.exceptions.RedisError as e_resubscribe:
+                    logger.error(f"WebSocketManager: Не удалось переподписаться: {e_resubscribe}")
             except Exception as e:
                 logger.error(f"WebSocketManager: Непредвиденная ошибка в слушателе Redis: {e}", exc_info=True)
                 await asyncio.sleep(1) # Предотвращение быстрого цикла при ошибках
 
 
+    async def send_to_client(self, task_id: str, websocket: WebSocket, message_content: Dict[str, Any]):
+        """Ответ одному клиенту (например, ошибка команды) в формате, выбранном им при подключении."""
+        connection = self.active_connections.get(task_id, {}).get(websocket)
+        if connection is not None:
+            await connection.send_now(OutgoingMessage(message_content))
+        else:
+            await websocket.send_json(message_content)
+
+    async def send_control_command(self, task_id: str, command: str) -> List[Dict[str, Any]]:
+        """
+        Передает команду клиента (pause/resume/cancel) воркерам задачи через канал управления Redis.
+        Возвращает параметры приостановленных шардов (для resume и cancel).
+        """
+        if not self.redis_client:
+            logger.error("WebSocketManager: Redis клиент не инициализирован. Невозможно отправить команду.")
+            return []
+        return await send_control_command(self.redis_client, task_id, command)
+
     async def send_message_via_redis(self, message_content: Dict[str, Any], task_id: str):
         """
         Публикует сообщение в Redis. Этот метод НЕ ДОЛЖЕН вызываться из Celery напрямую,
@@ -174,18 +353,13 @@ class WebSocketManager:
             return
 
         channel_name = await self._get_channel_name(task_id)
-        # Структура сообщения для Redis Pub/Sub
-        payload_to_redis = {
-            'task_id': task_id,          # Для маршрутизации и проверки
-            'message': message_content   # Фактическое сообщение для WebSocket клиента
-        }
         try:
-            json_payload = json.dumps(payload_to_redis)
-            await self.redis_client.publish(channel_name, json_payload)
+            # Как и у воркера: запись в журнал задачи и публикация в канал с общим event_id
+            await publish_event(self.redis_client, task_id, message_content)
             logger.info(f"WebSocketManager: Опубликовано сообщение в Redis канал '{channel_name}': {message_content.get('status')}")
         except TypeError as e_type:
             logger.error(f"WebSocketManager: Ошибка сериализации сообщения для Redis (канал '{channel_name}'): {e_type}. Сообщение: {message_content}")
-        except aioredis.exceptions.RedisError as e_redis:
+        except redis.exceptions.RedisError as e_redis:
             logger.error(f"WebSocketManager: Ошибка Redis при публикации в канал '{channel_name}': {e_redis}")
         except Exception as e:
             logger.error(f"WebSocketManager: Непредвиденная ошибка при публикации сообщения в Redis для task {task_id} (канал '{channel_name}'): {e}", exc_info=True)
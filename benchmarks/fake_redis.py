@@ -0,0 +1,187 @@
+# benchmarks/fake_redis.py
+import time
+from typing import Any, Callable, Dict, List, Optional
+from app.services.events import PUBLISH_EVENT_SCRIPT, STREAM_FIELD, WIRE_VERSION
+from app.services.status_cache import _SET_STATUS_SCRIPT
+
+# Подмена синхронного клиента Redis в памяти процесса - только команды, которые вызывают воркер и метрики.
+# Lua-скрипты не исполняются: для известных скриптов (журнал уведомлений, кэш статусов) eval вызывает
+# их эквивалент на Python. Сетевой задержки нет, поэтому бенчмарки с подменой меряют стоимость
+# работы на стороне Python (сериализация, сборка пайплайнов, раскладка по клиентам), а не Redis.
+FINAL_STATUSES = (b"completed", b"failed", b"cancelled")
+
+
+def _bytes(value) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, float):
+        return repr(value).encode("utf-8")
+    return str(value).encode("utf-8")
+
+
+class FakePipeline:
+    def __init__(self, redis_client: "FakeRedis"):
+        self._redis = redis_client
+        self._commands: List[Callable[[], Any]] = []
+
+    def __getattr__(self, name: str):
+        method = getattr(self._redis, name)
+
+        def queue(*args, **kwargs):
+            self._commands.append(lambda: method(*args, **kwargs))
+            return self
+        return queue
+
+    def execute(self) -> List[Any]:
+        commands, self._commands = self._commands, []
+        return [command() for command in commands]
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data: Dict[bytes, Any] = {}
+        self.published = 0
+        self._subscribers: List[Callable[[bytes, bytes], None]] = []
+        self._last_event_id = (0, 0)
+        self._scripts = {
+            PUBLISH_EVENT_SCRIPT: self._publish_event,
+            _SET_STATUS_SCRIPT: self._set_status,
+        }
+
+    def subscribe(self, callback: Callable[[bytes, bytes], None]):
+        """callback(канал, сообщение) получает все публикации (как шаблонная подписка ws:*)."""
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[bytes, bytes], None]):
+        self._subscribers.remove(callback)
+
+    # --- Общие команды ---
+    def ping(self) -> bool:
+        return True
+
+    def close(self):
+        pass
+
+    def pipeline(self, transaction: bool = True) -> FakePipeline:
+        return FakePipeline(self)
+
+    def expire(self, key, seconds) -> bool:
+        return _bytes(key) in self.data
+
+    def delete(self, *keys) -> int:
+        return sum(self.data.pop(_bytes(key), None) is not None for key in keys)
+
+    def get(self, key) -> Optional[bytes]:
+        return self.data.get(_bytes(key))
+
+    def set(self, key, value, nx: bool = False, ex: Optional[int] = None) -> Optional[bool]:
+        if nx and _bytes(key) in self.data:
+            return None
+        self.data[_bytes(key)] = _bytes(value)
+        return True
+
+    # --- Хеши ---
+    def _hash(self, key) -> Dict[bytes, bytes]:
+        return self.data.setdefault(_bytes(key), {})
+
+    def hset(self, key, field=None, value=None, mapping: Optional[Dict] = None) -> int:
+        values = dict(mapping or {})
+        if field is not None:
+            values[field] = value
+        target = self._hash(key)
+        added = sum(_bytes(name) not in target for name in values)
+        target.update({_bytes(name): _bytes(item) for name, item in values.items()})
+        return added
+
+    def hget(self, key, field) -> Optional[bytes]:
+        return self.data.get(_bytes(key), {}).get(_bytes(field))
+
+    def hgetall(self, key) -> Dict[bytes, bytes]:
+        return dict(self.data.get(_bytes(key), {}))
+
+    def hvals(self, key) -> List[bytes]:
+        return list(self.data.get(_bytes(key), {}).values())
+
+    def hdel(self, key, *fields) -> int:
+        target = self.data.get(_bytes(key), {})
+        return sum(target.pop(_bytes(field), None) is not None for field in fields)
+
+    def hincrbyfloat(self, key, field, amount) -> float:
+        target = self._hash(key)
+        value = float(target.get(_bytes(field), b"0")) + float(amount)
+        target[_bytes(field)] = _bytes(value)
+        return value
+
+    # --- Множества и сортированные множества ---
+    def smembers(self, key) -> set:
+        return set(self.data.get(_bytes(key), set()))
+
+    def sadd(self, key, *members) -> int:
+        target = self.data.setdefault(_bytes(key), set())
+        added = {_bytes(member) for member in members} - target
+        target |= added
+        return len(added)
+
+    def zadd(self, key, mapping: Dict) -> int:
+        target = self.data.setdefault(_bytes(key), {})
+        added = sum(_bytes(member) not in target for member in mapping)
+        target.update({_bytes(member): float(score) for member, score in mapping.items()})
+        return added
+
+    def zrem(self, key, *members) -> int:
+        target = self.data.get(_bytes(key), {})
+        return sum(target.pop(_bytes(member), None) is not None for member in members)
+
+    # --- Потоки и публикации ---
+    def xadd(self, key, fields: Dict, maxlen: Optional[int] = None, approximate: bool = True) -> bytes:
+        milliseconds = int(time.time() * 1000)
+        if milliseconds <= self._last_event_id[0]:
+            self._last_event_id = (self._last_event_id[0], self._last_event_id[1] + 1)
+        else:
+            self._last_event_id = (milliseconds, 0)
+        event_id = f"{self._last_event_id[0]}-{self._last_event_id[1]}".encode("utf-8")
+        stream = self.data.setdefault(_bytes(key), [])
+        stream.append((event_id, {_bytes(name): _bytes(value) for name, value in fields.items()}))
+        if maxlen is not None and len(stream) > maxlen:
+            del stream[:len(stream) - maxlen]
+        return event_id
+
+    def publish(self, channel, message) -> int:
+        self.published += 1
+        for callback in self._subscribers:
+            callback(_bytes(channel), _bytes(message))
+        return len(self._subscribers)
+
+    # --- Скрипты ---
+    def eval(self, script: str, numkeys: int, *keys_and_args):
+        handler = self._scripts.get(script)
+        if handler is None:
+            raise NotImplementedError("FakeRedis: неизвестный Lua-скрипт")
+        return handler(list(keys_and_args[:numkeys]), list(keys_and_args[numkeys:]))
+
+    def _publish_event(self, keys: List, args: List) -> bytes:
+        # PUBLISH_EVENT_SCRIPT: запись в журнал задачи и публикация кадра с тем же event_id
+        stream_key, channel = keys
+        message, task_id_str, maxlen, _ = args
+        event_id = self.xadd(stream_key, {STREAM_FIELD: message}, maxlen=int(maxlen))
+        task_id = _bytes(task_id_str)
+        self.publish(channel, bytes([WIRE_VERSION, len(task_id)]) + task_id + bytes([len(event_id)]) + event_id + message)
+        return event_id
+
+    def _set_status(self, keys: List, args: List) -> int:
+        # _SET_STATUS_SCRIPT: итоговый статус не перезаписывается промежуточным
+        _, status, progress, result, has_result = (_bytes(arg) for arg in args)
+        current = self.hget(keys[0], "status")
+        if current is None and progress == b"":
+            return 0
+        if current in FINAL_STATUSES and status not in FINAL_STATUSES:
+            return 0
+        if current in (b"paused", b"deferred") and status == b"running" and progress != b"":
+            return 0
+        values = {"status": status}
+        if progress != b"":
+            values["progress"] = progress
+        if has_result == b"1":
+            values["result"] = result
+        self.hset(keys[0], mapping=values)
+        return 1
@@ -0,0 +1,54 @@
+# benchmarks/fixtures.py
+import hashlib
+import random
+import struct
+import zlib
+import rarfile
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from app.services.rar_tools import RAR5_PW_CHECK_SIZE, rar3_s2k
+
+# Тестовые архивы генерируются без rar: для бенчмарка проверки достаточно заголовков шифрования -
+# RarPasswordVerifier проверяет кандидатов по ним в памяти, как и для настоящих архивов с теми же параметрами.
+# Соль и содержимое берутся из генератора с фиксированным seed - архивы одинаковы от запуска к запуску.
+
+
+def make_rar5_archive(path: str, password: str, kdf_count: int, seed: int = 0) -> str:
+    """RAR5 с зашифрованными заголовками и проверочным значением (режим rar5_check_value)."""
+    salt = random.Random(seed).randbytes(16)
+    derived = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, (1 << kdf_count) + 32)
+    folded = bytearray(RAR5_PW_CHECK_SIZE)
+    for i, value in enumerate(derived):
+        folded[i % RAR5_PW_CHECK_SIZE] ^= value
+    check_value = bytes(folded) + hashlib.sha256(folded).digest()[:4]
+    # Тип блока, флаги блока, алгоритм (AES-256), флаги шифрования (есть проверочное значение) - vint по байту
+    body = bytes([rarfile.RAR5_BLOCK_ENCRYPTION, 0, 0, rarfile.RAR5_ENC_FLAG_HAS_CHECKVAL, kdf_count]) + salt + check_value
+    header = bytes([len(body)]) + body
+    with open(path, "wb") as f:
+        f.write(rarfile.RAR5_ID + struct.pack("<L", zlib.crc32(header)) + header)
+    return path
+
+
+def make_rar3_archive(path: str, password: str, seed: int = 0) -> str:
+    """RAR3 с зашифрованными заголовками (режим rar3_headers): главный заголовок, соль и зашифрованный заголовок файла."""
+    rng = random.Random(seed)
+    salt = rng.randbytes(8)
+    main_header = struct.pack("<HBHH", 0, rarfile.RAR_BLOCK_MAIN, rarfile.RAR_MAIN_PASSWORD, 13) + bytes(6)
+    payload = rng.randbytes(20)
+    file_header = struct.pack("<BHH", rarfile.RAR_BLOCK_FILE, rarfile.RAR_LONG_BLOCK, 7 + len(payload)) + payload
+    file_header = struct.pack("<H", zlib.crc32(file_header) & 0xFFFF) + file_header
+    file_header += bytes(-len(file_header) % 16)
+    key, iv = rar3_s2k(password, salt)
+    encryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).encryptor()
+    with open(path, "wb") as f:
+        f.write(rarfile.RAR_ID + main_header + salt + encryptor.update(file_header) + encryptor.finalize())
+    return path
+
+
+def make_wordlist(path: str, words: int, seed: int = 0) -> str:
+    """Словарь из words строчных слов длиной 4-10 символов."""
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    with open(path, "w", encoding="utf-8") as f:
+        for _ in range(words):
+            f.write("".join(rng.choice(letters) for _ in range(rng.randint(4, 10))) + "\n")
+    return path
@@ -0,0 +1,176 @@
+# benchmarks/run.py
+"""
+Бенчмарки перебора и уведомлений, без Redis, PostgreSQL и rar - с локальными подменами.
+
+Запуск из корня репозитория:
+    python -m benchmarks.run --output bench.json
+    python -m benchmarks.run --baseline bench.json --fail-on-regression
+
+Результат - JSON (секции generation, verification, progress, db, websocket). С --baseline в него
+добавляется сравнение: метрики *_per_second сравниваются как "больше - лучше", *_seconds - "меньше - лучше";
+изменение хуже --threshold процентов считается регрессией.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+SECTIONS = ("generation", "verification", "progress", "db", "websocket")
+BENCH_PASSWORD = "~~~~" # Вне перебираемого пространства: проверка никогда не завершается находкой
+
+
+def _parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Бенчмарки перебора паролей и уведомлений")
+    parser.add_argument("--output", default="-", help="Файл для JSON с результатами ('-' - stdout)")
+    parser.add_argument("--baseline", help="JSON предыдущего запуска для сравнения")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Допустимое ухудшение метрики, %%")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Код выхода 1 при регрессии относительно --baseline")
+    parser.add_argument("--only", default=",".join(SECTIONS), help="Секции через запятую")
+    parser.add_argument("--duration", type=float, default=2.0, help="Длительность одного замера скорости, с")
+    parser.add_argument("--repeat", type=int, default=3, help="Замеров на метрику (берется медиана)")
+    parser.add_argument("--kdf-count", type=int, default=15, help="kdf_count тестового RAR5 (15 - как у rar по умолчанию)")
+    parser.add_argument("--ticks", type=int, default=1000, help="Тиков прогресса для замера стоимости тика")
+    parser.add_argument("--tick-interval", type=float, default=0.01, help="Интервал тиков при замере замедления перебора, с")
+    parser.add_argument("--db-rows", type=int, default=1000, help="Задач в пакете записи прогресса")
+    parser.add_argument("--ws-clients", default="1,100,10000", help="Числа клиентов WebSocket через запятую")
+    parser.add_argument("--ws-rounds", type=int, default=20, help="Уведомлений на каждое число клиентов")
+    args = parser.parse_args(argv)
+    args.only = [section for section in args.only.split(",") if section]
+    unknown = set(args.only) - set(SECTIONS)
+    if unknown:
+        parser.error(f"Неизвестные секции: {', '.join(sorted(unknown))}. Доступны: {', '.join(SECTIONS)}")
+    args.ws_clients = [int(count) for count in args.ws_clients.split(",") if count]
+    return args
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _environment() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "commit": _git_commit(),
+    }
+
+
+def run_benchmarks(args: argparse.Namespace, workdir: str) -> Dict[str, Any]:
+    # Настройки читаются при импорте app.core.config - БД задается до импорта модулей приложения
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    from benchmarks import scenarios
+    from benchmarks.fake_redis import FakeRedis
+    from benchmarks.fixtures import make_rar3_archive, make_rar5_archive, make_wordlist
+    from app.db.database import create_missing_tables
+    from app.services.metrics import metrics
+    from app.services.notifier import notifier
+
+    create_missing_tables()
+    # Метрики и уведомления процесса уходят в подмену, а не в общий пул Redis (REDIS_URL)
+    redis_client = FakeRedis()
+    metrics._redis = notifier._redis = redis_client
+    wordlist_path = make_wordlist(os.path.join(workdir, "words.txt"), words=100_000)
+    brute_force = {"charset": "abcdefghijklmnopqrstuvwxyz0123456789", "max_length": 8}
+    results: Dict[str, Any] = {}
+    if "generation" in args.only:
+        results["generation"] = scenarios.bench_generation({
+            "charset": brute_force,
+            "mask": {"charset": "", "max_length": 0, "mask": "?u?l?l?l?l?d?d?d"},
+            "wordlist_rules": {"charset": "", "max_length": 0, "wordlist_path": wordlist_path, "rules": ["case", "digits"]},
+            "hybrid": {"charset": "", "max_length": 0, "wordlist_path": wordlist_path, "mask": "?d?d?d"},
+        }, args.duration, args.repeat)
+    if "verification" in args.only:
+        results["verification"] = scenarios.bench_verification({
+            "rar5": make_rar5_archive(os.path.join(workdir, "bench5.rar"), BENCH_PASSWORD, args.kdf_count),
+            "rar3": make_rar3_archive(os.path.join(workdir, "bench3.rar"), BENCH_PASSWORD),
+        }, brute_force, args.duration, args.repeat)
+    if "progress" in args.only:
+        results["progress"] = scenarios.bench_progress(redis_client, brute_force, args.ticks, args.tick_interval, args.duration, args.repeat)
+    if "db" in args.only:
+        results["db"] = scenarios.bench_db(args.db_rows, args.repeat)
+    if "websocket" in args.only:
+        results["websocket"] = scenarios.bench_websocket(redis_client, args.ws_clients, args.ws_rounds)
+    notifier.close()
+    metrics.close()
+    return results
+
+
+# --- Сравнение с предыдущим запуском ---
+
+def _flatten(results: Dict[str, Any], prefix: str = "") -> Iterator[Tuple[str, float]]:
+    for name, value in results.items():
+        key = f"{prefix}{name}"
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{key}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield key, float(value)
+
+
+def _higher_is_better(key: str) -> Optional[bool]:
+    if key.endswith("_per_second"):
+        return True
+    if key.endswith("_seconds") and not key.endswith("interval_seconds"):
+        return False
+    return None # Параметры и производные метрики не сравниваются
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> Dict[str, Dict[str, Any]]:
+    """Метрика -> {baseline, current, change_percent, regression}; change_percent > 0 - стало лучше."""
+    previous = dict(_flatten(baseline.get("results", {})))
+    comparison = {}
+    for key, current in _flatten(results):
+        higher_is_better = _higher_is_better(key)
+        if higher_is_better is None or not previous.get(key):
+            continue
+        change = (current - previous[key]) / previous[key] * 100
+        if not higher_is_better:
+            change = -change
+        comparison[key] = {"baseline": previous[key], "current": current,
+                           "change_percent": round(change, 2), "regression": change < -threshold}
+    return comparison
+
+
+def main(argv=None) -> int:
+    args = _parse_args(argv)
+    started = time.time()
+    with tempfile.TemporaryDirectory(prefix="rar-bench-") as workdir:
+        results = run_benchmarks(args, workdir)
+    report: Dict[str, Any] = {
+        "schema_version": 1,
+        "started_at": started,
+        "elapsed_seconds": round(time.time() - started, 2),
+        "environment": _environment(),
+        "parameters": {name: value for name, value in vars(args).items()
+                       if name not in ("output", "baseline", "fail_on_regression")},
+        "results": results,
+    }
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["comparison"] = compare(results, json.load(f), args.threshold)
+        regressions = [key for key, item in report["comparison"].items() if item["regression"]]
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    for key in regressions:
+        item = report["comparison"][key]
+        print(f"Регрессия {key}: {item['baseline']:.6g} -> {item['current']:.6g} ({item['change_percent']}%)", file=sys.stderr)
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,304 @@
+# benchmarks/scenarios.py
+import asyncio
+import statistics
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from app.celery.celery import celery_db_instance
+from app.db.database import create_missing_tables, engine, task_table
+from app.db.progress_writer import ProgressWriter
+from app.services.bruteforce import (MAX_BATCH_SIZE, _publish_notification_to_redis, _report_shard_progress, _search_range,
+                                     _update_task_status, load_checkpoint, save_checkpoint, update_task_db_status)
+from app.services.dedupe import task_followers
+from app.services.keyspace import build_candidate_space
+from app.services.metrics import metrics, process_label
+from app.services.progress import ProgressReporter
+from app.services.rar_tools import RarPasswordVerifier
+from app.websocket.manager import ClientConnection, WebSocketManager
+from benchmarks.fake_redis import FakeRedis
+
+# Сценарии бенчмарка. Каждый вызывает те же функции, что воркер и процесс API, с локальными подменами:
+# FakeRedis вместо Redis, SQLite (DATABASE_URL задает run.py) и сгенерированные архивы.
+# Скорости - медиана repeat замеров длительностью duration секунд.
+
+GENERATION_BATCH_SIZE = 4096
+BENCH_TASK_ID = 1
+
+
+def _median(values: Sequence[float]) -> float:
+    return statistics.median(values)
+
+
+def _percentile(values: Sequence[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def _repeat(measure: Callable[[], float], repeat: int) -> float:
+    return _median([measure() for _ in range(repeat)])
+
+
+# --- Генерация и проверка кандидатов ---
+
+def generation_rate(space, duration: float) -> float:
+    """Кандидатов в секунду только на генерацию: пакеты заполняются и обходятся, но не проверяются."""
+    batch = space.new_batch(MAX_BATCH_SIZE)
+    candidates = 0
+    rank = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < duration:
+        next_rank = space.next_batch(batch, rank, space.size, GENERATION_BATCH_SIZE)
+        for _ in batch:
+            pass
+        candidates += len(batch)
+        rank = next_rank if next_rank < space.size else 0 # Короткое пространство (словарь) обходится по кругу
+    return candidates / (time.perf_counter() - started)
+
+
+def search_rate(verifier, space, duration: float, on_tick: Optional[Callable[[int, int, float], bool]] = None,
+                interval: float = 1.0) -> float:
+    """Кандидатов в секунду в цикле перебора воркера (_search_range) с ProgressReporter."""
+    deadline = time.perf_counter() + duration
+    with ProgressReporter(on_tick or (lambda processed, checked_until, cps: False), interval).start(0) as reporter:
+        started = time.perf_counter()
+        _search_range(verifier, space, 0, space.size, reporter, should_stop=lambda: time.perf_counter() >= deadline)
+        elapsed = time.perf_counter() - started
+    return reporter.candidates / elapsed
+
+
+class NullVerifier:
+    """Проверка без затрат: в замере остаются генерация кандидатов и отчет о прогрессе."""
+
+    def check(self, password) -> bool:
+        return False
+
+
+def bench_generation(spaces: Dict[str, Dict[str, Any]], duration: float, repeat: int) -> Dict[str, Any]:
+    results = {}
+    for name, space_args in spaces.items():
+        space = build_candidate_space(**space_args)
+        try:
+            results[name] = {"candidates_per_second": _repeat(lambda: generation_rate(space, duration), repeat)}
+        finally:
+            space.close()
+    return results
+
+
+def bench_verification(archives: Dict[str, str], space_args: Dict[str, Any], duration: float, repeat: int) -> Dict[str, Any]:
+    results = {}
+    for name, rar_path in archives.items():
+        verifier = RarPasswordVerifier(rar_path, confirm_with_unrar=False)
+        space = build_candidate_space(**space_args)
+        try:
+            results[name] = {"mode": verifier.mode,
+                             "candidates_per_second": _repeat(lambda: search_rate(verifier, space, duration), repeat)}
+        finally:
+            space.close()
+            verifier.close()
+    return results
+
+
+# --- Отчет о прогрессе ---
+
+def make_worker_tick(redis_client: FakeRedis, space, task_id: int = BENCH_TASK_ID) -> Callable[[int, int, float], bool]:
+    """Тик прогресса, как on_tick в bruteforce_rar_task (без контрольных точек - они раз в минуты)."""
+    task_id_str = str(task_id)
+    worker_label = process_label()
+    total_combinations = space.size
+    state = {"last_db_progress": None}
+
+    def on_tick(processed: int, checked_until: int, cps: float) -> bool:
+        metrics.set_gauge("rar_candidates_per_second", cps, worker=worker_label, task_id=task_id_str, shard=0)
+        total_processed, total_cps = _report_shard_progress(redis_client, task_id_str, 0, processed, cps)
+        progress_percentage = min(int((total_processed / total_combinations) * 100), 100) if total_combinations > 0 else 0
+        current_password = space.password_at(checked_until - 1).decode("utf-8", errors="replace") if checked_until > 0 else None
+        progress_message = {
+            "status": "PROGRESS", "task_id": task_id_str, "progress": progress_percentage,
+            "current_combination": current_password, "combinations_per_second": round(total_cps, 2)
+        }
+        followers = task_followers(redis_client, task_id_str)
+        _publish_notification_to_redis(redis_client, task_id_str, progress_message, followers)
+        if progress_percentage != state["last_db_progress"]:
+            _update_task_status(redis_client, task_id, "running", progress_percentage, followers=followers)
+            state["last_db_progress"] = progress_percentage
+        return False
+
+    return on_tick
+
+
+def bench_progress(redis_client: FakeRedis, space_args: Dict[str, Any], ticks: int, tick_interval: float, duration: float, repeat: int) -> Dict[str, Any]:
+    """Стоимость одного тика прогресса и замедление цикла перебора от тиков с частотой 1/tick_interval."""
+    space = build_candidate_space(**space_args)
+    try:
+        on_tick = make_worker_tick(redis_client, space)
+        step = max(space.size // ticks, 1)
+        durations = []
+        for i in range(1, ticks + 1):
+            started = time.perf_counter()
+            on_tick(i * step, i * step, 1000.0)
+            durations.append(time.perf_counter() - started)
+
+        verifier = NullVerifier()
+        quiet_rates, ticking_rates = [], []
+        for _ in range(repeat):
+            # Замеры чередуются, чтобы дрейф скорости машины одинаково влиял на оба. Без отчета - тот же
+            # интервал с пустым тиком: размер пакета подстраивается под CPS одинаково в обоих замерах
+            quiet_rates.append(search_rate(verifier, space, duration, interval=tick_interval))
+            ticking_rates.append(search_rate(verifier, space, duration, make_worker_tick(redis_client, space), tick_interval))
+        quiet_rate, ticking_rate = _median(quiet_rates), _median(ticking_rates)
+    finally:
+        space.close()
+    return {
+        "tick_mean_seconds": statistics.fmean(durations),
+        "tick_p99_seconds": _percentile(durations, 0.99),
+        "tick_interval_seconds": tick_interval,
+        "quiet_candidates_per_second": quiet_rate,
+        "ticking_candidates_per_second": ticking_rate,
+        "overhead_percent": (1 - ticking_rate / quiet_rate) * 100 if quiet_rate else 0.0,
+    }
+
+
+# --- Запись в БД ---
+
+def _create_tasks(rows: int) -> List[int]:
+    create_missing_tables()
+    with engine.begin() as connection:
+        connection.execute(task_table.delete())
+        connection.execute(task_table.insert(), [
+            {"id": task_id, "hash": "bench", "file_path": "bench.rar", "charset": "abc", "max_length": 4,
+             "status": "running", "progress": 0}
+            for task_id in range(1, rows + 1)
+        ])
+    return list(range(1, rows + 1))
+
+
+async def _timed_writes(task_ids: Sequence[int], write: Callable[[int], Any]) -> float:
+    started = time.perf_counter()
+    for task_id in task_ids:
+        await write(task_id)
+    return len(task_ids) / (time.perf_counter() - started)
+
+
+async def _async_db_writes(task_ids: Sequence[int], repeat: int) -> Dict[str, float]:
+    await celery_db_instance.connect()
+    try:
+        for task_id in task_ids:
+            await load_checkpoint(task_id, 0, 0, 1_000_000)
+        checkpoint_rates, status_rates = [], []
+        for round_index in range(repeat):
+            checkpoint_rates.append(await _timed_writes(task_ids, lambda task_id: save_checkpoint(task_id, 0, 1000 + round_index)))
+            status_rates.append(await _timed_writes(
+                task_ids, lambda task_id: update_task_db_status(task_id, "completed", 100, result=f"pw{round_index}")
+            ))
+    finally:
+        await celery_db_instance.disconnect()
+    return {"checkpoint_writes_per_second": _median(checkpoint_rates),
+            "final_status_writes_per_second": _median(status_rates)}
+
+
+def bench_db(rows: int, repeat: int) -> Dict[str, Any]:
+    """Пакетная запись прогресса ProgressWriter, контрольные точки и итоговые статусы (по одной записи)."""
+    task_ids = _create_tasks(rows)
+    writer = ProgressWriter(interval=3600) # Пишем только явным flush()
+    batch_seconds = []
+    try:
+        for round_index in range(1, repeat + 1):
+            for task_id in task_ids:
+                writer.queue(task_id, "running", round_index)
+            started = time.perf_counter()
+            writer.flush()
+            batch_seconds.append(time.perf_counter() - started)
+    finally:
+        writer.close()
+    batch_time = _median(batch_seconds)
+    return {
+        "rows": rows,
+        "progress_batch_seconds": batch_time,
+        "progress_rows_per_second": rows / batch_time,
+        **asyncio.run(_async_db_writes(task_ids, repeat)),
+    }
+
+
+# --- Рассылка WebSocket ---
+
+class BenchWebSocket:
+    """Клиент WebSocket, который только отмечает время получения сообщения."""
+
+    def __init__(self, tracker: "DeliveryTracker"):
+        self._tracker = tracker
+
+    async def send_text(self, text: str):
+        self._tracker.delivered(time.perf_counter())
+
+    async def send_bytes(self, data: bytes):
+        self._tracker.delivered(time.perf_counter())
+
+    async def close(self, code: Optional[int] = None):
+        pass
+
+
+class DeliveryTracker:
+    def __init__(self):
+        self.times: List[float] = []
+        self.expected = 0
+        self.done = asyncio.Event()
+
+    def reset(self, expected: int):
+        self.times = []
+        self.expected = expected
+        self.done.clear()
+
+    def delivered(self, at: float):
+        self.times.append(at)
+        if len(self.times) >= self.expected:
+            self.done.set()
+
+
+async def _broadcast(redis_client: FakeRedis, clients: int, rounds: int, binary: bool) -> Dict[str, Any]:
+    task_id_str = str(BENCH_TASK_ID)
+    manager = WebSocketManager()
+    redis_client.subscribe(manager._dispatch) # Как слушатель pubsub: каждая публикация сразу раскладывается по клиентам
+    tracker = DeliveryTracker()
+    connections = manager.active_connections.setdefault(task_id_str, {})
+    for _ in range(clients):
+        websocket = BenchWebSocket(tracker)
+        connection = ClientConnection(websocket, task_id_str, manager._drop_slow_client, binary=binary)
+        connection.replay([]) # Журнал пуст - уведомления из канала идут сразу
+        connections[websocket] = connection
+    await asyncio.sleep(0) # Задачи отправки клиентов запущены и ждут сообщений
+
+    latencies, fanouts = [], []
+    try:
+        for round_index in range(rounds):
+            tracker.reset(clients)
+            published = time.perf_counter()
+            # Не PROGRESS: прогресс клиенту ограничен WS_PROGRESS_MAX_RATE, события уходят сразу
+            _publish_notification_to_redis(redis_client, task_id_str, {"status": "STARTED", "task_id": task_id_str,
+                                                                       "round": round_index}, followers=[])
+            await tracker.done.wait()
+            latencies.extend(at - published for at in tracker.times)
+            fanouts.append(max(tracker.times) - published)
+    finally:
+        redis_client.unsubscribe(manager._dispatch)
+        for connection in list(connections.values()):
+            await connection.close()
+    return {
+        "clients": clients,
+        "rounds": rounds,
+        "latency_p50_seconds": _percentile(latencies, 0.5),
+        "latency_p99_seconds": _percentile(latencies, 0.99),
+        "fanout_seconds": _median(fanouts),
+        "fanout_max_seconds": max(fanouts),
+    }
+
+
+def bench_websocket(redis_client: FakeRedis, client_counts: Sequence[int], rounds: int) -> Dict[str, Any]:
+    """
+    Задержка от публикации уведомления до отправки каждому из clients клиентов одной задачи:
+    clients_N - клиенты с кадрами JSON, clients_N_msgpack - с бинарными кадрами.
+    redis_client - подмена, в которую пишет notifier процесса (ее задает run.py).
+    """
+    results = {}
+    for clients in client_counts:
+        results[f"clients_{clients}"] = asyncio.run(_broadcast(redis_client, clients, rounds, binary=False))
+        results[f"clients_{clients}_msgpack"] = asyncio.run(_broadcast(redis_client, clients, rounds, binary=True))
+    return results
@@ -1,10 +1,12 @@
 # main.py
 from fastapi import FastAPI
 from app.api.routes import router
-from app.db.database import database, engine, metadata # Убедись, что это твоя основная БД
+from app.db.database import database, engine, metadata, create_missing_tables # Убедись, что это твоя основная БД
 from contextlib import asynccontextmanager
 import logging
 from app.websocket.manager import ws_manager # твой WebSocketManager
+from app.services.metrics import metrics # Метрики процесса для /metrics
+from app.services.estimator import check_shard_time_budget # Согласованность бюджета задач и visibility_timeout
 import asyncio
 
 logging.basicConfig(level=logging.INFO)
@@ -13,6 +15,7 @@ logger = logging.getLogger(__name__)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Lifespan: Запуск приложения...")
+    check_shard_time_budget() # Несогласованные настройки - приложение не запускается
     
     # Инициализация WebSocketManager (включая Redis и слушателя)
     logger.info("Lifespan: Инициализация WebSocketManager...")
@@ -29,6 +32,7 @@ async def lifespan(app: FastAPI):
     try:
         await database.connect()
         # metadata.create_all(engine) # Обычно для разработки, чтобы создать таблицы. Будь осторожен в продакшене.
+        create_missing_tables() # Служебные таблицы (контрольные точки перебора)
         logger.info("Lifespan: База данных успешно подключена.")
     except Exception as e:
         logger.error(f"Lifespan: Ошибка подключения к базе данных: {e}", exc_info=True)
@@ -63,6 +67,8 @@ async def lifespan(app: FastAPI):
         except Exception as e_r_close:
             logger.error(f"Lifespan: Ошибка закрытия соединения WebSocketManager с Redis: {e_r_close}")
     
+    metrics.close() # Дописываем накопленные метрики процесса
+
     if database.is_connected:
         logger.info("Lifespan: Отключение от базы данных...")
         await database.disconnect()
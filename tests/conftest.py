@@ -0,0 +1,65 @@
+# tests/conftest.py
+import os
+import tempfile
+import pytest
+
+# Тесты работают со своей временной БД SQLite, а не с test.db или DATABASE_URL окружения:
+# адрес читается при импорте конфигурации, поэтому задается до импорта app
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='rar-tests-'), 'tasks.db')}"
+
+from app.db.database import create_missing_tables, engine, metadata
+from app.services.keyspace import split_keyspace
+
+
+def _enumerate(space, batch_size: int, shards: int = 1):
+    """Кандидаты пространства по пакетам и шардам - в том порядке, в каком их проверит воркер."""
+    candidates = []
+    for start, end in split_keyspace(space.size, shards):
+        for batch in space.iter_batches(start, end, batch_size):
+            candidates.extend(bytes(candidate) for candidate in batch)
+    return candidates
+
+
+def _assert_bijection(space):
+    """
+    Ранг <-> кандидат: password_at и rank_of взаимно обратны, пакеты (в т.ч. по границам шардов)
+    дают ровно ту же последовательность, что и password_at по рангам. Возвращает пароли по порядку рангов.
+    """
+    passwords = [space.password_at(rank) for rank in range(space.size)]
+    assert len(set(passwords)) == space.size
+    assert [space.rank_of(password) for password in passwords] == list(range(space.size))
+    for batch_size, shards in ((1, 1), (7, 3), (64, 5)):
+        assert _enumerate(space, batch_size, shards) == passwords
+    return passwords
+
+
+@pytest.fixture
+def enumerate_space():
+    return _enumerate
+
+
+@pytest.fixture
+def assert_bijection():
+    return _assert_bijection
+
+
+@pytest.fixture
+def db():
+    """Чистые таблицы временной БД (синхронный движок воркеров)."""
+    create_missing_tables()
+    yield engine
+    with engine.begin() as connection:
+        for table in reversed(metadata.sorted_tables):
+            connection.execute(table.delete())
+
+
+@pytest.fixture
+def redis_server():
+    """
+    Redis в памяти (fakeredis) с настоящим выполнением Lua (lupa): скрипты проверяются как есть.
+    Возвращает (синхронный клиент воркеров, асинхронный клиент FastAPI) на одних данных.
+    """
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    server = fakeredis.FakeServer()
+    return fakeredis.FakeRedis(server=server), fakeredis.FakeAsyncRedis(server=server)
@@ -0,0 +1,109 @@
+# tests/test_admission.py
+import json
+import pytest
+from sqlalchemy import select
+from app.core.config import settings
+from app.db.database import task_table
+from app.services import admission, dispatch
+from app.services.admission import DEFERRED_QUEUE_KEY, admit_deferred_tasks
+from app.services.dispatch import effective_shard_count
+from app.services.estimator import JobEstimate, check_shard_time_budget, required_shards
+
+
+def _estimate(candidates: int, cps_per_slot: float = 1000.0) -> JobEstimate:
+    return JobEstimate(keyspace=candidates, candidates=candidates, cps_per_slot=cps_per_slot, slots=4, measured=True)
+
+
+def test_required_shards_fit_shard_time_budget(monkeypatch):
+    monkeypatch.setattr(settings, "SHARD_MAX_SECONDS", 100.0)
+    assert required_shards(_estimate(50_000)) == 1
+    assert required_shards(_estimate(100_000)) == 1
+    assert required_shards(_estimate(100_001)) == 2
+    assert required_shards(_estimate(1_000_000)) == 10
+
+
+def test_effective_shard_count(monkeypatch):
+    monkeypatch.setattr(settings, "BRUTEFORCE_MIN_SHARD_SIZE", 1000)
+    monkeypatch.setattr(settings, "BRUTEFORCE_MAX_SHARDS", 16)
+    assert effective_shard_count(10_000, 4) == 4
+    assert effective_shard_count(2_500, 8) == 3 # Мельче BRUTEFORCE_MIN_SHARD_SIZE не делим...
+    assert effective_shard_count(2_500, 1, min_shards=5) == 5 # ...если только шард иначе не успеет до передоставки
+    assert effective_shard_count(10**9, 1, min_shards=100) == 16
+    assert effective_shard_count(3, 8, min_shards=5) == 3
+
+
+def test_check_shard_time_budget(monkeypatch):
+    monkeypatch.setattr(settings, "BROKER_VISIBILITY_TIMEOUT", 1000)
+    monkeypatch.setattr(settings, "SHARD_MAX_SECONDS", 500.0)
+    monkeypatch.setattr(settings, "CLUSTER_WORKER_SLOTS", 4)
+    monkeypatch.setattr(settings, "BRUTEFORCE_MAX_SHARDS", 8)
+    monkeypatch.setattr(settings, "ADMISSION_MAX_ESTIMATED_SECONDS", 1000.0)
+    check_shard_time_budget() # 1000 * 4 / 8 = 500 с на шард - укладывается
+    monkeypatch.setattr(settings, "ADMISSION_MAX_ESTIMATED_SECONDS", 1001.0)
+    with pytest.raises(RuntimeError):
+        check_shard_time_budget()
+    monkeypatch.setattr(settings, "ADMISSION_MAX_ESTIMATED_SECONDS", 10.0)
+    monkeypatch.setattr(settings, "SHARD_MAX_SECONDS", 1000.0)
+    with pytest.raises(RuntimeError):
+        check_shard_time_budget()
+
+
+@pytest.fixture
+def deferred(db, redis_server, monkeypatch):
+    """Очередь отложенных задач: (добавить задачу, статусы задач в БД, отправленные задачи)."""
+    sync_client, _ = redis_server
+    monkeypatch.setattr(admission, "shared_redis", lambda: sync_client)
+    monkeypatch.setattr(settings, "ADMISSION_MAX_ACTIVE_TASKS", 2)
+    dispatched = []
+    monkeypatch.setattr(dispatch, "dispatch_bruteforce", lambda task_id, **kwargs: dispatched.append(task_id))
+
+    def add(task_id: int, status: str = "deferred"):
+        with db.begin() as connection:
+            connection.execute(task_table.insert().values(id=task_id, status=status, progress=0))
+        sync_client.rpush(DEFERRED_QUEUE_KEY, json.dumps({"task_id": task_id, "rar_path": "a.rar", "charset": "ab",
+                                                          "max_length": 2, "shards": 1}))
+
+    def statuses():
+        with db.connect() as connection:
+            return {row.id: row.status for row in connection.execute(select(task_table))}
+
+    return add, statuses, dispatched, sync_client
+
+
+def test_admit_deferred_skips_cancelled_and_respects_limit(deferred):
+    add, statuses, dispatched, sync_client = deferred
+    add(1, status="cancelled") # Отменена, пока ждала в очереди
+    add(2)
+    add(3)
+    add(4)
+    assert admit_deferred_tasks() == 2
+    assert dispatched == [2, 3]
+    assert statuses() == {1: "cancelled", 2: "pending", 3: "pending", 4: "deferred"}
+    assert sync_client.llen(DEFERRED_QUEUE_KEY) == 1
+
+
+def test_failed_dispatch_is_deferred_again_unless_cancelled(deferred, monkeypatch):
+    add, statuses, dispatched, sync_client = deferred
+    cancel_during_dispatch = set()
+
+    def failing_dispatch(task_id, **kwargs):
+        if task_id in cancel_during_dispatch:
+            # Отмена пришла, пока задача отправлялась: возвращать ее в очередь нельзя
+            with admission.engine.begin() as connection:
+                connection.execute(task_table.update().where(task_table.c.id == task_id).values(status="cancelled"))
+        raise RuntimeError("брокер недоступен")
+
+    monkeypatch.setattr(dispatch, "dispatch_bruteforce", failing_dispatch)
+    add(1)
+    with pytest.raises(RuntimeError):
+        admit_deferred_tasks()
+    assert statuses()[1] == "deferred"
+    assert json.loads(sync_client.lindex(DEFERRED_QUEUE_KEY, 0))["task_id"] == 1
+
+    sync_client.delete(DEFERRED_QUEUE_KEY)
+    cancel_during_dispatch.add(2)
+    add(2)
+    with pytest.raises(RuntimeError):
+        admit_deferred_tasks()
+    assert statuses()[2] == "cancelled"
+    assert sync_client.llen(DEFERRED_QUEUE_KEY) == 0
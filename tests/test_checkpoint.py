@@ -0,0 +1,25 @@
+# tests/test_checkpoint.py
+import asyncio
+from app.celery.celery import celery_db_instance
+from app.services.bruteforce import delete_checkpoints, load_checkpoint, save_checkpoint
+
+
+def test_checkpoint_resume(db):
+    async def scenario():
+        try:
+            # Первый запуск шарда создает контрольную точку в начале диапазона
+            assert await load_checkpoint(7, 1, 100, 200) == 100
+            await save_checkpoint(7, 1, 150)
+            # Передоставка того же шарда продолжает с сохраненного ранга, другие шарды независимы
+            assert await load_checkpoint(7, 1, 100, 200) == 150
+            assert await load_checkpoint(7, 0, 0, 100) == 0
+            # Диапазон шарда изменился (задачу разбили заново) - старая точка не применяется
+            assert await load_checkpoint(7, 1, 100, 300) == 100
+            await save_checkpoint(7, 1, 300)
+            assert await load_checkpoint(7, 1, 100, 300) == 300
+            await delete_checkpoints(7)
+            assert await load_checkpoint(7, 1, 100, 300) == 100
+        finally:
+            await celery_db_instance.disconnect()
+
+    asyncio.run(scenario())
@@ -0,0 +1,64 @@
+# tests/test_dedupe.py
+import asyncio
+from app.services.dedupe import (
+    JOB_KEY_TTL, attach_to_running_job, clear_followers, detach_follower, followers_key, get_followers,
+    get_primary_task, job_key, primary_key, refresh_jobs, register_job, release_job, task_followers, task_job_key,
+)
+
+
+def test_attach_detach_release(redis_server):
+    sync_client, async_client = redis_server
+
+    async def scenario():
+        assert await attach_to_running_job(async_client, "fp", 2) is None # Такой задачи еще нет
+        assert await register_job(async_client, "fp", 1)
+        assert not await register_job(async_client, "fp", 9) # Уже зарегистрирована - нужно присоединиться
+        assert await attach_to_running_job(async_client, "fp", 2) == 1
+        assert await attach_to_running_job(async_client, "fp", 3) == 1
+        assert sorted(await get_followers(async_client, "1")) == [2, 3]
+        assert await get_primary_task(async_client, "2") == "1"
+        assert await get_primary_task(async_client, "1") is None
+
+        # Отмена последователя отсоединяет только его
+        await detach_follower(async_client, "3", "1")
+        assert task_followers(sync_client, "1") == [2]
+        assert await get_primary_task(async_client, "3") is None
+
+        # Завершение основной задачи: новые такие же задачи больше не присоединяются, уже присоединенные получают итог
+        release_job(sync_client, "1")
+        assert await attach_to_running_job(async_client, "fp", 4) is None
+        assert task_followers(sync_client, "1") == [2]
+        clear_followers(sync_client, "1")
+        assert task_followers(sync_client, "1") == []
+        assert await get_primary_task(async_client, "2") is None
+
+    asyncio.run(scenario())
+
+
+def test_release_keeps_job_key_of_newer_task(redis_server):
+    sync_client, async_client = redis_server
+
+    async def scenario():
+        assert await register_job(async_client, "fp", 1)
+        await async_client.delete(job_key("fp")) # Ключ истек...
+        assert await register_job(async_client, "fp", 5) # ...и такую же задачу уже перебирает другая
+        release_job(sync_client, "1")
+        assert await attach_to_running_job(async_client, "fp", 6) == 5
+
+    asyncio.run(scenario())
+
+
+def test_refresh_extends_keys_of_running_job(redis_server):
+    sync_client, async_client = redis_server
+
+    async def scenario():
+        await register_job(async_client, "fp", 1)
+        await attach_to_running_job(async_client, "fp", 2)
+
+    asyncio.run(scenario())
+    keys = [job_key("fp"), task_job_key("1"), followers_key("1"), primary_key("2")]
+    for key in keys:
+        sync_client.expire(key, 5)
+    refresh_jobs(sync_client, ["1"])
+    assert [sync_client.ttl(key) > 5 for key in keys] == [True] * len(keys)
+    assert max(sync_client.ttl(key) for key in keys) <= JOB_KEY_TTL
@@ -0,0 +1,58 @@
+# tests/test_events.py
+import asyncio
+import json
+import pytest
+from app.services.events import (
+    LEGACY_STREAM_FIELD, PUBLISH_EVENT_SCRIPT, decode_published, events_key, publish_event_args, read_events, ws_channel,
+)
+from app.services.websocket_client import decode_frame
+from app.websocket.manager import OutgoingMessage
+
+MESSAGE = {"type": "PROGRESS", "task_id": 7, "progress": 42, "status": "Перебор"}
+
+
+def test_published_frame_round_trip(redis_server):
+    sync_client, _ = redis_server
+    pubsub = sync_client.pubsub()
+    pubsub.subscribe(ws_channel("7"))
+    pubsub.get_message(timeout=1) # Подтверждение подписки
+
+    keys, args = publish_event_args("7", MESSAGE)
+    event_id = sync_client.eval(PUBLISH_EVENT_SCRIPT, len(keys), *keys, *args).decode("utf-8")
+    frame = pubsub.get_message(timeout=1)["data"]
+    assert decode_published(frame) == ("7", event_id, MESSAGE)
+
+
+def test_legacy_json_envelope():
+    data = json.dumps({"task_id": "7", "event_id": "1-0", "message": MESSAGE}).encode("utf-8")
+    assert decode_published(data) == ("7", "1-0", MESSAGE)
+
+
+@pytest.mark.parametrize("frame", [b"\x09\x01" + b"7", b"\x02\x05" + b"7", b"\x02\x01" + b"7\x03" + b"1-0" + b"\xc1"])
+def test_corrupt_frame(frame):
+    with pytest.raises(ValueError):
+        decode_published(frame)
+
+
+def test_read_events_mixed_formats(redis_server):
+    sync_client, async_client = redis_server
+    # Запись прежнего формата, сделанная до обновления воркеров, затем новая
+    legacy_id = sync_client.xadd(events_key("7"), {LEGACY_STREAM_FIELD: json.dumps({"type": "STATUS"})}).decode("utf-8")
+    legacy_snapshot = asyncio.run(read_events(async_client, "7"))
+    keys, args = publish_event_args("7", MESSAGE)
+    event_id = sync_client.eval(PUBLISH_EVENT_SCRIPT, len(keys), *keys, *args).decode("utf-8")
+
+    async def scenario():
+        return await read_events(async_client, "7", legacy_id), await read_events(async_client, "7")
+
+    after_legacy, snapshot = asyncio.run(scenario())
+    assert legacy_snapshot == [(legacy_id, {"type": "STATUS"}, True)]
+    assert after_legacy == [(event_id, MESSAGE, False)]
+    assert snapshot == [(event_id, MESSAGE, True)]
+
+
+def test_client_decodes_both_subprotocols():
+    outgoing = OutgoingMessage(MESSAGE)
+    assert outgoing.packed is outgoing.packed # Кодируется один раз
+    assert decode_frame(outgoing.packed) == MESSAGE
+    assert decode_frame(outgoing.text) == MESSAGE
@@ -0,0 +1,38 @@
+# tests/test_keyspace.py
+import itertools
+import pytest
+from app.services.keyspace import CandidateSpace, keyspace_size, split_keyspace
+
+
+def test_charset_space(assert_bijection):
+    space = CandidateSpace.from_charset("abc", 3)
+    assert space.size == keyspace_size("abc", 3) == 3 + 9 + 27
+    passwords = assert_bijection(space)
+    assert passwords[:5] == [b"a", b"b", b"c", b"aa", b"ab"]
+    assert passwords[-1] == b"ccc"
+
+
+def test_charset_space_multibyte_symbols(assert_bijection):
+    space = CandidateSpace.from_charset("aя€", 2)
+    passwords = assert_bijection(space)
+    assert {password.decode("utf-8") for password in passwords} == {
+        "".join(p) for n in (1, 2) for p in itertools.product("aя€", repeat=n)}
+
+
+def test_rank_of_foreign_password():
+    space = CandidateSpace.from_charset("01", 2)
+    with pytest.raises(ValueError):
+        space.rank_of(b"0a")
+    with pytest.raises(ValueError):
+        space.rank_of(b"010")
+    with pytest.raises(IndexError):
+        space.password_at(space.size)
+
+
+@pytest.mark.parametrize("total, shards", [(10, 3), (2, 5), (0, 4), (1000, 7)])
+def test_split_keyspace(total, shards):
+    ranges = split_keyspace(total, shards)
+    assert ranges[0][0] == 0 and ranges[-1][1] == total
+    assert all(end == next_start for (_, end), (next_start, _) in zip(ranges, ranges[1:]))
+    sizes = [end - start for start, end in ranges]
+    assert max(sizes) - min(sizes) <= 1
@@ -0,0 +1,58 @@
+# tests/test_markov.py
+import pytest
+from app.core.config import settings
+from app.services.keyspace import CandidateSpace, build_candidate_space
+from app.services.markov import MarkovModel, train_model_file
+from app.services.rar_tools import file_sha256
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    path = tmp_path / "corpus.txt"
+    path.write_text("cab\ncba\ncca\nbac\nc\n", encoding="utf-8")
+    return str(path)
+
+
+@pytest.fixture
+def model_path(tmp_path, monkeypatch, corpus):
+    monkeypatch.setattr(settings, "MARKOV_MODEL_DIR", str(tmp_path / "models"))
+    return train_model_file(corpus)
+
+
+@pytest.mark.parametrize("mode", ["frequency", "markov"])
+def test_ordered_space(model_path, assert_bijection, mode):
+    plain = CandidateSpace.from_charset("abc", 3)
+    ordered = build_candidate_space("abc", 3, ordering=mode, ordering_model=model_path)
+    passwords = assert_bijection(ordered)
+    # Та же совокупность паролей и те же размеры длин, другой порядок: самые частые символы - первыми
+    assert sorted(passwords) == sorted(plain.password_at(rank) for rank in range(plain.size))
+    assert [segment.size for segment in ordered.segments] == [segment.size for segment in plain.segments]
+    assert passwords[0] == b"c"
+
+
+def test_markov_uses_transitions(model_path):
+    space = build_candidate_space("abc", 2, ordering="markov", ordering_model=model_path)
+    two_chars = [space.password_at(rank) for rank in range(3, space.size)]
+    # Первый символ по частоте - c. Переходы из "c" (cab, cba, cca) равны, поэтому дальше решают
+    # частота на второй позиции (a - дважды) и общая частота символа (c чаще b)
+    assert two_chars[:3] == [b"ca", b"cc", b"cb"]
+
+
+def test_ordering_requires_model():
+    with pytest.raises(ValueError):
+        build_candidate_space("abc", 2, ordering="markov")
+    with pytest.raises(ValueError):
+        build_candidate_space("abc", 2, ordering="random", ordering_model="model.json")
+
+
+def test_model_file_named_by_corpus_sha256(model_path, corpus):
+    assert model_path.endswith(f"{file_sha256(corpus)}.json")
+    assert train_model_file(corpus) == model_path # Повторное обучение на том же корпусе не нужно
+
+
+def test_model_json_round_trip(corpus):
+    model = MarkovModel.train(corpus)
+    restored = MarkovModel.from_json(model.to_json())
+    assert restored.position_counts == model.position_counts
+    assert restored.transition_counts == model.transition_counts
+    assert restored.total_counts == model.total_counts
@@ -0,0 +1,48 @@
+# tests/test_mask.py
+import pytest
+from app.services.keyspace import CandidateSpace, HybridSpace, parse_mask
+from benchmarks.fixtures import make_wordlist
+
+
+def test_mask_space(assert_bijection):
+    space = CandidateSpace.from_mask("?1x?d", {"1": "ab"})
+    passwords = assert_bijection(space)
+    assert space.size == 2 * 10
+    assert passwords[0] == b"ax0" and passwords[-1] == b"bx9"
+
+
+@pytest.mark.parametrize("mask", ["", "?", "?z", "?1"])
+def test_parse_mask_errors(mask):
+    with pytest.raises(ValueError):
+        parse_mask(mask)
+
+
+@pytest.mark.parametrize("mode", ["append", "prepend"])
+def test_hybrid_space(tmp_path, enumerate_space, mode):
+    path = make_wordlist(str(tmp_path / "words.txt"), 20)
+    words = [line for line in open(path, "rb").read().split(b"\n") if line]
+    mask = parse_mask("?d?1", {"1": "xy"})
+    space = HybridSpace(path, mask, mode)
+    try:
+        suffixes = [d + s for d in mask[0] for s in mask[1]]
+        expected = [word + suffix if mode == "append" else suffix + word for word in words for suffix in suffixes]
+        for batch_size, shards in ((1, 1), (7, 3), (33, 4), (500, 2)):
+            # Ранги гибрида - смещения в словаре * размер маски: шарды режут слова посередине маски
+            assert enumerate_space(space, batch_size, shards) == expected
+        # password_at - для ранга внутри слова (на строке слова)
+        line_start = len(words[0]) + 1
+        assert space.password_at(line_start * space.mask_size + 3) == expected[len(suffixes) + 3]
+    finally:
+        space.close()
+
+
+def test_hybrid_space_skips_empty_lines(tmp_path, enumerate_space):
+    path = tmp_path / "words.txt"
+    path.write_bytes(b"ab\r\n\n\ncd\n\nx")
+    space = HybridSpace(str(path), parse_mask("?d"))
+    try:
+        expected = [word + str(digit).encode() for word in (b"ab", b"cd", b"x") for digit in range(10)]
+        for batch_size, shards in ((1, 1), (3, 5), (50, 13)):
+            assert enumerate_space(space, batch_size, shards) == expected
+    finally:
+        space.close()
@@ -0,0 +1,43 @@
+# tests/test_progress_writer.py
+from sqlalchemy import select
+from app.db.database import task_table
+from app.db.progress_writer import ProgressWriter
+
+
+def _insert(db, statuses):
+    with db.begin() as connection:
+        for task_id, status in statuses.items():
+            connection.execute(task_table.insert().values(id=task_id, status=status, progress=0))
+
+
+def _rows(db):
+    with db.connect() as connection:
+        return {row.id: (row.status, row.progress) for row in connection.execute(select(task_table))}
+
+
+def test_batched_update_skips_protected_statuses(db):
+    _insert(db, {1: "pending", 2: "running", 3: "paused", 4: "deferred", 5: "completed", 6: "cancelled"})
+    writer = ProgressWriter(interval=3600)
+    try:
+        for task_id in range(1, 8): # Задачи 7 в БД нет - пакет ее просто пропускает
+            writer.queue(task_id, "running", 42)
+        writer.flush()
+    finally:
+        writer.close()
+    # Запоздалый прогресс шарда не возвращает в running приостановленную, отложенную или завершенную задачу
+    assert _rows(db) == {1: ("running", 42), 2: ("running", 42), 3: ("paused", 0), 4: ("deferred", 0),
+                         5: ("completed", 0), 6: ("cancelled", 0)}
+
+
+def test_latest_progress_wins_and_discard(db):
+    _insert(db, {1: "running", 2: "running"})
+    writer = ProgressWriter(interval=3600)
+    try:
+        writer.queue(1, "running", 10)
+        writer.queue(1, "running", 20)
+        writer.queue(2, "running", 30)
+        writer.discard(2) # Итоговый статус задачи 2 пишется мимо пакета
+        writer.flush()
+    finally:
+        writer.close()
+    assert _rows(db) == {1: ("running", 20), 2: ("running", 0)}
@@ -0,0 +1,122 @@
+# tests/test_rar_tools.py
+import struct
+import zlib
+import pytest
+import rarfile
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from app.services import rar_tools
+from app.services.rar_tools import (
+    MODE_RAR3_HEADERS, MODE_RAR3_STORED, MODE_RAR5_CHECK_VALUE, MODE_UNRAR,
+    RarPasswordVerifier, VerificationPlan, analyze_archive, rar3_s2k,
+)
+from benchmarks.fixtures import make_rar3_archive, make_rar5_archive
+
+# Архивы из benchmarks/fixtures.py: заголовки шифрования без самого rar. unrar не нужен -
+# проверка только в памяти (confirm_with_unrar=False).
+PASSWORD = "s3cret"
+
+
+def _verifier(path: str) -> RarPasswordVerifier:
+    return RarPasswordVerifier(path, confirm_with_unrar=False)
+
+
+def test_rar5_check_value(tmp_path):
+    path = make_rar5_archive(str(tmp_path / "a.rar"), PASSWORD, kdf_count=1)
+    verifier = _verifier(path)
+    assert verifier.mode == MODE_RAR5_CHECK_VALUE
+    assert verifier.check(PASSWORD)
+    assert verifier.check(PASSWORD.encode("utf-8")) # Кандидат из пакета - bytes
+    assert not verifier.check("s3creT")
+    assert not verifier.check("")
+
+
+def test_rar5_check_value_non_ascii(tmp_path):
+    password = "пароль"
+    verifier = _verifier(make_rar5_archive(str(tmp_path / "a.rar"), password, kdf_count=0))
+    assert verifier.check(memoryview(password.encode("utf-8")))
+    assert not verifier.check("Пароль")
+
+
+def test_rar5_corrupted_check_value_sum_falls_back_to_unrar(tmp_path):
+    path = make_rar5_archive(str(tmp_path / "a.rar"), PASSWORD, kdf_count=1)
+    data = bytearray(open(path, "rb").read())
+    data[-1] ^= 0xFF # Последний байт - контрольная сумма проверочного значения
+    open(path, "wb").write(bytes(data))
+    assert analyze_archive(path).mode == MODE_UNRAR
+
+
+def test_rar3_headers(tmp_path):
+    path = make_rar3_archive(str(tmp_path / "a.rar"), PASSWORD)
+    verifier = _verifier(path)
+    assert verifier.mode == MODE_RAR3_HEADERS
+    assert verifier.check(PASSWORD)
+    assert not verifier.check("secret")
+
+
+def test_rar3_headers_crc_mismatch(tmp_path):
+    path = make_rar3_archive(str(tmp_path / "a.rar"), PASSWORD)
+    plan = analyze_archive(path)
+    data = bytearray(open(path, "rb").read())
+    data[plan.data_offset + 16] ^= 0x01 # Второй блок AES: тип и размер в первом блоке целы, CRC - нет
+    open(path, "wb").write(bytes(data))
+    assert not _verifier(path).check(PASSWORD)
+
+
+@pytest.mark.parametrize("password", ["", "a", "s3cret", "пароль", "x" * 28])
+def test_rar3_s2k_matches_rarfile(password):
+    salt = bytes(range(8))
+    assert rar3_s2k(password, salt) == rarfile.rar3_s2k(password, salt)
+
+
+def test_rar3_s2k_long_seed_uses_rarfile(monkeypatch):
+    # Сид длиннее 64 байт (пароль от 29 символов) - там проявляется ошибка SHA1 из RAR3, считает rarfile
+    calls = []
+    original = rarfile.rar3_s2k
+    monkeypatch.setattr(rar_tools.rarfile, "rar3_s2k", lambda password, salt: calls.append(password) or original(password, salt))
+    salt = bytes(range(8))
+    assert rar3_s2k("x" * 28, salt) == original("x" * 28, salt)
+    assert calls == []
+    assert rar3_s2k("x" * 29, salt) == original("x" * 29, salt)
+    assert calls == ["x" * 29]
+
+
+def _stored_archive(path, password: str, content: bytes):
+    """Шифртекст несжатого файла и план rar3_stored для него (разбор настоящего архива нужен только analyze_archive)."""
+    salt = bytes(range(8, 16))
+    key, iv = rar3_s2k(password, salt)
+    padded = content + bytes(-len(content) % 16)
+    encryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).encryptor()
+    prefix = b"\0" * 32
+    with open(path, "wb") as f:
+        f.write(prefix + encryptor.update(padded) + encryptor.finalize())
+    return VerificationPlan(sha256="0" * 64, rar_version=3, headers_encrypted=False, mode=MODE_RAR3_STORED,
+                            salt=salt.hex(), data_offset=len(prefix), data_size=len(padded),
+                            file_size=len(content), file_crc=zlib.crc32(content) & 0xFFFFFFFF)
+
+
+def test_rar3_stored_crc(tmp_path):
+    path = str(tmp_path / "a.rar")
+    plan = _stored_archive(path, PASSWORD, b"stored member" * 5)
+    verifier = RarPasswordVerifier(path, plan=plan, confirm_with_unrar=False)
+    assert verifier.check(PASSWORD)
+    assert not verifier.check("wrong")
+
+
+def test_rar3_stored_data_shorter_than_plan(tmp_path):
+    path = str(tmp_path / "a.rar")
+    plan = _stored_archive(path, PASSWORD, b"stored member")
+    plan.data_size += 16
+    with pytest.raises(rar_tools.ArchiveRejected):
+        RarPasswordVerifier(path, plan=plan, confirm_with_unrar=False)
+
+
+def test_plan_json_round_trip(tmp_path):
+    plan = analyze_archive(make_rar3_archive(str(tmp_path / "a.rar"), PASSWORD))
+    assert VerificationPlan.from_json(plan.to_json()) == plan
+
+
+def test_not_rar_rejected(tmp_path):
+    path = tmp_path / "a.rar"
+    path.write_bytes(struct.pack("<L", 0) * 8)
+    with pytest.raises(rar_tools.ArchiveRejected):
+        analyze_archive(str(path))
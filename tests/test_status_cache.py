@@ -0,0 +1,53 @@
+# tests/test_status_cache.py
+import asyncio
+from app.services.status_cache import (
+    cache_task_status, decode_status, get_cached_statuses, populate_statuses, status_key,
+)
+
+
+def _cached(sync_client, task_id: int):
+    raw = sync_client.hgetall(status_key(task_id))
+    return decode_status(task_id, raw) if raw else None
+
+
+def test_progress_does_not_override_paused_or_deferred(redis_server):
+    sync_client, _ = redis_server
+    cache_task_status(sync_client, [1], "running", None)
+    assert _cached(sync_client, 1) is None # Без прогресса строку не создаем - ее возьмут из БД
+
+    cache_task_status(sync_client, [1, 2], "running", 10)
+    cache_task_status(sync_client, [1], "paused", None)
+    cache_task_status(sync_client, [2], "deferred", None)
+    cache_task_status(sync_client, [1, 2], "running", 20) # Запоздалый прогресс шарда
+    assert _cached(sync_client, 1)["status"] == "paused"
+    assert _cached(sync_client, 2)["status"] == "deferred"
+
+    cache_task_status(sync_client, [1], "running", None) # resume
+    assert _cached(sync_client, 1) == {"task_id": 1, "status": "running", "progress": 10, "result": None}
+
+
+def test_final_status_is_kept(redis_server):
+    sync_client, _ = redis_server
+    cache_task_status(sync_client, [1], "completed", 100, result="")
+    cache_task_status(sync_client, [1], "running", 50)
+    assert _cached(sync_client, 1) == {"task_id": 1, "status": "completed", "progress": 100, "result": ""}
+    cache_task_status(sync_client, [1], "failed", None) # Итоговый статус итоговым заменить можно
+    assert _cached(sync_client, 1)["status"] == "failed"
+
+
+def test_populate_does_not_override_worker_status(redis_server):
+    sync_client, async_client = redis_server
+    cache_task_status(sync_client, [1], "running", 70)
+
+    async def scenario():
+        await populate_statuses(async_client, [
+            {"task_id": 1, "status": "running", "progress": 40, "result": None}, # Строка БД старее кэша
+            {"task_id": 2, "status": "completed", "progress": 100, "result": "pass"},
+        ])
+        return await get_cached_statuses(async_client, [1, 2, 3])
+
+    cached = asyncio.run(scenario())
+    assert cached == {
+        1: {"task_id": 1, "status": "running", "progress": 70, "result": None},
+        2: {"task_id": 2, "status": "completed", "progress": 100, "result": "pass"},
+    }
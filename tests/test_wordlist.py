@@ -0,0 +1,28 @@
+# tests/test_wordlist.py
+from app.services.wordlist import WordlistSpace, build_mangler, parse_rules
+
+
+def test_wordlist_space(tmp_path, enumerate_space):
+    path = tmp_path / "words.txt"
+    path.write_bytes(b"alpha\r\n\nbeta\ngamma")
+    space = WordlistSpace(str(path))
+    try:
+        # Ранг - смещение строки: шарды режут файл по байтам, но каждая строка достается ровно одному шарду
+        for batch_size, shards in ((1, 1), (2, 3), (10, 7)):
+            assert enumerate_space(space, batch_size, shards) == [b"alpha", b"beta", b"gamma"]
+        assert space.password_at(8) == b"beta"
+    finally:
+        space.close()
+
+
+def test_wordlist_rules(tmp_path, enumerate_space):
+    path = tmp_path / "words.txt"
+    path.write_bytes(b"pass\n")
+    rules = parse_rules("case,digits")
+    space = WordlistSpace(str(path), rules)
+    try:
+        candidates = enumerate_space(space, 1000)
+        assert candidates == build_mangler(rules)(memoryview(b"pass"))
+        assert b"pass" in candidates and b"Pass" in candidates and b"pass1" in candidates
+    finally:
+        space.close()